@@ -9,12 +9,35 @@ import os
 import sys
 import traceback
 import queue
+import hashlib
+import socket
+import sqlite3
+import zlib
+import re
+import functools
 import tkinter as tk
 from datetime import datetime
 from dotenv import load_dotenv, set_key
-from concurrent.futures import ThreadPoolExecutor, as_completed
+from collections import OrderedDict, deque
+from concurrent.futures import Future, as_completed
 import socketio
 
+import wire
+from lldp_parser import parse_lldp, parse_serial
+from config_templates import render_commands
+from vendors import resolve_vendor
+from backup_delta import backup_header, render_backup, encode_sections
+from credential_vault import session_keypair, session_cipher, unseal, payload_devices
+from config_push import PushTransaction, apply_push, cli_error, flatten_commands
+from latency_stats import LatencyStats
+from topology_delta import TopologyCache, topology_delta
+from topology_crawl import CRAWL_MAX_DEPTH, CRAWL_MAX_DEVICES, CrawlFrontier
+from rollout import ROLLOUT_DEFAULTS, RolloutProgress, plan_waves
+from job_journal import JobJournal
+from job_control import CANCELLED_OUTPUT, SHUTDOWN_OUTPUT, JobControl
+from device_sessions import DeviceSessions, is_read_only
+from show_cache import DEFAULT_ALLOW, ShowCache
+
 try:
     import pystray
     from PIL import Image, ImageDraw
@@ -130,133 +153,174 @@ F_TS      = (F_MONO, 11, "bold") # ทำตัวหนาให้เวลา
 #   Agent Core Logic (runs in background thread)
 # ─────────────────────────────────────────────
 
+# ─────────────────────────────────────────────
+#   Adaptive timeouts (เรียนรู้จาก latency จริงของแต่ละ device/command)
+# ─────────────────────────────────────────────
+DATA_DIR       = os.path.dirname(CONFIG_PATH)
+LATENCY_PATH   = os.path.join(DATA_DIR, 'agent_latency.json')
+CONNECT_KEY    = '__connect__'
+TCP_KEY        = '__tcp__'
+
+
+LATENCY = LatencyStats(LATENCY_PATH)
+
+
+def device_password(device) -> str:
+    if 'password' not in device and device.get('credential_id'):
+        # ยังไม่ได้ credential จาก server — อย่าลอง login ด้วย password ว่าง (โดน lock account)
+        raise PermissionError(f"credential set {device['credential_id']} unavailable")
+    return device['password']
+
+
 def get_device_driver(device):
+    host = device['ip_address']
+    # เครื่องที่เคย login เร็ว จะได้ timeout สั้นลง (แต่ไม่เกินค่าเดิม)
+    connect_t = LATENCY.timeout_for(host, CONNECT_KEY, default=15, floor=5, ceiling=15)
     return {
         'device_type': device['device_type'],
-        'host':        device['ip_address'],
+        'host':        host,
         'username':    device['username'],
-        'password':    device['password'],
+        'password':    device_password(device),
         'secret':      device.get('secret', ''),
         'port':        int(device.get('port', 22)),
         'global_delay_factor': 0.5,
-        'fast_cli':    True,
-        'banner_timeout': 15,
-        'timeout':        10,
-        'auth_timeout':   15,
+        'fast_cli':    resolve_vendor(device['device_type']).pipelining,
+        'conn_timeout':   min(connect_t, 10),
+        'banner_timeout': connect_t,
+        'timeout':        min(connect_t, 10),
+        'auth_timeout':   connect_t,
     }
 
+
+def tcp_precheck(host: str, port: int):
+    """Fail fast when the SSH port does not answer, instead of waiting for the SSH timeouts."""
+    timeout = LATENCY.timeout_for(host, TCP_KEY, default=3, floor=1, ceiling=3)
+    t0 = time.monotonic()
+    try:
+        sock = socket.create_connection((host, port), timeout=timeout)
+        sock.close()
+    except OSError as e:
+        raise ConnectionError(f"TCP {host}:{port} unreachable ({e})")
+    LATENCY.record(host, TCP_KEY, time.monotonic() - t0)
+
+
+def connect_device(device):
+    """Open a netmiko session after a quick TCP check, recording login latency."""
+    from netmiko import ConnectHandler
+    host = device['ip_address']
+    tcp_precheck(host, int(device.get('port', 22)))
+    t0 = time.monotonic()
+    conn = ConnectHandler(**get_device_driver(device))
+    LATENCY.record(host, CONNECT_KEY, time.monotonic() - t0)
+    return conn
+
+
+# ─────────────────────────────────────────────
+#   Per-device sessions (ตัวจำกัด slot / coalesce อยู่ใน device_sessions.py)
+# ─────────────────────────────────────────────
+DEVICE_SESSION_LIMIT = int(os.getenv('DEVICE_SESSION_LIMIT', '2'))
+SESSIONS = DeviceSessions(DEVICE_SESSION_LIMIT)
+
+
+def device_session(fn):
+    """Run a device task (first argument = device) inside one of that device's session slots."""
+    @functools.wraps(fn)
+    def wrapper(device, *args, **kwargs):
+        with SESSIONS.slot(device):
+            return fn(device, *args, **kwargs)
+    return wrapper
+
+
+# ─────────────────────────────────────────────
+#   Show-command cache (ตัว cache อยู่ใน show_cache.py)
+# ─────────────────────────────────────────────
+SHOW_CACHE_TTL   = float(os.getenv('SHOW_CACHE_TTL', '15'))
+SHOW_CACHE_ALLOW = os.getenv('SHOW_CACHE_ALLOW', DEFAULT_ALLOW)    # regex คั่นด้วย ;
+SHOW_CACHE = ShowCache(SHOW_CACHE_TTL, SHOW_CACHE_ALLOW)
+
+
+def invalidates_show_cache(fn):
+    """Drop the device's cached show output before and after a task that may change it."""
+    @functools.wraps(fn)
+    def wrapper(device, *args, **kwargs):
+        SHOW_CACHE.invalidate(device)
+        try:
+            return fn(device, *args, **kwargs)
+        finally:
+            SHOW_CACHE.invalidate(device)
+    return wrapper
+
+
+def send_timed(conn, device, command: str, default_timeout: float, **kwargs):
+    """send_command with a learned read_timeout; the old fixed value stays the upper bound."""
+    host = device['ip_address']
+    read_timeout = LATENCY.timeout_for(host, command, default_timeout)
+    t0 = time.monotonic()
+    try:
+        return conn.send_command(command, read_timeout=read_timeout, **kwargs)
+    finally:
+        # บันทึกแม้ timeout เพื่อให้ค่าที่เรียนรู้ขยับขึ้นในรอบถัดไป
+        LATENCY.record(host, command, time.monotonic() - t0)
+
 def get_backup_commands(device_type):
     """ คืนค่ารายการคำสั่งดึง config และสถานะการทำงาน (Operational State) ตาม vendor """
-    dtype = device_type.lower()
-    
-    # ── Cisco / Aruba (IOS-like) ──
-    if "cisco" in dtype or "aruba" in dtype:
-        return [
-            ("Running Configuration", "show running-config"),
-            ("Version & Uptime", "show version"),
-            ("Interface Status", "show ip interface brief"),
-            ("LLDP Neighbors", "show lldp neighbors detail" if "cisco" not in dtype else "show lldp neighbors"),
-            ("CDP Neighbors", "show cdp neighbors detail"),
-            ("MAC Address Table", "show mac address-table"),
-            ("ARP Table", "show ip arp"),
-            ("Routing Table", "show ip route")
-        ]
-        
-    # ── HPE ProVision / ArubaOS-Switch ──
-    elif "hp_procurve" in dtype or "provision" in dtype:
-        return [
-            ("Running Configuration", "show running-config"),
-            ("Version & Uptime", "show version"),
-            ("Interface Status", "show interfaces brief"),
-            ("LLDP Neighbors", "show lldp info remote-device detail"),
-            ("MAC Address Table", "show mac-address"),
-            ("ARP Table", "show arp"),
-            ("Routing Table", "show ip route")
-        ]
-        
-    # ── HP / Comware / Huawei ──
-    elif "hp" in dtype or "comware" in dtype or "huawei" in dtype:
-        return [
-            ("Current Configuration", "display current-configuration"),
-            ("Version & Uptime", "display version"),
-            ("Interface Status", "display ip interface brief"),
-            ("LLDP Neighbors", "display lldp neighbor-information verbose"),
-            ("MAC Address Table", "display mac-address"),
-            ("ARP Table", "display arp"),
-            ("Routing Table", "display ip routing-table")
-        ]
-        
-    # ── Juniper ──
-    elif "juniper" in dtype:
-        return [
-            ("Configuration", "show configuration"),
-            ("Version & Uptime", "show version"),
-            ("Interface Status", "show interfaces terse"),
-            ("LLDP Neighbors", "show lldp neighbors"),
-            ("ARP Table", "show arp"),
-            ("Routing Table", "show route")
-        ]
-        
-    # ── Fortinet ──
-    elif "fortinet" in dtype:
-        return [
-            ("Full Configuration", "show full-configuration"),
-            ("System Status", "get system status"),
-            ("Interface Status", "get system interface physical"),
-            ("ARP Table", "get system arp"),
-            ("Routing Table", "get router info routing-table all")
-        ]
-        
-    # ── Default Fallback ──
-    return [("Running Configuration", "show running-config")]
+    return list(resolve_vendor(device_type).backup_commands)
 
-def task_backup(device):
-    from netmiko import ConnectHandler
-    import time
+@device_session
+def task_backup(device, cancel: Optional[threading.Event] = None):
     try:
-        net_connect = ConnectHandler(**get_device_driver(device))
+        net_connect = connect_device(device)
         
         commands = get_backup_commands(device['device_type'])
-        full_output = f"=== NETWORK AUDIT BACKUP FOR {device.get('hostname', 'UNKNOWN')} ===\n"
-        full_output += f"Timestamp: {time.strftime('%Y-%m-%d %H:%M:%S')}\n\n"
+        header = backup_header(device.get('hostname', 'UNKNOWN'), time.strftime('%Y-%m-%d %H:%M:%S'))
+        sections = []
         
         for section_name, cmd in commands:
-            full_output += f"\n{'='*60}\n"
-            full_output += f"👉 {section_name} ({cmd})\n"
-            full_output += f"{'='*60}\n"
+            # ✅ job ถูกยกเลิก → ปล่อย session ทันที ไม่รอครบทุกคำสั่ง
+            if cancel is not None and cancel.is_set():
+                net_connect.disconnect()
+                return {'status': 'Cancelled', 'output': CANCELLED_OUTPUT}
             try:
-                out = net_connect.send_command(cmd, read_timeout=90)
-                full_output += out + "\n"
+                out = send_timed(net_connect, device, cmd, 90)
             except Exception as e:
-                full_output += f"[Error executing command: {str(e)}]\n"
+                out = f"[Error executing command: {str(e)}]"
+            sections.append((section_name, cmd, out))
                 
         net_connect.disconnect()
-        return {'status': 'Success', 'output': full_output}
+        # sections แยกไว้ให้ส่งแบบ hash / diff ได้ (output เต็มยังใช้กับ server รุ่นเก่า)
+        return {'status': 'Success', 'output': render_backup(header, sections),
+                'header': header, 'sections': sections}
     except Exception as e:
         import traceback
         traceback.print_exc()
         return {'status': 'Failed', 'output': str(e)}
 
-def task_push_config(device, commands):
-    from netmiko import ConnectHandler
-    hostname = device.get('hostname', 'unknown')
+# ─────────────────────────────────────────────
+#   Transactional push (snapshot → push → verify → commit | rollback) — logic อยู่ใน config_push.py
+# ─────────────────────────────────────────────
+@invalidates_show_cache
+@device_session
+def task_push_config(device, commands, transactional=False, verify_commands=None):
+    net_connect = None
+    txn = None
     try:
-        flat = []
-        if isinstance(commands, str):
-            commands = [commands]
-        for cmd in commands:
-            for sub in str(cmd).split('\n'):
-                if sub.strip():
-                    flat.append(sub.strip())
-
-        net_connect = ConnectHandler(**get_device_driver(device))
+        flat = flatten_commands(commands)
+        net_connect = connect_device(device)
         # 1. เช็คและเข้า Enable Mode เสมอ (ถ้ามันยังไม่ได้เข้า)
         try:
             if not net_connect.check_enable_mode():
                 net_connect.enable()
         except Exception as e:
             pass
-            
+
+        # 1.5 ✅ transactional: เก็บ snapshot ก่อนแก้ (ใช้ session เดิม)
+        if transactional:
+            pending = PushTransaction(net_connect, device,
+                                      send=lambda conn, cmd, timeout: send_timed(conn, device, cmd, timeout),
+                                      reconnect=lambda: connect_device(device))
+            pending.begin()
+            txn = pending
+
         # 2. บังคับเข้า Config Mode ไปเลยเพื่อป้องกัน Error "Failed to enter configuration mode"
         try:
             if not net_connect.check_config_mode():
@@ -264,31 +328,56 @@ def task_push_config(device, commands):
         except Exception as e:
             pass
 
-        output = net_connect.send_config_set(flat, read_timeout=90)
-
-        save_out = ''
-        dtype = device.get('device_type', '').lower()
-        save_cmd = None
-        if "cisco" in dtype or "aruba" in dtype:
-            save_cmd = "write memory"
-        elif "hp" in dtype or "comware" in dtype or "huawei" in dtype:
-            save_cmd = "save force"
-        if save_cmd:
-            save_out = net_connect.send_command(save_cmd, read_timeout=60)
-
-        net_connect.disconnect()
-        return {'status': 'Success', 'output': output,
-                'save_output': save_out, 'commands_applied': flat}
+        # 3. push → verify → commit | rollback (config_push.apply_push)
+        save_cmd = resolve_vendor(device.get('device_type', '')).save_command
+        save = (lambda: send_timed(net_connect, device, save_cmd, 60)) if save_cmd else None
+        return apply_push(net_connect, flat, txn, verify_commands, save)
     except Exception as e:
         traceback.print_exc()
         return {'status': 'Failed', 'output': str(e),
                 'save_output': '', 'commands_applied': []}
+    finally:
+        # rollback อาจเปิด session ใหม่ (txn.conn) — ปิดทั้งตัวเดิมและตัวใหม่
+        conns = [net_connect] + ([txn.conn] if txn and txn.conn is not net_connect else [])
+        for conn in conns:
+            if conn is None:
+                continue
+            try:
+                conn.disconnect()
+            except Exception:
+                pass
 
-def task_run_command(device, command):
-    from netmiko import ConnectHandler
+def task_run_command(device, command, max_age: Optional[float] = None):
+    """max_age: oldest cached output the caller accepts in seconds (0 = always ask the device)."""
+    if not is_read_only(command):
+        return _run_write_command(device, command)
+    cacheable = SHOW_CACHE.cacheable(command)
+    if cacheable:
+        cached = SHOW_CACHE.get(device, command, max_age)
+        if cached:
+            return cached
+    # show/display ชุดเดียวกันบนเครื่องเดียวกันที่ยังรันอยู่ → รอผลเดียวกัน ไม่เปิด session ซ้อน
+    return SESSIONS.coalesce(device, command, lambda: _read_through(device, command, cacheable))
+
+
+def _read_through(device, command, cacheable):
+    generation = SHOW_CACHE.generation(device)
+    result = dict(_run_command(device, command), cached=False)
+    if cacheable and result['status'] == 'Success':
+        SHOW_CACHE.put(device, command, result, generation)
+    return result
+
+
+@invalidates_show_cache
+def _run_write_command(device, command):
+    return _run_command(device, command)
+
+
+@device_session
+def _run_command(device, command):
     try:
-        net_connect = ConnectHandler(**get_device_driver(device))
-        output = net_connect.send_command(command, read_timeout=120)
+        net_connect = connect_device(device)
+        output = send_timed(net_connect, device, command, 120)
         net_connect.disconnect()
         return {'status': 'Success', 'output': output}
     except Exception as e:
@@ -296,10 +385,474 @@ def task_run_command(device, command):
         return {'status': 'Failed', 'output': str(e)}
 
 
+# ─────────────────────────────────────────────
+#   Topology cache (S/N + LLDP fingerprint ต่อ device — logic อยู่ใน topology_delta.py)
+# ─────────────────────────────────────────────
+TOPOLOGY_CACHE_PATH = os.path.join(DATA_DIR, 'agent_topology_cache.json')
+TOPOLOGY_CACHE      = TopologyCache(TOPOLOGY_CACHE_PATH)
+
+
+@device_session
+def task_topology(device, known_fingerprint: Optional[str] = None):
+    """Run LLDP + S/N on one device and return parsed structured data (full table or delta)."""
+    hostname = device.get('hostname', '?')
+    ip       = device.get('ip_address', '')
+    vendor   = resolve_vendor(device.get('device_type', ''))
+
+    try:
+        if not vendor.lldp_format:
+            raise ValueError(f"LLDP topology not supported for {vendor.name}")
+        conn     = connect_device(device)
+
+        try:
+            real_hostname = vendor.hostname_from_prompt(conn.find_prompt())
+        except:
+            real_hostname = hostname
+
+        lldp_raw = send_timed(conn, device, vendor.lldp_command, 60)
+        # ✅ ใช้ S/N จาก cache ถ้ายังไม่หมดอายุ ไม่ต้องยิงคำสั่งซ้ำ
+        sn = TOPOLOGY_CACHE.fresh_serial(ip)
+        sn_raw = '' if sn else send_timed(conn, device, vendor.serial_command, 60)
+        conn.disconnect()
+
+        # ── Parse S/N + LLDP (lldp_parser: precompiled per-vendor tables) ──
+        if sn_raw:
+            sn = parse_serial(sn_raw)
+        neighbors = [n.to_dict() for n in parse_lldp(lldp_raw, vendor.lldp_format)]
+
+        if sn_raw and sn:
+            TOPOLOGY_CACHE.update(ip, sn=sn, sn_at=time.time())
+        result = {
+        'hostname': real_hostname, 
+        'ip': ip, 
+        'device_id': device.get('_id'),
+        'sn': sn,
+        'neighbors': neighbors, 
+        'neighbor_count': len(neighbors),
+        'status': 'Success', 
+        'error': ''
+        }
+        result.update(topology_delta(TOPOLOGY_CACHE, ip, neighbors, known_fingerprint))
+        return result
+
+    except Exception as e:
+        return {
+            'hostname': hostname, 
+            'ip': ip, 
+            'sn': '',
+            'neighbors': [], 
+            'status': 'Failed', 
+            'error': str(e)
+        }
+
+
+# ─────────────────────────────────────────────
+#   Reachability pre-scan (TCP sweep ก่อนส่งงานเข้า worker)
+# ─────────────────────────────────────────────
+PRESCAN_TIMEOUT     = 2.0
+# ไม่ใช่ลิมิตของ OS (asyncio บน Windows ใช้ proactor / IOCP ไม่มีเพดาน select()) —
+# ทุก probe คือ TCP connect เข้า SSH daemon ของ device จริง: ยิงเป็น burst ใหญ่ sshd / VTY
+# จะตัด connection ที่ยังไม่ login (MaxStartups, login block) และ AAA / firewall ปลายทางเห็นเป็นการสแกน
+PRESCAN_CONCURRENCY = 500
+
+
+def prescan_reachable(devices, timeout: float = PRESCAN_TIMEOUT,
+                      concurrency: int = PRESCAN_CONCURRENCY):
+    """
+    Non-blocking TCP connect sweep to every device's SSH port.
+    Returns (reachable_devices, [(device, reason), ...]) preserving input order.
+    """
+    import asyncio
+
+    async def probe(dev, sem):
+        host = dev.get('ip_address')
+        if not host:
+            return "Missing ip_address"
+        port = int(dev.get('port', 22) or 22)
+        async with sem:
+            t0 = time.monotonic()
+            try:
+                _, writer = await asyncio.wait_for(asyncio.open_connection(host, port), timeout)
+            except asyncio.TimeoutError:
+                return f"TCP {host}:{port} timed out after {timeout:.0f}s"
+            except OSError as e:
+                return f"TCP {host}:{port} unreachable ({e})"
+            LATENCY.record(host, TCP_KEY, time.monotonic() - t0)
+            writer.close()
+            try:
+                # ปิดให้จบจริง ไม่งั้นค้าง half-closed + "unclosed transport" warning
+                await asyncio.wait_for(writer.wait_closed(), timeout)
+            except (asyncio.TimeoutError, OSError):
+                pass
+            return None
+
+    async def sweep():
+        sem = asyncio.Semaphore(concurrency)
+        return await asyncio.gather(*(probe(d, sem) for d in devices))
+
+    reasons = asyncio.run(sweep())
+    reachable   = [d for d, r in zip(devices, reasons) if r is None]
+    unreachable = [(d, r) for d, r in zip(devices, reasons) if r is not None]
+    return reachable, unreachable
+
+
+# ─────────────────────────────────────────────
+#   Login rate limit (กัน AAA / TACACS โดน login พร้อมกันหลายพันครั้ง)
+# ─────────────────────────────────────────────
+class LoginRateLimiter:
+    """Spaces out SSH logins to at most `rate` per second across all worker threads."""
+
+    def __init__(self, rate=None):
+        self.interval = 1.0 / float(rate) if rate else 0.0
+        self._lock = threading.Lock()
+        self._next = 0.0
+
+    def wait(self):
+        if not self.interval:
+            return
+        with self._lock:
+            now = time.monotonic()
+            slot = max(now, self._next)
+            self._next = slot + self.interval
+        if slot > now:
+            time.sleep(slot - now)
+
+    def call(self, fn, *args, **kwargs):
+        self.wait()
+        return fn(*args, **kwargs)
+
+
+# ─────────────────────────────────────────────
+#   Priority lanes (worker pool เดียวทั้ง agent — งาน interactive ไม่ต้องรอหลัง batch)
+# ─────────────────────────────────────────────
+LANES = ('interactive', 'push', 'backup', 'topology')     # ลำดับ = priority
+LANE_SLO = {'interactive': 2, 'push': 60, 'backup': 600, 'topology': 900}   # เวลารอคิวที่ยอมรับได้ (วินาที)
+INTERACTIVE_RESERVED = int(os.getenv('INTERACTIVE_WORKERS', '2'))
+
+
+def _pct(sorted_values, pct):
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(len(sorted_values) - 1, int(round(pct * (len(sorted_values) - 1))))]
+
+
+class LaneScheduler:
+    """
+    Shared worker pool with strict lane priority: a free worker always takes the oldest
+    item of the highest non-empty lane, so queued backups are overtaken by pushes and
+    terminal commands. `reserved` extra workers only serve the interactive lane.
+    Within a lane, jobs take turns; `limit` caps how many workers one job may hold.
+    """
+
+    def __init__(self, workers: int, reserved: int = INTERACTIVE_RESERVED):
+        self._cv      = threading.Condition()
+        self._queues  = {lane: OrderedDict() for lane in LANES}    # lane → job → deque of items
+        self._limits  = {}
+        self._running = {}                                         # job → workers in use
+        self._waits   = {lane: deque(maxlen=500) for lane in LANES}
+        self._counts  = {lane: {'done': 0, 'slo_miss': 0, 'running': 0} for lane in LANES}
+        self._stopped = False
+        for i in range(workers + reserved):
+            allowed = LANES if i < workers else ('interactive',)
+            threading.Thread(target=self._worker, args=(allowed,), daemon=True,
+                             name=f"lane-{'any' if i < workers else 'interactive'}-{i}").start()
+
+    def submit(self, lane: str, fn, *args, job=None, limit=None) -> Future:
+        fut = Future()
+        with self._cv:
+            if self._stopped:
+                fut.cancel()
+                return fut
+            key = job or f"_{lane}"
+            self._queues[lane].setdefault(key, deque()).append((fut, fn, args, time.monotonic()))
+            if limit:
+                self._limits[key] = limit
+            self._cv.notify_all()           # worker สำรองของ interactive หยิบงาน lane อื่นไม่ได้
+        return fut
+
+    def _next(self, allowed):
+        for lane in allowed:
+            pending = self._queues[lane]
+            for key in list(pending):
+                limit = self._limits.get(key)
+                if limit and self._running.get(key, 0) >= limit:
+                    continue
+                item = pending[key].popleft()
+                if pending[key]:
+                    pending.move_to_end(key)    # job ถัดไปใน lane เดียวกันได้คิวบ้าง
+                else:
+                    del pending[key]
+                self._running[key] = self._running.get(key, 0) + 1
+                self._counts[lane]['running'] += 1
+                return lane, key, item
+        return None
+
+    def _worker(self, allowed):
+        while True:
+            with self._cv:
+                picked = self._next(allowed)
+                while picked is None:
+                    if self._stopped:
+                        return
+                    self._cv.wait()
+                    picked = self._next(allowed)
+            lane, key, (fut, fn, args, queued_at) = picked
+            try:
+                if fut.set_running_or_notify_cancel():
+                    waited = time.monotonic() - queued_at
+                    with self._cv:
+                        self._waits[lane].append(waited)
+                        self._counts[lane]['done'] += 1
+                        self._counts[lane]['slo_miss'] += 1 if waited > LANE_SLO[lane] else 0
+                    try:
+                        fut.set_result(fn(*args))
+                    except BaseException as e:
+                        fut.set_exception(e)
+            finally:
+                with self._cv:
+                    self._running[key] -= 1
+                    self._counts[lane]['running'] -= 1
+                    if not self._running[key] and not any(key in q for q in self._queues.values()):
+                        self._running.pop(key, None)
+                        self._limits.pop(key, None)
+                    self._cv.notify_all()
+
+    def stats(self) -> dict:
+        """Per-lane queue depth and queue-wait latency against the lane SLO."""
+        with self._cv:
+            out = {}
+            for lane in LANES:
+                waits = sorted(self._waits[lane])
+                out[lane] = {
+                    'queued': sum(len(q) for q in self._queues[lane].values()),
+                    'running': self._counts[lane]['running'],
+                    'done': self._counts[lane]['done'],
+                    'slo_seconds': LANE_SLO[lane],
+                    'slo_miss': self._counts[lane]['slo_miss'],
+                    'p50_wait': round(_pct(waits, 0.5), 2),
+                    'p95_wait': round(_pct(waits, 0.95), 2),
+                    'max_wait': round(waits[-1], 2) if waits else 0.0,
+                }
+            return out
+
+    def summary(self) -> str:
+        parts = []
+        for lane, st in self.stats().items():
+            if st['done'] or st['queued']:
+                parts.append(f"{lane} p95 {st['p95_wait']:.1f}s"
+                             + (f" ({st['slo_miss']} > SLO)" if st['slo_miss'] else ""))
+        return "  |  ".join(parts) or "idle"
+
+    def shutdown(self):
+        """Stop the workers; anything still queued is cancelled."""
+        with self._cv:
+            self._stopped = True
+            for pending in self._queues.values():
+                for items in pending.values():
+                    for fut, *_ in items:
+                        fut.cancel()
+                pending.clear()
+            self._cv.notify_all()
+
+
+# ─────────────────────────────────────────────
+#   Rolling rollout — health check ระหว่าง wave (แบ่ง wave / abort อยู่ใน rollout.py)
+# ─────────────────────────────────────────────
+@device_session
+def task_health_check(device, commands):
+    """Post-push check: device still accepts SSH, and the verification commands run without errors."""
+    try:
+        conn = connect_device(device)
+    except Exception as e:
+        return False, f"unreachable after push: {e}"
+    try:
+        for cmd in commands:
+            out = send_timed(conn, device, cmd, 60)
+            if cli_error(out):
+                return False, f"'{cmd}' → {out.strip()[:200]}"
+        return True, ''
+    except Exception as e:
+        return False, f"health check failed: {e}"
+    finally:
+        try:
+            conn.disconnect()
+        except Exception:
+            pass
+
+
+def push_and_verify(device, commands, health_commands=None, transactional=False):
+    # transactional: health commands รันใน session เดิมก่อน save → fail แล้ว rollback ได้
+    res = task_push_config(device, commands, transactional=transactional,
+                           verify_commands=health_commands if transactional else None)
+    if res['status'] == 'Success' and health_commands is not None:
+        ok, reason = task_health_check(device, [] if transactional else health_commands)
+        if not ok:
+            res = dict(res, status='Failed', health_failed=True, output=f"Health check: {reason}")
+    return res
+
+
 # ─────────────────────────────────────────────
 #   Agent Thread
 # ─────────────────────────────────────────────
 
+# ─────────────────────────────────────────────
+#   Job journal (checkpoint ต่อ device ของ batch ใหญ่ — ตัว journal อยู่ใน job_journal.py)
+# ─────────────────────────────────────────────
+JOURNAL_PATH = os.path.join(DATA_DIR, 'agent_jobs.db')
+JOURNAL = JobJournal(JOURNAL_PATH)
+
+
+# ─────────────────────────────────────────────
+#   Result spool — ผลงาน (durable) ทุกชิ้นลง disk ก่อน แล้วส่งตามลำดับด้วย sio.call
+#   ลบออกเมื่อ server ack ว่าเก็บแล้วเท่านั้น (server หลุด / ประมวลผลพัง → ยังอยู่ รอส่งใหม่)
+# ─────────────────────────────────────────────
+SPOOL_PATH         = os.path.join(DATA_DIR, 'agent_spool.db')
+SPOOL_MAX_BYTES    = int(os.getenv('SPOOL_MAX_MB', '200')) * 1024 * 1024
+SPOOL_ACK_TIMEOUT  = 30
+SPOOL_RETRY_DELAY  = 30      # server ตอบ error / ไม่ ack → รอเท่านี้ก่อนลองใหม่
+SPOOL_MAX_ATTEMPTS = 5       # ผลที่ server ประมวลผลพังซ้ำๆ → ทิ้ง ไม่ให้ขวางคิวทั้งหมด
+TRANSIENT_RESULTS  = ('batch_config_wave', 'topology_crawl_progress', 'batch_resume')   # UI / handshake เท่านั้น ไม่ spool
+
+
+class ResultSpool:
+    """Bounded FIFO of zlib-compressed task results; oldest entries are dropped past max_bytes."""
+
+    def __init__(self, path: str, max_bytes: int):
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("""
+            CREATE TABLE IF NOT EXISTS spool (
+                seq INTEGER PRIMARY KEY AUTOINCREMENT, result_id TEXT UNIQUE,
+                body BLOB, size INTEGER, at REAL, attempts INTEGER DEFAULT 0
+            )
+        """)
+        cols = {row[1] for row in self._db.execute("PRAGMA table_info(spool)")}
+        if 'attempts' not in cols:     # spool จาก agent รุ่นก่อน
+            self._db.execute("ALTER TABLE spool ADD COLUMN attempts INTEGER DEFAULT 0")
+        self.count, self.bytes = self._db.execute(
+            "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM spool").fetchone()
+
+    def __len__(self):
+        return self.count
+
+    def put(self, data: dict) -> int:
+        """Append one result; returns how many old results had to be dropped to stay in bounds."""
+        body = zlib.compress(json.dumps(data, default=str, ensure_ascii=False).encode('utf-8'), 6)
+        dropped = 0
+        with self._lock:
+            cur = self._db.execute("INSERT OR IGNORE INTO spool (result_id, body, size, at) VALUES (?, ?, ?, ?)",
+                                   (data.get('result_id'), body, len(body), time.time()))
+            if cur.rowcount:
+                self.count += 1
+                self.bytes += len(body)
+            while self.bytes > self.max_bytes and self.count > 1:
+                seq, size = self._db.execute("SELECT seq, size FROM spool ORDER BY seq LIMIT 1").fetchone()
+                self._db.execute("DELETE FROM spool WHERE seq = ?", (seq,))
+                self.count -= 1
+                self.bytes -= size
+                dropped += 1
+        return dropped
+
+    def peek(self, limit: int = 50) -> list:
+        """Oldest results first: [(seq, data)]."""
+        with self._lock:
+            rows = self._db.execute("SELECT seq, body FROM spool ORDER BY seq LIMIT ?", (limit,)).fetchall()
+        return [(seq, json.loads(zlib.decompress(body))) for seq, body in rows]
+
+    def remove(self, seq: int):
+        with self._lock:
+            row = self._db.execute("SELECT size FROM spool WHERE seq = ?", (seq,)).fetchone()
+            if row:
+                self._db.execute("DELETE FROM spool WHERE seq = ?", (seq,))
+                self.count -= 1
+                self.bytes -= row[0]
+
+    def failed(self, seq: int) -> int:
+        """Count one rejected delivery of a result; returns its attempts so far."""
+        with self._lock:
+            self._db.execute("UPDATE spool SET attempts = attempts + 1 WHERE seq = ?", (seq,))
+            row = self._db.execute("SELECT attempts FROM spool WHERE seq = ?", (seq,)).fetchone()
+        return row[0] if row else 0
+
+
+SPOOL = ResultSpool(SPOOL_PATH, SPOOL_MAX_BYTES)
+
+
+# ─────────────────────────────────────────────
+#   Section index (section ล่าสุดที่ upload แล้วต่อ device — base ของการส่งแบบ hash / diff)
+# ─────────────────────────────────────────────
+SECTIONS_PATH = os.path.join(DATA_DIR, 'agent_sections.db')
+
+
+class SectionIndex:
+    """{device_id: {section: (hash, body)}} of the last backup the server accepted, bodies zlib-compressed."""
+
+    def __init__(self, path: str):
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("""
+            CREATE TABLE IF NOT EXISTS sections (
+                device_id TEXT, name TEXT, hash TEXT, body BLOB,
+                PRIMARY KEY (device_id, name)
+            )
+        """)
+
+    def get(self, device_id: str) -> dict:
+        with self._lock:
+            rows = self._db.execute("SELECT name, hash, body FROM sections WHERE device_id = ?",
+                                    (device_id,)).fetchall()
+        return {name: (h, zlib.decompress(body).decode('utf-8')) for name, h, body in rows}
+
+    def put(self, device_id: str, index: dict):
+        rows = [(device_id, name, h, zlib.compress(body.encode('utf-8'), 6)) for name, (h, body) in index.items()]
+        with self._lock:
+            self._db.execute("BEGIN")
+            self._db.execute("DELETE FROM sections WHERE device_id = ?", (device_id,))
+            self._db.executemany("INSERT INTO sections VALUES (?, ?, ?, ?)", rows)
+            self._db.execute("COMMIT")
+
+    def forget(self, device_id: str):
+        with self._lock:
+            self._db.execute("DELETE FROM sections WHERE device_id = ?", (device_id,))
+
+
+SECTIONS = SectionIndex(SECTIONS_PATH)
+
+
+# ─────────────────────────────────────────────
+#   Credential cache (credential set จาก vault ของ server — memory เท่านั้น ไม่ลง disk)
+# ─────────────────────────────────────────────
+CREDENTIAL_TTL = float(os.getenv('CREDENTIAL_TTL', '600'))
+
+
+class CredentialCache:
+    """Decrypted credential sets by id, each kept for `ttl` seconds after it was fetched."""
+
+    def __init__(self, ttl: float = CREDENTIAL_TTL):
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._items = {}                     # cred_id → (fetched_at, creds)
+
+    def get(self, cred_id: str):
+        with self._lock:
+            entry = self._items.get(cred_id)
+            if entry and time.monotonic() - entry[0] <= self.ttl:
+                return entry[1]
+            self._items.pop(cred_id, None)
+            return None
+
+    def put(self, cred_id: str, creds: dict):
+        with self._lock:
+            self._items[cred_id] = (time.monotonic(), creds)
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+
+
 class AgentThread(threading.Thread):
     def __init__(self, server_url: str, agent_key: str, max_workers: int,
                  log_queue: queue.Queue, status_callback):
@@ -310,6 +863,20 @@ class AgentThread(threading.Thread):
         self.log_q           = log_queue
         self.status_cb       = status_callback
         self.allowed_user    = None
+        self.codec           = None      # wire codec ที่ server ตกลงให้ใช้
+        self.wire_stats      = wire.WireStats()
+        self.lanes           = LaneScheduler(max_workers)   # worker pool เดียว แบ่งตาม priority lane
+        self._active_jobs    = set()     # job_id ที่กำลังรันอยู่ใน process นี้ (ไม่ต้องขอ resume)
+        self._jobs           = {}        # job_id → JobControl ของงานที่กำลังรัน
+        self._flush_lock     = threading.Lock()
+        self._spool_wake     = threading.Event()   # มีผลใหม่ใน spool → run() ส่งทันที
+        self._spool_retry_at = 0.0
+        self._section_lock   = threading.Lock()
+        self.section_delta   = False     # server รองรับ backup แบบ section hash / diff
+        self.credential_vault = False    # server ส่ง device แบบ credential_id
+        self.credentials     = CredentialCache()
+        self._vault_cipher   = None      # session key จาก X25519 ตอน auth (ใหม่ทุก connection)
+        self._vault_private  = None
         self._stop_event     = threading.Event()
         self.sio             = socketio.Client(
             reconnection=True,
@@ -322,6 +889,149 @@ class AgentThread(threading.Thread):
         ts = datetime.now().strftime("%H:%M:%S")
         self.log_q.put((ts, icon, msg))
 
+    def _send_backup(self, dev: dict, res: dict, owner, run_id=None, device_id=None, full=False) -> bool:
+        """
+        Backup result → server. A successful backup goes up as per-section hashes (unchanged)
+        or diffs (changed) against the last upload, when the server supports it.
+        """
+        device_id = device_id or dev.get('_id')
+        msg = {
+            'type': 'backup', 'status': res['status'],
+            'hostname': dev.get('hostname', '?'),
+            'device_id': device_id,
+            'owner': owner,
+            'run_id': run_id
+        }
+        if res['status'] != 'Success' or not res.get('sections') or not self.section_delta or not device_id:
+            msg['output'] = res['output']
+            return self._send_result(msg)
+
+        # lock ครอบ encode + ส่ง + อัปเดต index ให้ลำดับ base ตรงกับที่ server ได้รับ
+        with self._section_lock:
+            previous = {} if full else SECTIONS.get(device_id)
+            msg['header'] = res['header']
+            msg['sections'], index = encode_sections(res['sections'], previous)
+            sent = self._send_result(msg)
+            if sent:
+                SECTIONS.put(device_id, index)
+        return sent
+
+    def _online(self) -> bool:
+        return bool(self.allowed_user) and self.sio.connected
+
+    def _send_result(self, data: dict) -> bool:
+        """
+        Send a task_result, compressed when the server negotiated a codec.
+        Final results get an idempotency key and always go through the on-disk spool:
+        run() delivers them in order with an acked sio.call and removes each one only
+        after the server confirms it was stored. Progress / UI messages are plain emits.
+        Returns False only when the result was dropped (transient progress while offline).
+        """
+        durable = data.get('type') not in TRANSIENT_RESULTS and data.get('status') != 'Running'
+        if not durable:
+            if not self._online():
+                return False
+            try:
+                self.sio.emit('task_result', wire.pack(data, self.codec, stats=self.wire_stats, direction='up'))
+                return True
+            except Exception as e:
+                self._log("⚠️", f"Result not sent ({data.get('type')} {data.get('hostname', '')}): {e}")
+                return False
+
+        data.setdefault('result_id', os.urandom(12).hex())
+        data.setdefault('produced_at', time.time())
+        dropped = SPOOL.put(data)
+        if dropped:
+            self._log("⚠️", f"Spool full — dropped {dropped} oldest result(s)")
+        self._spool_wake.set()
+        return True
+
+    def _flush_spool(self, wait: bool = False):
+        """Deliver spooled results oldest-first; each one waits for the server ack before it is removed."""
+        if not self._flush_lock.acquire(blocking=wait):
+            return      # มี thread อื่นส่งอยู่แล้ว — มันจะเก็บตัวใหม่ไปด้วย
+        sent = 0
+        try:
+            while self._online():
+                rows = SPOOL.peek()
+                if not rows:
+                    break
+                for seq, data in rows:
+                    ack = self.sio.call('task_result',
+                                        wire.pack(data, self.codec, stats=self.wire_stats, direction='up'),
+                                        timeout=SPOOL_ACK_TIMEOUT)
+                    if isinstance(ack, dict) and ack.get('status') == 'error':
+                        # server เก็บไม่สำเร็จ (ปล่อย result_id คืนแล้ว) → เก็บไว้ส่งใหม่ จนกว่าจะเกินจำนวนครั้ง
+                        if SPOOL.failed(seq) >= SPOOL_MAX_ATTEMPTS:
+                            SPOOL.remove(seq)
+                            self._log("❌", f"Result {data.get('type')} {data.get('hostname', '')} dropped after "
+                                           f"{SPOOL_MAX_ATTEMPTS} server errors: {ack.get('error')}")
+                            continue
+                        raise RuntimeError(f"server error: {ack.get('error')}")
+                    SPOOL.remove(seq)
+                    sent += 1
+        except Exception as e:
+            self._spool_retry_at = time.monotonic() + SPOOL_RETRY_DELAY
+            self._log("⚠️", f"Result delivery paused ({len(SPOOL)} left, retry in {SPOOL_RETRY_DELAY}s): {e}")
+        finally:
+            self._flush_lock.release()
+            if sent > 1:
+                self._log("📤", f"Delivered {sent} queued result(s)")
+
+    def _after_auth(self, owner: str):
+        # spool ก่อน — server ต้องเห็นผลที่ค้างอยู่ก่อนคำนวณว่าเหลือเครื่องไหนให้ resume
+        if len(SPOOL):
+            self._log("📤", f"Replaying {len(SPOOL)} result(s) spooled while offline ...")
+            self._spool_retry_at = 0.0
+            self._flush_spool(wait=True)
+        if not len(SPOOL):
+            self._request_resume(owner)
+
+    def _request_resume(self, owner: str):
+        """After (re)authorizing, ask the server to resend whatever our journal still has open."""
+        for job_id, task_type, total, done in JOURNAL.unfinished(owner):
+            if job_id in self._active_jobs:
+                continue
+            self._log("♻️", f"Resume {task_type} run {job_id}  →  {len(done)}/{total} done before stop")
+            self._send_result({
+                'type': 'batch_resume', 'job_type': task_type,
+                'run_id': job_id, 'done': done, 'owner': owner,
+            })
+
+    def _hydrate_credentials(self, payload):
+        """Fill username / password / secret of devices that only carry a credential_id."""
+        devices = [d for d in payload_devices(payload) if d.get('credential_id') and 'password' not in d]
+        if not devices:
+            return
+        wanted = {d['credential_id'] for d in devices}
+        found = {}
+        for cid in wanted:
+            creds = self.credentials.get(cid)
+            if creds:
+                found[cid] = creds
+        missing = sorted(wanted - set(found))
+        if missing:
+            try:
+                reply = self.sio.call('get_credentials', {'ids': missing}, timeout=30) or {}
+                for cid, token in (reply.get('credentials') or {}).items():
+                    found[cid] = unseal(self._vault_cipher, token)
+                    self.credentials.put(cid, found[cid])
+            except Exception as e:
+                self._log("🔑", f"Credential fetch failed ({len(missing)} set(s)): {e}")
+        for d in devices:
+            if d['credential_id'] in found:
+                d.update(found[d['credential_id']])
+
+    def _prescan(self, devices, payload):
+        """Split devices into (reachable, unreachable) before they reach the worker pool."""
+        if len(devices) < 2 or not payload.get('prescan', True):
+            return devices, []   # งานเดี่ยวใช้ tcp_precheck ใน connect_device แทน
+        t0 = time.monotonic()
+        reachable, unreachable = prescan_reachable(devices)
+        self._log("📡", f"Pre-scan  →  {len(reachable)} reachable  |  "
+                        f"{len(unreachable)} down  ({time.monotonic() - t0:.1f}s)")
+        return reachable, unreachable
+
     def _setup_events(self):
         sio = self.sio
 
@@ -329,7 +1039,13 @@ class AgentThread(threading.Thread):
         def connect():
             self._log("🔌", f"Connected → Server")
             self.status_cb("connecting", None)
-            sio.emit('register_agent', {'agent_key': self.agent_key})
+            self._vault_private, vault_pub = session_keypair()
+            sio.emit('register_agent', {
+                'agent_key': self.agent_key,
+                'version': AGENT_VERSION,
+                'compression': wire.supported_codecs(),
+                'credential_vault': vault_pub,
+            })
 
         @sio.event
         def disconnect():
@@ -341,8 +1057,14 @@ class AgentThread(threading.Thread):
         def on_auth_ok(payload):
             user = payload.get('user')
             self.allowed_user = user
-            self._log("✅", f"Authorized as  →  {user}")
+            self.codec = payload.get('compression')
+            self.section_delta = bool(payload.get('section_delta'))
+            server_pub = payload.get('credential_vault')
+            self._vault_cipher = session_cipher(self._vault_private, server_pub) if server_pub else None
+            self.credential_vault = self._vault_cipher is not None
+            self._log("✅", f"Authorized as  →  {user}" + (f"  (wire: {self.codec})" if self.codec else ""))
             self.status_cb("connected", user)
+            threading.Thread(target=self._after_auth, args=(user,), daemon=True).start()
 
         @sio.on('agent_auth_failed')
         def on_auth_fail(payload):
@@ -353,82 +1075,130 @@ class AgentThread(threading.Thread):
         def on_task(payload):
             if not self.allowed_user:
                 return
+            payload = wire.unpack(payload, stats=self.wire_stats, direction='down')
             if payload.get('owner') != self.allowed_user:
                 return
-            threading.Thread(target=self._handle_task,
-                             args=(payload,), daemon=True).start()
+            # register ก่อน start thread — cancel_task ที่ตามมาติดๆ จะได้เจอ job
+            ctl = JobControl(payload.get('job_id'))
+            if ctl.job_id:
+                self._jobs[ctl.job_id] = ctl
+            threading.Thread(target=self._run_task,
+                             args=(payload, ctl), daemon=True).start()
+
+        @sio.on('cancel_task')
+        def on_cancel(payload):
+            ctl = self._jobs.get((payload or {}).get('job_id'))
+            if not ctl:
+                return
+            dropped = ctl.cancel('user')
+            self._log("🛑", f"Cancel job {ctl.job_id}  →  {dropped} queued device(s) dropped")
 
-    def _handle_task(self, payload):
+    def _run_task(self, payload, ctl: JobControl):
+        try:
+            self._handle_task(payload, ctl)
+        finally:
+            status = ctl.final_status()
+            if ctl.job_id:
+                self._jobs.pop(ctl.job_id, None)
+                if status:
+                    self._send_result({
+                        'type': 'job_status', 'job_id': ctl.job_id, 'job_type': payload.get('type'),
+                        'status': status,
+                        'owner': payload.get('owner'),
+                        'lanes': self.lanes.stats(),
+                    })
+
+    def _handle_task(self, payload, ctl: Optional[JobControl] = None):
         task_type = payload.get('type')
         owner     = payload.get('owner')
+        ctl       = ctl or JobControl()
+        job_key   = ctl.job_id or f"{task_type}-{id(payload)}"      # กลุ่มของงานใน LaneScheduler
+        self._hydrate_credentials(payload)
 
         # ── BACKUP ────────────────────────────────────
         if task_type == 'backup':
             device = payload.get('device', {})
             hostname = device.get('hostname', '?')
-            self._log("💾", f"Backup  {hostname} ...")
-            result = task_backup(device)
+            full     = bool(payload.get('full_upload'))    # server ประกอบ diff ไม่ได้ → ขอ text เต็ม
+            self._log("💾", f"Backup  {hostname} ..." + ("  (full upload)" if full else ""))
+            # lanes.shutdown() ยกเลิกงานที่ยังรอคิว → ได้ผล Cancelled แทน CancelledError ที่ฆ่า thread นี้
+            result = JobControl.outcome(self.lanes.submit('backup', task_backup, device), SHUTDOWN_OUTPUT)
             status = result['status']
             icon   = "✅" if status == 'Success' else "❌"
             self._log(icon, f"Backup {hostname}  →  {status}")
-            self.sio.emit('task_result', {
-                'type': task_type, 'status': status,
-                'output': result['output'],
-                'hostname': hostname,
-                'device_id': payload.get('device_id'),
-                'owner': owner
-            })
+            self._send_backup(device, result, owner, run_id=payload.get('run_id'),
+                              device_id=payload.get('device_id'), full=full)
 
         # ── BATCH BACKUP ───────────────────────────────
         elif task_type == 'batch_backup':
             devices = payload.get('devices', [])
-            self._log("📦", f"Batch backup  →  {len(devices)} devices")
-
-
-
-            # ✅ 1. ส่งสถานะเริ่มต้น (10% Connecting) กลับไปบอกหน้าเว็บก่อนทันที
-            for d in devices:
-                self.sio.emit('task_result', {
-                    'type': 'backup',
-                    'status': 'Running',
-                    'percent': 10,
-                    'msg': 'Connecting...',
-                    'hostname': d.get('hostname', '?'),
-                    'device_id': d.get('_id'),
-                    'owner': owner
-                })
+            run_id  = payload.get('run_id')           # server ส่ง run_id มาให้ echo กลับ (ใช้เป็น job id ของ journal)
+            workers = min(self.max_workers, int(payload.get('max_workers') or self.max_workers))
+            limiter = LoginRateLimiter(payload.get('login_rate'))
+
+            # ✅ resume: ข้ามเครื่องที่ checkpoint ไว้แล้ว (server อาจยังไม่เห็นผลก่อนเราหลุด)
+            if run_id:
+                done = JOURNAL.open(run_id, task_type, owner, len(devices))
+                if done:
+                    devices = [d for d in devices if d.get('_id') not in done]
+                self._active_jobs.add(run_id)
+
+            self._log("📦", f"Batch backup  →  {len(devices)} devices"
+                      + (f"  |  run {run_id}  |  {workers} workers" if run_id else "")
+                      + ("  |  resumed" if payload.get('trigger') == 'resume' else "")
+                      + (f"  |  config changed by {', '.join(payload.get('changed_by') or ['?'])}"
+                         if payload.get('trigger') == 'syslog' else ""))
+
+            def report(dev, res):
+                if res['status'] == 'Cancelled' and ctl.reason == 'shutdown':
+                    return False    # agent ปิดเอง — ไม่ checkpoint, ให้ resume รอบหน้า
+                sent = self._send_backup(dev, res, owner, run_id=run_id)
+                # checkpoint เมื่อผลถึง server หรืออยู่ใน spool แล้ว — ที่หายจะถูกรันใหม่ตอน resume
+                if sent and run_id:
+                    JOURNAL.mark(run_id, dev.get('_id'), res['status'])
+                return sent
 
+            try:
+                # ✅ 0. ตัดเครื่องที่ต่อ port 22 ไม่ได้ออกก่อน แจ้ง Failed ทันที
+                devices, unreachable = self._prescan(devices, payload)
+                for d, reason in unreachable:
+                    self._log("❌", f"  └ {d.get('hostname', '?')}  →  {reason}")
+                    report(d, {'status': 'Failed', 'output': reason})
+
+                # ✅ 1. ส่งสถานะเริ่มต้น (10% Connecting) กลับไปบอกหน้าเว็บก่อนทันที
+                for d in devices:
+                    self._send_result({
+                        'type': 'backup',
+                        'status': 'Running',
+                        'percent': 10,
+                        'msg': 'Connecting...',
+                        'hostname': d.get('hostname', '?'),
+                        'device_id': d.get('_id'),
+                        'owner': owner,
+                        'run_id': run_id
+                    })
 
                 # ✅ 2. เริ่มเปิด Thread เข้าอุปกรณ์จริงๆ
-            with ThreadPoolExecutor(max_workers=self.max_workers) as ex:
-                futures = {ex.submit(task_backup, d): d for d in devices}
+                futures = {self.lanes.submit('backup', ctl.guard, limiter.call, task_backup, d, ctl.event,
+                                             job=job_key, limit=workers): d for d in devices}
+                ctl.track(futures)
                 for fut in as_completed(futures):
                     dev = futures[fut]
                     hostname = dev.get('hostname', '?')
                     try:
-                        res    = fut.result()
+                        res    = ctl.outcome(fut)
                         status = res['status']
-                        icon   = "✅" if status == 'Success' else "❌"
+                        icon   = "✅" if status == 'Success' else ("🛑" if status == 'Cancelled' else "❌")
                         self._log(icon, f"  └ {hostname}  →  {status}")
-
-
-
-                        self.sio.emit('task_result', {
-                            'type': 'backup', 'status': status,
-                            'output': res['output'],
-                            'hostname': hostname,
-                            'device_id': dev.get('_id'),
-                            'owner': owner
-                        })
+                        report(dev, res)
                     except Exception as exc:
                         self._log("❌", f"  └ {hostname}  →  {exc}")
-                        self.sio.emit('task_result', {
-                            'type': 'backup', 'status': 'Failed',
-                            'output': str(exc),
-                            'hostname': hostname,
-                            'device_id': dev.get('_id'),
-                            'owner': owner
-                        })
+                        report(dev, {'status': 'Failed', 'output': str(exc)})
+                if run_id and ctl.reason != 'shutdown':
+                    JOURNAL.finish(run_id)
+            finally:
+                if run_id:
+                    self._active_jobs.discard(run_id)
 
         # ── BATCH CONFIG ───────────────────────────────
         elif task_type == 'batch_config':
@@ -441,116 +1211,246 @@ class AgentThread(threading.Thread):
                 commands = raw_cmds
             self._log("⚙️", f"Batch config  →  {len(devices)} devices  |  {len(commands)} cmds")
 
+            rollout = payload.get('rollout')
+            transactional = bool(payload.get('transactional'))
+            opts = {**ROLLOUT_DEFAULTS, **(rollout or {})}
             summary = {'success': 0, 'failed': 0}
             details = []
-            with ThreadPoolExecutor(max_workers=self.max_workers) as ex:
-                futures = {ex.submit(task_push_config, d, commands): d for d in devices}
+            devices, unreachable = self._prescan(devices, payload)
+            for d, reason in unreachable:
+                summary['failed'] += 1
+                details.append({'host': d.get('hostname', '?'), 'ip': d.get('ip_address', ''),
+                                'status': 'failed', 'commands_applied': [], 'log': reason})
+
+            # ไม่มี rollout = wave เดียวทั้งหมดเหมือนเดิม
+            if rollout:
+                waves = plan_waves(len(devices), opts['canary'], opts['growth'], opts['max_wave'])
+                health = list(opts['health_commands'] or [])
+                self._log("🐤", f"Rolling rollout  →  waves {waves}  |  abort > {opts['abort_threshold']:.0%}")
+            else:
+                waves, health = ([len(devices)] if devices else []), None
+
+            wave_reports = []
+            progress = RolloutProgress(opts['abort_threshold'] if rollout else None)
+            pos = 0
+            aborted = None
+            for wave_no, size in enumerate(waves, 1):
+                wave = devices[pos:pos + size]
+                pos += size
+                report = {'wave': wave_no, 'devices': len(wave), 'success': 0, 'failed': 0, 'health_failed': 0}
+                futures = {self.lanes.submit('push', ctl.guard, push_and_verify, d, commands, health, transactional,
+                                             job=job_key): d for d in wave}
+                ctl.track(futures)
                 for fut in as_completed(futures):
                     dev      = futures[fut]
                     hostname = dev.get('hostname', '?')
                     try:
-                        res        = fut.result()
+                        res        = ctl.outcome(fut)
                         is_success = res['status'] == 'Success'
                         applied    = res.get('commands_applied', [])
                         save_out   = res.get('save_output', '').strip()
+                        if res['status'] == 'Cancelled':
+                            # push ที่เริ่มไปแล้วปล่อยให้จบ (ตัดกลาง config อันตรายกว่า) — ยกเลิกได้เฉพาะที่ยังไม่เริ่ม
+                            summary['cancelled'] = summary.get('cancelled', 0) + 1
+                            details.append({'host': hostname, 'ip': dev.get('ip_address', ''),
+                                            'status': 'cancelled', 'commands_applied': [],
+                                            'wave': wave_no, 'log': res['output']})
+                            continue
                         icon       = "✅" if is_success else "❌"
                         self._log(icon, f"  └ {hostname}  →  {res['status']}")
                         if is_success:
                             summary['success'] += 1
+                            report['success'] += 1
                             cmd_lines = '\n'.join(f'  {i+1}. {c}' for i, c in enumerate(applied))
                             log = f"Commands Applied ({len(applied)}):\n{cmd_lines}"
                             if save_out:
                                 log += f"\nSave: {save_out[:120]}"
                         else:
                             summary['failed'] += 1
+                            report['failed'] += 1
+                            report['health_failed'] += 1 if res.get('health_failed') else 0
                             log = res['output']
                         details.append({
                             'host': hostname,
                             'ip': dev.get('ip_address', ''),
                             'status': 'success' if is_success else 'failed',
                             'commands_applied': applied,
-                            'log': log
+                            'wave': wave_no,
+                            'log': log,
+                            'change': res.get('change')
                         })
                     except Exception as exc:
                         summary['failed'] += 1
+                        report['failed'] += 1
                         details.append({'host': hostname, 'ip': '',
                                         'status': 'failed', 'commands_applied': [],
-                                        'log': str(exc)})
-
-            self.sio.emit('task_result', {
+                                        'wave': wave_no, 'log': str(exc)})
+
+                aborted = progress.wave_done(report, remaining=len(devices) - pos)
+                wave_reports.append(report)
+                if rollout:
+                    self._log("🌊", f"Wave {wave_no}/{len(waves)}  ✅ {report['success']}  ❌ {report['failed']}"
+                              f"  (rate {report['failure_rate']:.0%})")
+                    self._send_result({
+                        'type': 'batch_config_wave', 'owner': owner, 'profile_id': profile_id,
+                        'total_waves': len(waves), 'aborted': aborted, **report
+                    })
+                if aborted or ctl.cancelled:
+                    break
+                if rollout and opts['pause_seconds'] and pos < len(devices):
+                    ctl.event.wait(float(opts['pause_seconds']))
+                    if ctl.cancelled:
+                        break
+
+            skipped = devices[pos:]
+            for d in skipped:
+                details.append({'host': d.get('hostname', '?'), 'ip': d.get('ip_address', ''),
+                                'status': 'skipped', 'commands_applied': [],
+                                'log': f"Skipped — rollout aborted ({aborted})" if aborted
+                                       else f"Skipped — {CANCELLED_OUTPUT.lower()}"})
+            if rollout or skipped:
+                summary['skipped'] = len(skipped)
+            if aborted:
+                self._log("🛑", f"Rollout aborted at {aborted}  |  {len(skipped)} devices skipped")
+
+            self._send_result({
                 'type': 'batch_config',
                 'summary': summary,
                 'details': details,
+                'waves': wave_reports,
+                'aborted': aborted,
+                'cancelled': ctl.cancelled,
                 'owner': owner,
                 'profile_id': profile_id
             })
             self._log("📊", f"Batch done  ✅ {summary['success']}  ❌ {summary['failed']}")
 
         # ── BATCH CONFIG ZIP ───────────────────────────────
-        elif task_type == 'batch_config_zip':
-            tasks = payload.get('tasks', [])  # list of dicts: {'device': dev, 'commands': cmds}
+        elif task_type in ('batch_config_zip', 'batch_template'):
             profile_id = payload.get('profile_id', '')
-            self._log("⚙️", f"Batch ZIP config  →  {len(tasks)} devices")
-
+            transactional = bool(payload.get('transactional'))
             summary = {'success': 0, 'failed': 0}
             details = []
-            with ThreadPoolExecutor(max_workers=self.max_workers) as ex:
-                futures = {ex.submit(task_push_config, t['device'], t['commands']): t for t in tasks}
-                for fut in as_completed(futures):
-                    t        = futures[fut]
-                    dev      = t['device']
-                    hostname = dev.get('hostname', '?')
+
+            if task_type == 'batch_template':
+                # ✅ render ที่ agent: server ส่ง template ครั้งเดียว + vars ต่อ device
+                tpl = payload.get('template', {})
+                tasks = []
+                for t in payload.get('targets', []):
+                    dev = t['device']
                     try:
-                        res        = fut.result()
-                        is_success = res['status'] == 'Success'
-                        applied    = res.get('commands_applied', [])
-                        save_out   = res.get('save_output', '').strip()
-                        icon       = "✅" if is_success else "❌"
-                        self._log(icon, f"  └ {hostname}  →  {res['status']}")
-                        if is_success:
-                            summary['success'] += 1
-                            cmd_lines = '\n'.join(f'  {i+1}. {c}' for i, c in enumerate(applied))
-                            log = f"Commands Applied ({len(applied)}):\n{cmd_lines}"
-                            if save_out:
-                                log += f"\nSave: {save_out[:120]}"
-                        else:
-                            summary['failed'] += 1
-                            log = res['output']
-                        details.append({
-                            'host': hostname,
-                            'ip': dev.get('ip_address', ''),
-                            'status': 'success' if is_success else 'failed',
-                            'commands_applied': applied,
-                            'log': log
-                        })
-                    except Exception as exc:
+                        cmds = render_commands(tpl.get('bodies', {}), dev, t.get('vars'), payload.get('common_vars'))
+                        tasks.append({'device': dev, 'commands': cmds})
+                    except ValueError as e:
                         summary['failed'] += 1
+                        details.append({'host': dev.get('hostname', '?'), 'ip': dev.get('ip_address', ''),
+                                        'status': 'failed', 'commands_applied': [], 'log': f"Render: {e}"})
+                self._log("🧩", f"Template v{tpl.get('version', '?')}  →  {len(tasks)} rendered"
+                                f"  |  {summary['failed']} render errors")
+            else:
+                tasks = payload.get('tasks', [])  # list of dicts: {'device': dev, 'commands': cmds}
+                self._log("⚙️", f"Batch ZIP config  →  {len(tasks)} devices")
+
+            reachable, unreachable = self._prescan([t['device'] for t in tasks], payload)
+            reachable_ids = {id(d) for d in reachable}
+            tasks = [t for t in tasks if id(t['device']) in reachable_ids]
+            for d, reason in unreachable:
+                summary['failed'] += 1
+                details.append({'host': d.get('hostname', '?'), 'ip': d.get('ip_address', ''),
+                                'status': 'failed', 'commands_applied': [], 'log': reason})
+            futures = {self.lanes.submit('push', ctl.guard, task_push_config, t['device'], t['commands'],
+                                         transactional, job=job_key): t for t in tasks}
+            ctl.track(futures)
+            for fut in as_completed(futures):
+                t        = futures[fut]
+                dev      = t['device']
+                hostname = dev.get('hostname', '?')
+                try:
+                    res        = ctl.outcome(fut)
+                    is_success = res['status'] == 'Success'
+                    applied    = res.get('commands_applied', [])
+                    save_out   = res.get('save_output', '').strip()
+                    if res['status'] == 'Cancelled':
+                        summary['cancelled'] = summary.get('cancelled', 0) + 1
                         details.append({'host': hostname, 'ip': dev.get('ip_address', ''),
-                                        'status': 'failed', 'commands_applied': [],
-                                        'log': str(exc)})
-
-            self.sio.emit('task_result', {
+                                        'status': 'cancelled', 'commands_applied': [], 'log': res['output']})
+                        continue
+                    icon       = "✅" if is_success else "❌"
+                    self._log(icon, f"  └ {hostname}  →  {res['status']}")
+                    if is_success:
+                        summary['success'] += 1
+                        cmd_lines = '\n'.join(f'  {i+1}. {c}' for i, c in enumerate(applied))
+                        log = f"Commands Applied ({len(applied)}):\n{cmd_lines}"
+                        if save_out:
+                            log += f"\nSave: {save_out[:120]}"
+                    else:
+                        summary['failed'] += 1
+                        log = res['output']
+                    details.append({
+                        'host': hostname,
+                        'ip': dev.get('ip_address', ''),
+                        'status': 'success' if is_success else 'failed',
+                        'commands_applied': applied,
+                        'log': log,
+                        'change': res.get('change')
+                    })
+                except Exception as exc:
+                    summary['failed'] += 1
+                    details.append({'host': hostname, 'ip': dev.get('ip_address', ''),
+                                    'status': 'failed', 'commands_applied': [],
+                                    'log': str(exc)})
+
+            self._send_result({
                 'type': 'batch_config',  # Output type matches existing frontend expected format
                 'summary': summary,
                 'details': details,
+                'cancelled': ctl.cancelled,
                 'owner': owner,
                 'profile_id': profile_id
             })
             self._log("📊", f"Batch ZIP done  ✅ {summary['success']}  ❌ {summary['failed']}")
 
+        # ── PUSH CONFIG (single device) ─────────────────
+        elif task_type == 'push_config':
+            device   = payload.get('device', {})
+            hostname = device.get('hostname', '?')
+            transactional = bool(payload.get('transactional'))
+            self._log("⚙️", f"Push  {hostname}  →  {len(payload.get('commands') or [])} cmds"
+                      + ("  (transactional)" if transactional else ""))
+            result = JobControl.outcome(self.lanes.submit('push', task_push_config, device, payload.get('commands', []),
+                                                          transactional, payload.get('verify_commands')),
+                                        SHUTDOWN_OUTPUT)
+            icon   = "✅" if result['status'] == 'Success' else ("↩️" if result.get('rolled_back') else "❌")
+            self._log(icon, f"Push {hostname}  →  {result['status']}")
+            self._send_result({
+                'type': task_type, 'status': result['status'],
+                'output': result['output'],
+                'hostname': hostname,
+                'device_id': device.get('_id'),
+                'ip': device.get('ip_address', ''),
+                'change': result.get('change'),
+                'owner': owner
+            })
+
         # ── RUN COMMAND ────────────────────────────────
         elif task_type == 'run_command':
             device  = payload.get('device', {})
             command = payload.get('command', '')
             hostname = device.get('hostname', '?')
             self._log("💻", f"CMD  {hostname}  →  {command[:40]}")
-            result = task_run_command(device, command)
-            icon   = "✅" if result['status'] == 'Success' else "❌"
-            self._log(icon, f"CMD {hostname}  →  {result['status']}")
-            self.sio.emit('task_result', {
+            # lane interactive: แซงคิว batch ได้ + มี worker สำรองไว้ให้เสมอ
+            result = JobControl.outcome(self.lanes.submit('interactive', task_run_command, device, command,
+                                                          payload.get('max_age')),
+                                        SHUTDOWN_OUTPUT)
+            icon   = "⚡" if result.get('cached') else ("✅" if result['status'] == 'Success' else "❌")
+            self._log(icon, f"CMD {hostname}  →  {result['status']}"
+                      + (f"  (cached {result['cache_age']}s)" if result.get('cached') else ""))
+            self._send_result({
                 'type': task_type, 'status': result['status'],
                 'output': result['output'],
                 'hostname': hostname,
+                'cached': bool(result.get('cached')),
+                'cache_age': result.get('cache_age'),
                 'owner': owner
             })
 
@@ -559,351 +1459,135 @@ class AgentThread(threading.Thread):
             devices = payload.get('devices', [])
             self._log("🗺️", f"Topology scan  →  {len(devices)} devices")
 
-            def task_topology(device):
-                """Run LLDP + S/N on one device and return parsed structured data."""
-                from netmiko import ConnectHandler
-                import re
-                hostname = device.get('hostname', '?')
-                ip       = device.get('ip_address', '')
-                dtype    = device.get('device_type', '').lower()
-
-                # ── Per-vendor commands ───────────────────────────────
-                is_ruckus   = 'fastiron' in dtype or 'ruckus' in dtype
-                is_procurve = 'hp_procurve' in dtype or 'provision' in dtype
-                is_ios      = 'cisco' in dtype
-                is_comware  = 'comware' in dtype or 'hp_comware' in dtype or 'huawei' in dtype
-                is_aoscx    = 'aruba_aoscx' in dtype or 'aoscx' in dtype
-
-                if is_ruckus or is_ios:
-                    lldp_cmd = 'show lldp neighbors detail'
-                    sn_cmd   = 'show version'
-
-                elif is_aoscx:
-                    lldp_cmd = 'show lldp neighbor-info detail'
-                    sn_cmd   = 'show system'
-
-                elif is_procurve:
-                    lldp_cmd = 'show lldp info remote-device detail'
-                    sn_cmd   = 'show system information'
-
-                else:  # Comware
-                    lldp_cmd = 'display lldp neighbor-information verbose'
-                    sn_cmd   = 'display device manuinfo'
-
-                try:
-                    conn     = ConnectHandler(**get_device_driver(device))
-                    
-                    try:
-                        rp = conn.find_prompt()
-                        real_hostname = re.sub(r'^[<\[]+|[>\]#$]*$', '', rp).strip()
-                    except:
-                        real_hostname = hostname
-
-                    lldp_raw = conn.send_command(lldp_cmd, read_timeout=60)
-                    sn_raw   = conn.send_command(sn_cmd,   read_timeout=60)
-                    conn.disconnect()
-
-                    # ── Parse S/N ────────────────────────────────────
-                    sn = ''
-                    for line in sn_raw.splitlines():
-                        # Ruckus: "      Serial  #:DUH3221T0BZ"
-                        m = re.search(r'Serial\s+#\s*:\s*(\S+)', line, re.IGNORECASE)
-                        if not m:
-                            m = re.search(r'DEVICE_SERIAL_NUMBER\s*[:\s]\s*(\S+)', line, re.IGNORECASE)
-                        if not m:
-                            m = re.search(r'Serial\s*Num(?:ber)?\s*[:\s]\s*(\S+)', line, re.IGNORECASE)
-                        if not m:
-                            m = re.search(r'Serial\s+(?:Number|Nbr)\s*:\s*(\S+)', line, re.IGNORECASE)  # Aruba CX
-                        if m:
-                            sn = m.group(1)
-                            break
-
-                    # ── Helper: strip quotes from field values ────────
-                    def unquote(s: str) -> str:
-                        return s.strip().strip('"').strip("'")
-
-                    # ── LLDP parser ─────────────
-                    neighbors = []
-                    cur: dict = {}
-                    ipv4_seen = False
-
-                    fmt = 'ruckus' if (is_ruckus or is_ios) else \
-                    'aoscx'  if is_aoscx else \
-                    'procurve' if is_procurve else \
-                    'comware'
-
-                    def flush_cur(c: dict, lst: list):
-                        if c:
-                            if not c.get('neighbor'):
-                                fallback = c.get('remote_port', '')
-                                if fallback:
-                                    c['neighbor'] = f"Unknown-{fallback}"
-                            if c.get('neighbor'):
-                                lst.append(c)
-
-                    # ════ RUCKUS / IOS "show lldp neighbors detail" parser ════
-                    neighbors = []
-                    cur = None
-                    ipv4_seen = False
-
-                    # ════ RUCKUS Parser ════
-                    if fmt == 'ruckus':
-                        for line in lldp_raw.splitlines():
-                            stripped = line.strip()
-
-                            # Block header format 1: "Local port: 1/1/24" หรือ format 2: "Port : 1/1/12"
-                            m_hdr1 = re.match(r'Local port:\s*(\S+)', stripped, re.IGNORECASE)
-                            m_hdr2 = re.match(r'Port\s*:\s*(\S+)', stripped, re.IGNORECASE)
-                            m_hdr = m_hdr1 or m_hdr2
-
-                            if m_hdr:
-                                flush_cur(cur, neighbors)
-                                cur = {
-                                    'local_port':  m_hdr.group(1).strip(),
-                                    'neighbor':    '',
-                                    'remote_port': '',
-                                    'mgmt_ip':     '',
-                                    'port_desc':   '',
-                                    'update_time': '',
-                                    'sys_desc':    '',
-                                }
-                                ipv4_seen = False
-                                continue
-
-                            if not cur:
-                                continue
-
-                            # Strip leading "+ " or "  + " prefix
-                            clean = re.sub(r'^\+\s*', '', stripped)
-
-                            def _rf(label: str):
-                                m = re.match(rf'{re.escape(label)}(?:\s*\(.*?\))?\s*:\s*(.+)', clean, re.IGNORECASE)
-                                return unquote(m.group(1)) if m else None
-
-                            v = _rf('System name') or _rf('Neighbor System-Name')
-                            if v: cur['neighbor'] = v; continue
-
-                            v = _rf('System description') or _rf('Neighbor System-Description')
-                            if v and not cur['sys_desc']: cur['sys_desc'] = v; continue
-
-                            v = _rf('Port ID') or _rf('Neighbor Port-ID')
-                            if v and not cur['remote_port']:
-                                cur['remote_port'] = v.split('(')[0].strip() if '(' in v else v
-                                continue
-
-                            v = _rf('Port description') or _rf('Neighbor Port-Desc')
-                            if v: cur['port_desc'] = v; continue
-
-                            v = _rf('Management address (IPv4)') or _rf('Neighbor Management-Address')
-                            if v and not ipv4_seen:
-                                cur['mgmt_ip'] = v
-                                ipv4_seen = True
-                                continue
-
-                            v = _rf('Time to live') or _rf('TTL')
-                            if v and not cur['update_time']:
-                                cur['update_time'] = f"{v} (TTL)"
-                                continue
-                            
-                            m_ttl = re.search(r'TTL\s+(\d+)\s+seconds?', line, re.IGNORECASE)
-                            if m_ttl and not cur['update_time']:
-                                cur['update_time'] = f"{m_ttl.group(1)} seconds (TTL)"
-
-                    # ════ ARUBA CX Parser ════
-                    elif fmt == 'aoscx':
-                        for line in lldp_raw.splitlines():
-                            stripped = line.strip()
-                            m_hdr = re.match(r'Port\s*:\s*(\S+)', stripped, re.IGNORECASE)
-
-                            if m_hdr:
-                                flush_cur(cur, neighbors)
-                                cur = {
-                                    'local_port':  m_hdr.group(1),
-                                    'neighbor':    '',
-                                    'remote_port': '',
-                                    'mgmt_ip':     '',
-                                    'port_desc':   '',
-                                    'update_time': '',
-                                    'sys_desc':    '',
-                                }
-                                continue
-
-                            if not cur:
-                                continue
-
-                            def _field(label):
-                                m = re.match(rf'{re.escape(label)}(?:\s*\(.*?\))?\s*:\s*(.+)', stripped, re.IGNORECASE)
-                                return m.group(1).strip() if m else None
-
-                            v = _field('Neighbor System-Name')
-                            if v: cur['neighbor'] = v; continue
-
-                            v = _field('Neighbor System-Description')
-                            if v: cur['sys_desc'] = v; continue
-
-                            v = _field('Neighbor Port-ID')
-                            if v: cur['remote_port'] = v; continue
-
-                            v = _field('Neighbor Port-Desc')
-                            if v: cur['port_desc'] = v; continue
-
-                            v = _field('TTL')
-                            if v: cur['update_time'] = f"{v} (TTL)"; continue
-
-                            v = _field('Neighbor Management-Address')
-                            if v and not cur['mgmt_ip']:
-                                cur['mgmt_ip'] = v.split(',')[0]
-                                continue
-
-                    # ════ PROCURVE Parser ════
-                    elif fmt == 'procurve':
-                        for line in lldp_raw.splitlines():
-                            stripped = line.strip()
-                            m_hdr = re.match(r'Local Port\s*:\s*(\S+)', stripped, re.IGNORECASE)
-
-                            if m_hdr:
-                                flush_cur(cur, neighbors)
-                                cur = {
-                                    'local_port':  m_hdr.group(1).strip(),
-                                    'neighbor':    '',
-                                    'remote_port': '',
-                                    'mgmt_ip':     '',
-                                    'port_desc':   '',
-                                    'update_time': '',
-                                    'sys_desc':    '',
-                                }
-                                ipv4_seen = False
-                                continue
-
-                            if not cur:
-                                continue
-
-                            def _field(label: str):
-                                m = re.match(rf'{re.escape(label)}(?:\s*\(.*?\))?\s*:\s*(.+)', stripped, re.IGNORECASE)
-                                return m.group(1).strip() if m else None
-
-                            v = _field('SysName')
-                            if v: cur['neighbor'] = v; continue
-
-                            v = _field('System Descr')
-                            if v and not cur['sys_desc']: cur['sys_desc'] = v; continue
-
-                            v = _field('PortId')
-                            if v and not cur['remote_port']: cur['remote_port'] = v; continue
-
-                            v = _field('PortDescr')
-                            if v: cur['port_desc'] = v; continue
-                            
-                            # HP ProCurve IP format under "Remote Management Address"
-                            v = _field('Address') # e.g. "Address : 10.116.254.1"
-                            if v and not ipv4_seen and re.match(r'\d{1,3}(\.\d{1,3}){3}', v):
-                                cur['mgmt_ip'] = v
-                                ipv4_seen = True
-                                continue
-
-                    # ════ COMWARE Parser ════
-                    else:
-                        for line in lldp_raw.splitlines():
-                            stripped = line.strip()
-                            m_hdr = re.match(r'LLDP neighbor-information of port\s+\d+\[([^\]]+)\]', stripped, re.IGNORECASE)
-
-                            if m_hdr:
-                                flush_cur(cur, neighbors)
-                                cur = {
-                                    'local_port':  m_hdr.group(1).strip(),
-                                    'neighbor':    '',
-                                    'remote_port': '',
-                                    'mgmt_ip':     '',
-                                    'port_desc':   '',
-                                    'update_time': '',
-                                    'sys_desc':    '',
-                                }
-                                ipv4_seen = False
-                                continue
-
-                            if not cur:
-                                continue
-
-                            def _field(label: str):
-                                m = re.match(rf'{re.escape(label)}(?:\s*\(.*?\))?\s*:\s*(.+)', stripped, re.IGNORECASE)
-                                return m.group(1).strip() if m else None
-
-                            v = _field('System name')
-                            if v: cur['neighbor'] = v; continue
-
-                            v = _field('System description')
-                            if v and not cur['sys_desc']:
-                                cur['sys_desc'] = v; continue
-
-                            v = _field('Port ID')
-                            if v and not cur['remote_port']:
-                                cur['remote_port'] = v; continue
-
-                            v = _field('Port description')
-                            if v: cur['port_desc'] = v; continue
-
-                            v = _field('Update time')
-                            if v: cur['update_time'] = v; continue
-
-                            v = _field('Management address')
-                            if v and not ipv4_seen:
-                                if re.match(r'\d{1,3}(\.\d{1,3}){3}$', v):
-                                    cur['mgmt_ip'] = v
-                                    ipv4_seen = True
-
-                    # เก็บข้อมูลตัวสุดท้ายหลังจากจบ Loop ของแต่ละ format
-                    flush_cur(cur, neighbors)
-                    return {
-                    'hostname': real_hostname, 
-                    'ip': ip, 
-                    'sn': sn,
-                    'neighbors': neighbors, 
-                    'status': 'Success', 
-                    'error': ''
-                    }
-
-                except Exception as e:
-                    return {
-                        'hostname': hostname, 
-                        'ip': ip, 
-                        'sn': '',
-                        'neighbors': [], 
-                        'status': 'Failed', 
-                        'error': str(e)
-                    }
             results = []
-            with ThreadPoolExecutor(max_workers=self.max_workers) as ex:
-                futures = {ex.submit(task_topology, d): d for d in devices}
-                for fut in as_completed(futures):
-                    dev = futures[fut]
-                    try:
-                        r = fut.result()
-                    except Exception as exc:
-                        r = {'hostname': dev.get('hostname', '?'), 'ip': dev.get('ip_address', ''),
-                             'sn': '', 'neighbors': [], 'status': 'Failed', 'error': str(exc)}
-                    icon = "✅" if r['status'] == 'Success' else "❌"
-                    self._log(icon, f"  └ {r['hostname']}  SN:{r['sn'] or '-'}  neighbors:{len(r['neighbors'])}")
-                    results.append(r)
-
-            self.sio.emit('task_result', {'type': 'topology_scan', 'results': results, 'owner': owner})
+            devices, unreachable = self._prescan(devices, payload)
+            for d, reason in unreachable:
+                self._log("❌", f"  └ {d.get('hostname', '?')}  →  {reason}")
+                results.append({'hostname': d.get('hostname', '?'), 'ip': d.get('ip_address', ''),
+                                'sn': '', 'neighbors': [], 'status': 'Failed', 'error': reason})
+            known = payload.get('fingerprints', {})
+            futures = {self.lanes.submit('topology', ctl.guard, task_topology, d, known.get(d.get('ip_address')),
+                                         job=job_key): d for d in devices}
+            ctl.track(futures)
+            for fut in as_completed(futures):
+                dev = futures[fut]
+                try:
+                    r = ctl.outcome(fut)
+                    if r['status'] == 'Cancelled':
+                        continue
+                except Exception as exc:
+                    r = {'hostname': dev.get('hostname', '?'), 'ip': dev.get('ip_address', ''),
+                         'sn': '', 'neighbors': [], 'status': 'Failed', 'error': str(exc)}
+                icon = "✅" if r['status'] == 'Success' else "❌"
+                changes = f"  Δ +{len(r['added'])} -{len(r['removed'])}" if r.get('mode') == 'delta' else ''
+                self._log(icon, f"  └ {r['hostname']}  SN:{r['sn'] or '-'}  "
+                                f"neighbors:{r.get('neighbor_count', len(r['neighbors']))}{changes}")
+                results.append(r)
+
+            TOPOLOGY_CACHE.save()
+            self._send_result({'type': 'topology_scan', 'results': results, 'owner': owner,
+                               'profile_id': payload.get('profile_id')})
             ok  = sum(1 for r in results if r['status'] == 'Success')
             err = len(results) - ok
             self._log("🗺️", f"Topology done  ✅ {ok}  ❌ {err}")
 
+        # ── TOPOLOGY CRAWL ──────────────────────────────
+        elif task_type == 'topology_crawl':
+            self._crawl(payload, ctl)
+
         else:
             self._log("❓", f"Unknown task type: {task_type}")
 
+        if task_type in ('batch_backup', 'batch_config', 'batch_config_zip', 'batch_template', 'topology_scan'):
+            self._log("📶", f"Wire  {self.wire_stats.summary()}")
+            self._log("⏱️", f"Lanes {self.lanes.summary()}"
+                      + (f"  |  {SESSIONS.coalesced} coalesced cmds" if SESSIONS.coalesced else "")
+                      + (f"  |  show cache {SHOW_CACHE.hits}/{SHOW_CACHE.hits + SHOW_CACHE.misses} hits"
+                         if SHOW_CACHE.hits else ""))
+        LATENCY.save()
+
+    def _crawl(self, payload, ctl: Optional[JobControl] = None):
+        """
+        Breadth-first discovery: scan the seeds, follow each LLDP neighbor's
+        management IP, de-duplicate by IP / chassis id / serial, and stop at
+        max_depth or max_devices.
+        """
+        owner     = payload.get('owner')
+        crawl_id  = payload.get('crawl_id')
+        max_depth = int(payload.get('max_depth') or CRAWL_MAX_DEPTH)
+        max_devs  = int(payload.get('max_devices') or CRAWL_MAX_DEVICES)
+        scope     = payload.get('scope') or []
+        seeds     = payload.get('devices', [])
+        ctl       = ctl or JobControl()
+        job_key   = ctl.job_id or f"crawl-{crawl_id}"
+        self._log("🧭", f"Topology crawl  →  {len(seeds)} seeds  depth≤{max_depth}  max {max_devs}")
+
+        crawl = CrawlFrontier(seeds, max_depth, max_devs, scope)
+        while not ctl.cancelled:
+            frontier = crawl.next_level()
+            if not frontier:
+                break
+            reachable, unreachable = self._prescan(frontier, payload)
+            level = []
+            for d, reason in unreachable:
+                level.append((d, {'hostname': d.get('hostname', '?'), 'ip': d.get('ip_address', ''),
+                                  'sn': '', 'neighbors': [], 'status': 'Failed', 'error': reason}))
+            futures = {self.lanes.submit('topology', ctl.guard, task_topology, d, job=job_key): d
+                       for d in reachable}
+            ctl.track(futures)
+            for fut in as_completed(futures):
+                d = futures[fut]
+                try:
+                    r = ctl.outcome(fut)
+                    if r['status'] != 'Cancelled':
+                        level.append((d, r))
+                except Exception as exc:
+                    level.append((d, {'hostname': d.get('hostname', '?'), 'ip': d.get('ip_address', ''),
+                                      'sn': '', 'neighbors': [], 'status': 'Failed', 'error': str(exc)}))
+
+            for d, r in level:
+                entry = crawl.record(d, r)
+                if entry['status'] == 'Duplicate':
+                    continue
+                icon = "✅" if entry['status'] == 'Success' else "❌"
+                self._log(icon, f"  └ [{entry['depth']}] {entry['hostname']}  ({entry['ip']})  "
+                                f"neighbors:{entry['neighbor_count']}")
+                self._send_result({
+                    'type': 'topology_crawl_progress', 'crawl_id': crawl_id, 'owner': owner,
+                    'device': entry, 'scanned': len(crawl.inventory),
+                    'queued': len(crawl.pending), 'depth': d['_depth'],
+                })
+
+        TOPOLOGY_CACHE.save()
+        ok = sum(1 for e in crawl.inventory if e['status'] == 'Success')
+        self._send_result({
+            'type': 'topology_crawl', 'crawl_id': crawl_id, 'owner': owner,
+            'profile_id': payload.get('profile_id'),
+            'inventory': crawl.inventory, 'results': crawl.results,
+            'summary': {'scanned': len(crawl.inventory), 'success': ok,
+                        'truncated': crawl.truncated, 'cancelled': ctl.cancelled},
+        })
+        self._log("🧭", f"Crawl done  →  {len(crawl.inventory)} devices  ✅ {ok}")
+
     def run(self):
         try:
             self.sio.connect(self.server_url, transports=['websocket'])
             while not self._stop_event.is_set():
-                time.sleep(0.5)
+                # thread นี้ว่างอยู่แล้ว → เป็นคนส่ง spool (task thread ไม่ต้องรอ ack)
+                self._spool_wake.wait(0.5)
+                self._spool_wake.clear()
+                if len(SPOOL) and self._online() and time.monotonic() >= self._spool_retry_at:
+                    self._flush_spool()
         except Exception as e:
             self._log("❌", f"Connection error: {e}")
             self.status_cb("disconnected", None)
 
     def stop(self):
         self._stop_event.set()
+        # หยุดงานที่ค้าง — batch_backup ที่มี journal จะ resume ต่อตอนเปิดใหม่
+        for ctl in list(self._jobs.values()):
+            ctl.cancel('shutdown')
+        self.lanes.shutdown()
         try:
             self.sio.disconnect()
         except Exception:
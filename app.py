@@ -1,10 +1,11 @@
 import eventlet
 eventlet.monkey_patch()
 
-from flask import Flask, request, jsonify, send_file
+from flask import Flask, request, jsonify, send_file, Response, stream_with_context
 from flask_cors import CORS
 from flask_socketio import SocketIO, emit, join_room
-from pymongo import MongoClient
+from pymongo import MongoClient, UpdateOne, ReturnDocument
+from pymongo.errors import DuplicateKeyError, BulkWriteError
 from bson.objectid import ObjectId
 import datetime as dt
 import certifi
@@ -16,12 +17,30 @@ import pandas as pd
 from werkzeug.utils import secure_filename
 from datetime import datetime, timezone, timedelta
 import secrets  # สำหรับ gen key
+import hashlib
+import json
+from concurrent.futures import ThreadPoolExecutor
 
 import env
 from dotenv import load_dotenv
 load_dotenv()
 
 from converter import ConfigConverter
+from archive_stream import iter_zip, iter_tar_gz
+import wire
+from topology_graph import TopologyGraph
+from topology_delta import link_changes
+from lldp_parser import parse_lldp, lldp_format
+from vendors import resolve_vendor
+from backup_delta import decode_sections, render_backup
+from cryptography.fernet import Fernet
+from credential_vault import (CREDENTIAL_FIELDS, SECRET_FIELDS, session_keypair, session_cipher, credential_id,
+                              seal, unseal, payload_devices)
+import scheduler
+from rollout import validate_rollout
+from config_templates import validate_bodies, render_bulk, parse_vlan_range, CACHE as TEMPLATE_CACHE
+from state_parsers import parse_backup_state, normalize_mac, endpoint_entries
+import re
 
 app = Flask(__name__)
 CORS(app)
@@ -29,6 +48,24 @@ socketio = SocketIO(app, cors_allowed_origins="*", async_mode='eventlet')
 
 thai_tz = timezone(timedelta(hours=7))
 agent_connections = {}
+agent_codecs = {}        # sid → wire codec ที่ตกลงกันตอน register_agent
+wire_stats = wire.WireStats()
+agent_lane_stats = {}    # owner → queue wait ต่อ priority lane ล่าสุดที่ agent รายงานมา
+topology_graph_cache = {}   # (owner, profile_id) → (stamp, TopologyGraph)
+STATE_TABLES = ('mac', 'arp', 'routes', 'interfaces')   # collection state_<table>
+STATE_QUERY_LIMIT = 1000
+# port ที่เรียน MAC มากกว่านี้ถือว่าเป็น uplink (กรณีไม่มีข้อมูล LLDP ของ port นั้น)
+UPLINK_MAC_THRESHOLD = int(os.getenv('UPLINK_MAC_THRESHOLD', '64'))
+RESULT_DEDUP_SECONDS = 7 * 24 * 3600   # จำ result_id ที่รับแล้วไว้กี่วินาที (agent spool replay)
+SECTION_BLOB_TTL = 90 * 24 * 3600      # section ที่ไม่มี backup ไหนอ้างถึงนานเกินนี้ถูกลบ (agent จะส่งเต็มใหม่เอง)
+JOB_CANCEL_TIMEOUT = 10 * 60     # job ที่ค้าง cancelling นานเกินนี้ (agent หลุดก่อนตอบ) ถือว่า cancelled
+# งานที่ยาวพอจะต้องยกเลิกได้ — ได้ job_id ตอน dispatch
+JOB_TYPES = ('batch_backup', 'batch_config', 'batch_config_zip', 'batch_template', 'topology_scan', 'topology_crawl')
+# Fernet key ของ credential vault — ไม่ตั้ง = ส่ง username / password ใน payload แบบเดิม
+CREDENTIAL_VAULT_KEY = os.getenv('CREDENTIAL_VAULT_KEY')
+vault_cipher = Fernet(CREDENTIAL_VAULT_KEY) if CREDENTIAL_VAULT_KEY else None
+agent_vaults = {}              # sid → transport cipher ของ agent ที่รับ credential_id ได้
+_known_credential_ids = set()  # credential set ที่ upsert แล้วใน process นี้
 
 # ── Agent Version Management ──────────────────────────────────────
 # เพิ่ม version ทุกครั้งที่ release agent ใหม่
@@ -49,6 +86,42 @@ try:
     
     # Create TTL Index on batch_reports run_date to auto-expire after 7 days
     db.batch_reports.create_index("run_date", expireAfterSeconds=604800)
+    # ใช้กับ $sort + $group หา backup ล่าสุดของแต่ละ device
+    db.backups.create_index([('owner', 1), ('device_id', 1), ('timestamp', -1)])
+    db.topology_nodes.create_index([('owner', 1), ('ip', 1)], unique=True)
+    db.topology_links.create_index([('owner', 1), ('device_ip', 1), ('key', 1)], unique=True)
+    db.topology_links.create_index([('owner', 1), ('device_ip', 1), ('local_port', 1)])
+    db.topology_links.create_index([('owner', 1), ('profile_id', 1)])
+    db.topology_nodes.create_index([('owner', 1), ('profile_id', 1), ('updated_at', -1)])
+    for table in STATE_TABLES:
+        db[f'state_{table}'].create_index([('owner', 1), ('device_id', 1)])
+    db.state_mac.create_index([('owner', 1), ('mac', 1)])
+    db.state_mac.create_index([('owner', 1), ('vlan', 1)])
+    db.state_arp.create_index([('owner', 1), ('ip', 1)])
+    db.state_arp.create_index([('owner', 1), ('mac', 1)])
+    db.state_routes.create_index([('owner', 1), ('prefix', 1)])
+    db.state_interfaces.create_index([('owner', 1), ('interface', 1)])
+    db.endpoint_locations.create_index([('owner', 1), ('mac', 1)], unique=True)
+    db.endpoint_locations.create_index([('owner', 1), ('device_id', 1)])
+    db.endpoint_ips.create_index([('owner', 1), ('ip', 1)], unique=True)
+    db.endpoint_ips.create_index([('owner', 1), ('device_id', 1)])
+    db.endpoint_ips.create_index([('owner', 1), ('mac', 1)])
+    db.backup_schedules.create_index([('enabled', 1), ('next_run', 1)])
+    db.backup_schedules.create_index([('owner', 1), ('profile_id', 1)])
+    db.backup_runs.create_index('run_id', unique=True)
+    db.backup_runs.create_index([('status', 1), ('retry_at', 1)])
+    db.backup_runs.create_index([('schedule_id', 1), ('started_at', -1)])
+    db.config_change_events.create_index('device_ip', unique=True)
+    db.config_change_events.create_index([('status', 1), ('last_event_at', 1)])
+    db.config_diffs.create_index([('owner', 1), ('ip', 1), ('timestamp', -1)])
+    db.config_templates.create_index([('owner', 1), ('name', 1)], unique=True)
+    db.agent_results.create_index('at', expireAfterSeconds=RESULT_DEDUP_SECONDS)
+    db.section_blobs.create_index('last_seen', expireAfterSeconds=SECTION_BLOB_TTL)
+    db.jobs.create_index('job_id', unique=True)
+    db.jobs.create_index('created_at', expireAfterSeconds=RESULT_DEDUP_SECONDS)
+    db.jobs.create_index([('owner', 1), ('status', 1)])
+    db.credential_sets.create_index('cred_id', unique=True)
+    db.credential_sets.create_index([('owner', 1), ('name', 1)])
     
     print("✅ Connected to MongoDB Atlas")
 except Exception as e:
@@ -71,76 +144,47 @@ def serialize_doc(doc: dict) -> dict:
     return result
 
 def get_backup_command(device_type):
-    # แปลงเป็นตัวพิมพ์เล็กกันพลาด
-    dtype = device_type.lower()
-    
-    if "cisco" in dtype or "aruba_osswitch" in dtype or "aruba_aoscx" in dtype or "aruba" in dtype:
-        return "show running-config"
-        
-    elif "juniper" in dtype:
-        return "show configuration"
-        
-    elif "hp_comware" in dtype or "huawei" in dtype or "hp" in dtype or "comware" in dtype:
-        return "display current-configuration"
-        
-    elif "fortinet" in dtype:
-        return "show full-configuration"
-        
-    else:
-        return "show running-config" # Default
-
-
-def parse_vlan_range(vlan_str):
-    vlans = []
-    try:
-        parts = vlan_str.split(',')
-        for part in parts:
-            part = part.strip()
-            if '-' in part:
-                start, end = map(int, part.split('-'))
-                vlans.extend(range(start, end + 1))
-            elif 'to' in part:
-                start, end = map(int, part.split('to'))
-                vlans.extend(range(start, end + 1))
-            else:
-                vlans.append(int(part))
-    except:
-        pass
-    return sorted(list(set(vlans)))
+    return resolve_vendor(device_type).running_config
 
 
 def generate_bulk_vlan_config(device_type, vlan_str, vlan_name_prefix, svi_id, ip_address, subnet_mask):
     configs = []
-    dtype = device_type.lower()
+    profile = resolve_vendor(device_type)
+    style = profile.vlan_style
     vlan_list = parse_vlan_range(vlan_str)
 
     # VLAN creation
-    if "cisco" in dtype or "aruba" in dtype:
+    if style in ('ios', 'procurve'):
         for vid in vlan_list:
             configs.append(f"vlan {vid}")
             if vlan_name_prefix:
                 configs.append(f"name {vlan_name_prefix}_{vid}")
-            configs.append("exit")
-    elif "hp_comware" in dtype or "huawei" in dtype:
+            configs.append(profile.exit_command)
+    elif style == 'comware':
         batch_str = " ".join(map(str, vlan_list))
         configs.append(f"vlan batch {batch_str}")
         if vlan_name_prefix:
             for vid in vlan_list:
                 configs.append(f"vlan {vid}")
                 configs.append(f"name {vlan_name_prefix}_{vid}")
-                configs.append("quit")
+                configs.append(profile.exit_command)
 
     # SVI / L3 interface
     if svi_id and ip_address and subnet_mask:
-        if "cisco" in dtype or "aruba" in dtype:
+        if style == 'ios':
             configs.append(f"interface vlan {svi_id}")
             configs.append(f"ip address {ip_address} {subnet_mask}")
             configs.append("no shutdown")
-            configs.append("exit")
-        elif "hp_comware" in dtype or "huawei" in dtype:
+            configs.append(profile.exit_command)
+        elif style == 'procurve':
+            # ProCurve ไม่มี interface vlan — IP อยู่ใต้ vlan context
+            configs.append(f"vlan {svi_id}")
+            configs.append(f"ip address {ip_address} {subnet_mask}")
+            configs.append(profile.exit_command)
+        elif style == 'comware':
             configs.append(f"interface Vlan-interface {svi_id}")
             configs.append(f"ip address {ip_address} {subnet_mask}")
-            configs.append("quit")
+            configs.append(profile.exit_command)
 
     return configs
 
@@ -153,12 +197,376 @@ def get_device_driver(device):
         'secret': device.get('secret', ''),
         'port': int(device.get('port', 22)),
         'global_delay_factor': 0.5,
-        'fast_cli': True,           # ✅ เปิดโหมด Fast (ช่วยได้เยอะใน Cisco/Aruba)
+        'fast_cli': resolve_vendor(device['device_type']).pipelining,   # ✅ Fast mode เฉพาะ vendor ที่รับได้
         'banner_timeout': 10,       # เผื่อ Banner ยาว
         'auth_timeout': 10,         # เผื่อ Authentication ช้า
     }
 
 
+def streaming_zip_response(entries, download_name):
+    """Stream a ZIP built from (arcname, content) pairs as a chunked download."""
+    return Response(
+        stream_with_context(iter_zip(entries)),
+        mimetype='application/zip',
+        headers={'Content-Disposition': f'attachment; filename="{download_name}"'}
+    )
+
+
+# ────────────────────────────────────────────────
+#             CREDENTIAL VAULT
+#   credential_sets: 1 doc ต่อ login (token = Fernet ของ vault key)
+#   agent ที่รองรับได้ device แบบมีแค่ credential_id แล้วขอ credential ผ่าน get_credentials ครั้งเดียวต่อ set
+# ────────────────────────────────────────────────
+
+def credential_ref(owner, device):
+    """credential_id for a device: the set it references, or one made from its inline login."""
+    if device.get('credential_id'):
+        return device['credential_id']
+    creds = {k: device.get(k) or '' for k in CREDENTIAL_FIELDS}
+    cred_id = credential_id(CREDENTIAL_VAULT_KEY.encode(), owner, creds)
+    if cred_id not in _known_credential_ids:
+        db.credential_sets.update_one({'cred_id': cred_id}, {'$setOnInsert': {
+            'owner': owner, 'name': f"{creds['username'] or '?'} (inline)", 'username': creds['username'],
+            'token': seal(vault_cipher, creds), 'inline': True, 'created_at': dt.datetime.now(thai_tz),
+        }}, upsert=True)
+        _known_credential_ids.add(cred_id)
+    return cred_id
+
+
+def load_credentials(owner, cred_ids):
+    """{cred_id: {'username', 'password', 'secret'}} for the owner's sets among cred_ids."""
+    out = {}
+    for doc in db.credential_sets.find({'cred_id': {'$in': list(cred_ids)}, 'owner': owner}):
+        out[doc['cred_id']] = unseal(vault_cipher, doc['token'])
+    return out
+
+
+def _map_devices(payload, fn):
+    """Shallow copy of an execute_task payload with fn applied to every device dict."""
+    out = dict(payload)
+    if isinstance(out.get('device'), dict):
+        out['device'] = fn(out['device'])
+    if out.get('devices'):
+        out['devices'] = [fn(d) for d in out['devices']]
+    for key in ('tasks', 'targets'):
+        if out.get(key):
+            out[key] = [dict(t, device=fn(t['device'])) if isinstance(t.get('device'), dict) else t
+                        for t in out[key]]
+    return out
+
+
+def vault_payload(owner, payload):
+    """Payload for vault-capable agents: devices carry credential_id, never password / secret."""
+    refs = {}
+
+    def strip(dev):
+        key = (dev.get('credential_id'),) + tuple(dev.get(k) or '' for k in CREDENTIAL_FIELDS)
+        if key not in refs:
+            refs[key] = credential_ref(owner, dev)
+        slim = {k: v for k, v in dev.items() if k not in SECRET_FIELDS}
+        slim['credential_id'] = refs[key]
+        return slim
+
+    return _map_devices(payload, strip)
+
+
+def plain_payload(owner, payload):
+    """Payload for older agents: devices that only reference a credential set get the login inline."""
+    ids = {d['credential_id'] for d in payload_devices(payload) if d.get('credential_id') and not d.get('password')}
+    if not ids or not vault_cipher:
+        return payload
+    creds = load_credentials(owner, ids)
+
+    def fill(dev):
+        if dev.get('credential_id') in creds and not dev.get('password'):
+            return dict(dev, **creds[dev['credential_id']])
+        return dev
+
+    return _map_devices(payload, fill)
+
+
+def pack_for_agent(sid, owner, payload, cache=None):
+    """wire-packed execute_task body for one agent (codec + credential style it negotiated)."""
+    vault = sid in agent_vaults
+    key = (agent_codecs.get(sid), vault)
+    if cache is not None and key in cache:
+        return cache[key]
+    body = vault_payload(owner, payload) if vault else plain_payload(owner, payload)
+    packed = wire.pack(body, key[0], stats=wire_stats, direction='to_agent')
+    if cache is not None:
+        cache[key] = packed
+    return packed
+
+
+def dispatch_task(owner, payload):
+    """
+    Send an execute_task payload to every agent connected for `owner`.
+    Large payloads are compressed with the codec each agent negotiated.
+    Batch tasks get a job_id (set on the payload) that /api/jobs/<id>/cancel can target.
+    Returns the number of agents the task was sent to.
+    """
+    payload.setdefault('owner', owner)
+    if payload.get('type') in JOB_TYPES:
+        payload.setdefault('job_id', payload.get('run_id') or secrets.token_hex(8))
+        now = dt.datetime.now(thai_tz)
+        db.jobs.update_one(
+            {'job_id': payload['job_id']},
+            {'$set': {'status': 'running', 'dispatched_at': now},
+             '$setOnInsert': {'owner': owner, 'type': payload['type'], 'created_at': now,
+                              'profile_id': payload.get('profile_id'), 'run_id': payload.get('run_id')}},
+            upsert=True
+        )
+    packed = {}
+    sent = 0
+    for sid, user in list(agent_connections.items()):
+        if user != owner:
+            continue
+        socketio.emit('execute_task', pack_for_agent(sid, owner, payload, packed), to=sid)
+        sent += 1
+    return sent
+
+
+# ────────────────────────────────────────────────
+#             TOPOLOGY STORE
+#   topology_nodes: 1 doc ต่อ device ที่ scan (fingerprint ของตาราง LLDP ล่าสุด)
+#   topology_links: 1 doc ต่อ adjacency, key = hash ของ neighbor record จาก agent
+# ────────────────────────────────────────────────
+
+def _link_doc(owner, profile_id, device_ip, hostname, n):
+    return {
+        'owner': owner,
+        'profile_id': profile_id,
+        'device_ip': device_ip,
+        'device_hostname': hostname,
+        'key': n.get('key'),
+        'local_port': n.get('local_port', ''),
+        'neighbor': n.get('neighbor', ''),
+        'remote_port': n.get('remote_port', ''),
+        'mgmt_ip': n.get('mgmt_ip', ''),
+        'port_desc': n.get('port_desc', ''),
+        'sys_desc': n.get('sys_desc', ''),
+        'update_time': n.get('update_time', ''),
+        'updated_at': dt.datetime.now(thai_tz),
+    }
+
+
+def apply_topology_result(owner, profile_id, r):
+    """
+    Persist one device's topology scan result (full table or delta) and
+    fill r['neighbors'] with the complete table for the browser.
+    """
+    ip = r['ip']
+    node = db.topology_nodes.find_one({'owner': owner, 'ip': ip}, {'fingerprint': 1}) or {}
+
+    changes = link_changes(node.get('fingerprint'), r)
+    if changes is None:
+        # store ไม่ตรงกับ base ของ agent → ล้าง fingerprint ให้รอบหน้าส่ง full มา
+        db.topology_nodes.update_one({'owner': owner, 'ip': ip}, {'$set': {'fingerprint': None}})
+    else:
+        replace_all, upserts, removed = changes
+        if replace_all:
+            db.topology_links.delete_many({'owner': owner, 'device_ip': ip})
+            if upserts:
+                db.topology_links.insert_many(
+                    [_link_doc(owner, profile_id, ip, r.get('hostname'), n) for n in upserts]
+                )
+        else:
+            if removed:
+                db.topology_links.delete_many({'owner': owner, 'device_ip': ip, 'key': {'$in': removed}})
+            for n in upserts:
+                db.topology_links.replace_one(
+                    {'owner': owner, 'device_ip': ip, 'key': n['key']},
+                    _link_doc(owner, profile_id, ip, r.get('hostname'), n),
+                    upsert=True
+                )
+        _set_topology_node(owner, profile_id, r, r.get('fingerprint'))
+
+    if r.get('mode') == 'delta':
+        r['neighbors'] = [
+            {k: l.get(k, '') for k in ('local_port', 'neighbor', 'remote_port', 'mgmt_ip',
+                                        'port_desc', 'update_time', 'sys_desc')}
+            for l in db.topology_links.find({'owner': owner, 'device_ip': ip})
+        ]
+
+
+def _set_topology_node(owner, profile_id, r, fingerprint):
+    update = {
+        'owner': owner,
+        'ip': r['ip'],
+        'hostname': r.get('hostname'),
+        'sn': r.get('sn', ''),
+        'fingerprint': fingerprint,
+        'updated_at': dt.datetime.now(thai_tz),
+    }
+    if profile_id:
+        update['profile_id'] = profile_id
+    if r.get('device_id'):
+        update['device_id'] = r['device_id']
+    db.topology_nodes.update_one({'owner': owner, 'ip': r['ip']}, {'$set': update}, upsert=True)
+
+
+def get_topology_graph(owner, profile_id=None):
+    """
+    In-memory graph for one profile, rebuilt only when the store changed
+    (every applied scan bumps topology_nodes.updated_at).
+    """
+    query = {'owner': owner}
+    if profile_id:
+        query['profile_id'] = profile_id
+    latest = db.topology_nodes.find_one(query, {'updated_at': 1}, sort=[('updated_at', -1)])
+    stamp = latest.get('updated_at') if latest else None
+
+    key = (owner, profile_id)
+    cached = topology_graph_cache.get(key)
+    if cached and cached[0] == stamp:
+        return cached[1]
+
+    nodes = list(db.topology_nodes.find(query, {'ip': 1, 'hostname': 1}))
+    links = list(db.topology_links.find(query, {
+        'device_ip': 1, 'device_hostname': 1, 'local_port': 1,
+        'neighbor': 1, 'remote_port': 1, 'mgmt_ip': 1
+    }))
+    graph = TopologyGraph.from_links(nodes, links)
+    topology_graph_cache[key] = (stamp, graph)
+    return graph
+
+
+# Section header ที่ agent เขียนใน backup:  "👉 {section_name} ({cmd})" ล้อมด้วยเส้น ====
+SECTION_HEADER_RE = re.compile(r'^={20,}\n👉 (?P<name>.+?) \((?P<cmd>.*)\)\n={20,}\n', re.MULTILINE)
+
+
+def split_backup_sections(text):
+    """Split a stored backup into {section_name: (command, output)}."""
+    sections = {}
+    matches = list(SECTION_HEADER_RE.finditer(text or ''))
+    for i, m in enumerate(matches):
+        end = matches[i + 1].start() if i + 1 < len(matches) else len(text)
+        sections[m.group('name')] = (m.group('cmd'), text[m.end():end].strip('\n'))
+    return sections
+
+
+def rebuild_backup_output(data):
+    """
+    Backup uploaded as section hashes / diffs → full text, using section_blobs as the
+    content store. Raises LookupError / ValueError when the agent's base is not here.
+    """
+    wire_sections = data.get('sections') or []
+    needed = {e.get('base', e['hash']) for e in wire_sections if 'text' not in e}
+    blobs = {b['_id']: b['text'] for b in db.section_blobs.find({'_id': {'$in': list(needed)}})} if needed else {}
+    sections = decode_sections(wire_sections, blobs.get)
+
+    now = dt.datetime.now(thai_tz)
+    ops = [UpdateOne({'_id': e['hash']}, {'$setOnInsert': {'text': body}, '$set': {'last_seen': now}}, upsert=True)
+           for e, (_, _, body) in zip(wire_sections, sections)]
+    if ops:
+        try:
+            db.section_blobs.bulk_write(ops, ordered=False)
+        except BulkWriteError:
+            pass    # upsert ชนกันจาก backup พร้อมกัน — blob มีอยู่แล้ว
+    return render_backup(data.get('header', ''), sections)
+
+
+def request_full_backup(owner, device_id, run_id=None):
+    """Server could not rebuild a section upload → ask the agent for the whole text once."""
+    try:
+        device = db.devices.find_one({'_id': ObjectId(device_id), 'owner': owner})
+    except Exception:
+        device = None
+    if not device:
+        return
+    dispatch_task(owner, {
+        'type': 'backup',
+        'device': serialize_doc(device),
+        'device_id': device_id,
+        'owner': owner,
+        'run_id': run_id,
+        'full_upload': True,
+    })
+
+
+def store_config_diff(owner, ip, hostname, change, source):
+    """Before/after diff of a transactional push (committed or rolled back)."""
+    db.config_diffs.insert_one({
+        'owner': owner,
+        'ip': ip,
+        'hostname': hostname,
+        'source': source,
+        'timestamp': dt.datetime.now(thai_tz),
+        **change,
+    })
+
+
+# ────────────────────────────────────────────────
+#   Operational state (MAC / ARP / Route / Interface tables)
+# ────────────────────────────────────────────────
+def index_backup_state(owner, device_id, hostname, config_data, backup_id=None):
+    """Parse a successful backup's show-command sections and replace that device's state rows."""
+    device = None
+    if device_id:
+        try:
+            device = db.devices.find_one({'_id': ObjectId(device_id), 'owner': owner},
+                                         {'device_type': 1, 'profile_id': 1, 'ip_address': 1})
+        except Exception:
+            device = None
+    if not device:
+        return
+
+    parsed = parse_backup_state(split_backup_sections(config_data), device.get('device_type', ''))
+    now = dt.datetime.now(thai_tz)
+    base = {
+        'owner': owner,
+        'device_id': device_id,
+        'hostname': hostname,
+        'device_ip': device.get('ip_address'),
+        'profile_id': device.get('profile_id'),
+        'backup_id': backup_id,
+        'updated_at': now,
+    }
+    for table, rows in parsed.items():
+        coll = db[f'state_{table}']
+        coll.delete_many({'owner': owner, 'device_id': device_id})
+        if rows:
+            coll.insert_many([{**base, **row} for row in rows], ordered=False)
+    print(f"[STATE] {hostname}: " + ", ".join(f"{t}={len(r)}" for t, r in parsed.items()))
+
+    try:
+        refresh_endpoint_index(owner, base, parsed)
+    except Exception as e:
+        print(f"Error updating endpoint index: {e}")
+
+
+def refresh_endpoint_index(owner, base, parsed):
+    """
+    Incremental update of the MAC → (device, port, vlan) and IP → MAC lookups
+    from one device's freshly parsed state. Only this device's entries are touched.
+    """
+    device_id = base['device_id']
+    now = base['updated_at']
+    where = {'device_id': device_id, 'hostname': base['hostname'], 'device_ip': base['device_ip'],
+             'profile_id': base['profile_id'], 'seen_at': now}
+
+    lldp_ports = []
+    if base['device_ip'] and 'mac' in parsed:
+        lldp_ports = [l.get('local_port') for l in
+                      db.topology_links.find({'owner': owner, 'device_ip': base['device_ip']}, {'local_port': 1})]
+    locations, ips = endpoint_entries(parsed, lldp_ports, UPLINK_MAC_THRESHOLD)
+
+    if locations is not None:
+        ops = [UpdateOne({'owner': owner, 'mac': mac}, {'$set': {**where, **loc}}, upsert=True)
+               for mac, loc in locations.items()]
+        if ops:
+            db.endpoint_locations.bulk_write(ops, ordered=False)
+        # MAC ที่เคยอยู่บน device นี้แต่รอบนี้ไม่เห็นแล้ว (ย้ายไปที่อื่นจะถูก upsert ทับโดย device ใหม่อยู่แล้ว)
+        db.endpoint_locations.delete_many({'owner': owner, 'device_id': device_id, 'seen_at': {'$lt': now}})
+
+    if ips is not None:
+        ops = [UpdateOne({'owner': owner, 'ip': ip}, {'$set': {**where, **row}}, upsert=True)
+               for ip, row in ips.items()]
+        if ops:
+            db.endpoint_ips.bulk_write(ops, ordered=False)
+        db.endpoint_ips.delete_many({'owner': owner, 'device_id': device_id, 'seen_at': {'$lt': now}})
+
+
 # ────────────────────────────────────────────────
 #   Agent Version Check (public — no auth needed)
 # ────────────────────────────────────────────────
@@ -187,6 +595,7 @@ def agent_version():
 # ────────────────────────────────────────────────
 @socketio.on('task_result')
 def handle_task_result(data):
+    data = wire.unpack(data, stats=wire_stats, direction='from_agent')
     task_type = data.get('type')
     status = data.get('status')
     hostname = data.get('hostname')
@@ -194,8 +603,54 @@ def handle_task_result(data):
 
     print(f"[TASK RESULT] {task_type} - {hostname} - {status} (owner: {owner})")
 
+    # ✅ ผลที่ agent spool ไว้ตอนหลุดอาจถูก replay ซ้ำ (ack หาย) → รับครั้งเดียวต่อ result_id
+    if data.get('result_id'):
+        try:
+            db.agent_results.insert_one({'_id': data['result_id'], 'owner': owner,
+                                         'type': task_type, 'at': dt.datetime.now(thai_tz)})
+        except DuplicateKeyError:
+            print(f"[TASK RESULT] duplicate {data['result_id']} ignored")
+            return {'status': 'duplicate'}
+    try:
+        process_task_result(data)
+    except Exception as e:
+        if not data.get('result_id'):
+            raise
+        # ประมวลผลไม่สำเร็จ → ปล่อย result_id คืน แล้ว ack เป็น error ให้ agent เก็บไว้ใน spool ส่งใหม่
+        traceback.print_exc()
+        db.agent_results.delete_one({'_id': data['result_id']})
+        return {'status': 'error', 'error': str(e)}
+    # ack ของ sio.call ฝั่ง agent — ได้ค่านี้แล้ว agent ถึงลบผลออกจาก spool
+    return {'status': 'ok'}
+
+
+def process_task_result(data):
+    """Apply one (already de-duplicated) agent result; raises when it could not be stored."""
+    task_type = data.get('type')
+    status = data.get('status')
+    hostname = data.get('hostname')
+    owner = data.get('owner')
+
     # 1. กรณีเป็นงาน Backup
     if task_type == 'backup':
+        # ✅ device ที่ถูกยกเลิกกลาง batch — ไม่มี backup ให้เก็บ แค่ปิดรายการใน run
+        if status == 'Cancelled':
+            if data.get('run_id'):
+                record_run_result(data['run_id'], data.get('device_id'), status, 'Cancelled by user')
+            socketio.emit('backup_update', {
+                'device_id': data.get('device_id'), 'hostname': hostname, 'status': status,
+                'percent': 100, 'msg': 'Cancelled', 'output': ''
+            })
+            return
+
+        # ✅ agent ส่งมาแบบ section hash / diff → ประกอบกลับเป็น output เต็มก่อน
+        if status == 'Success' and data.get('sections') is not None:
+            try:
+                data['output'] = rebuild_backup_output(data)
+            except (LookupError, ValueError) as e:
+                print(f"[BACKUP] {hostname}: {e} → requesting full upload")
+                request_full_backup(owner, data.get('device_id'), data.get('run_id'))
+                return
         # ✅ บันทึกลง DB เฉพาะเมื่อเสร็จจริงๆ (Success / Failed) เพื่อหลีกเลี่ยง NameError ตอน status='Running'
         if status in ['Success', 'Failed']:
             backup_doc = {
@@ -204,9 +659,20 @@ def handle_task_result(data):
                 'owner': owner,
                 'config_data': data.get('output', '') if status == 'Success' else data.get('output', str(data.get('error', 'Unknown error'))),
                 'status': status,
-                'timestamp': dt.datetime.now(thai_tz),
+                # ผลที่ replay จาก spool ใช้เวลาที่ agent ทำเสร็จจริง
+                'timestamp': datetime.fromtimestamp(data['produced_at'], thai_tz)
+                             if data.get('produced_at') else dt.datetime.now(thai_tz),
             }
-            db.backups.insert_one(backup_doc)
+            inserted = db.backups.insert_one(backup_doc)
+            if status == 'Success' and owner:
+                # parse ตารางสถานะใน background ไม่ให้ handler ช้า
+                socketio.start_background_task(
+                    index_backup_state, owner, data.get('device_id'), hostname,
+                    backup_doc['config_data'], str(inserted.inserted_id)
+                )
+            if data.get('run_id'):
+                record_run_result(data['run_id'], data.get('device_id'), status,
+                                  None if status == 'Success' else backup_doc['config_data'][:500])
 
         # ✅ ส่งสถานะออก frontend ทุกครั้งไม่ว่าจะ Running / Success / Failed
         socketio.emit('backup_update', {
@@ -220,6 +686,8 @@ def handle_task_result(data):
 
     # 2. กรณีเป็นงาน Command / Config ธรรมดา ให้ส่งเข้า Terminal
     elif task_type in ['run_command', 'push_config']:
+        if task_type == 'push_config' and data.get('change') and owner:
+            store_config_diff(owner, data.get('ip'), hostname, data['change'], 'push_config')
         socketio.emit('terminal_update', data)
         
     # ✅ 3. กรณีเป็น Batch Config ให้แยกส่ง Event ไปหาหน้าต่าง Batch โดยเฉพาะ!
@@ -238,14 +706,49 @@ def handle_task_result(data):
                 'summary': summary,
                 'details': data.get('details', [])
             }
+            if data.get('waves'):
+                report_doc['waves'] = data['waves']
+                report_doc['aborted'] = data.get('aborted')
             db.batch_reports.insert_one(report_doc)
+
+        # ✅ diff ก่อน/หลังของ transactional push แยกเก็บต่อ device
+        if owner:
+            for d in data.get('details', []):
+                if d.get('change'):
+                    store_config_diff(owner, d.get('ip'), d.get('host'), d['change'], 'batch_config')
             
         socketio.emit('batch_config_result', data)
+
+    # ✅ agent มี run ค้างใน journal → ส่งเฉพาะเครื่องที่ยังไม่เสร็จกลับไป
+    elif task_type == 'batch_resume':
+        if owner and agent_connections.get(request.sid) == owner and data.get('run_id'):
+            resume_backup_run(owner, data['run_id'], data.get('done') or [], request.sid)
+
+    # ✅ agent จบ job (ปกติหรือถูกยกเลิก)
+    elif task_type == 'job_status':
+        if owner and data.get('job_id'):
+            db.jobs.update_one({'job_id': data['job_id'], 'owner': owner}, {'$set': {
+                'status': data.get('status'),
+                'finished_at': dt.datetime.now(thai_tz),
+                'summary': data.get('summary', {}),
+            }})
+        if owner and data.get('lanes'):
+            agent_lane_stats[owner] = {'lanes': data['lanes'], 'reported_at': dt.datetime.now(thai_tz).isoformat()}
+        socketio.emit('job_status', data)
+
+    # ✅ ผลของแต่ละ wave ตอน rolling rollout
+    elif task_type == 'batch_config_wave':
+        socketio.emit('batch_config_wave', data)
     # 4. Topology scan result — forward to the monitoring page
     elif task_type == 'topology_scan':
         results = data.get('results', [])
         if owner:
             for r in results:
+                if r.get('status') == 'Success' and r.get('ip'):
+                    try:
+                        apply_topology_result(owner, data.get('profile_id'), r)
+                    except Exception as e:
+                        print(f"Error updating topology store: {e}")
                 if r.get('status') == 'Success' and r.get('ip') and r.get('hostname'):
                     try:
                         db.devices.update_many(
@@ -257,6 +760,29 @@ def handle_task_result(data):
                         
         socketio.emit('topology_result', data)
 
+    # 5. Topology crawl — progress ต่อ device และ inventory ตอนจบ
+    elif task_type == 'topology_crawl_progress':
+        socketio.emit('topology_crawl_progress', data)
+
+    elif task_type == 'topology_crawl':
+        if owner:
+            for r in data.get('results', []):
+                if r.get('status') == 'Success' and r.get('ip'):
+                    try:
+                        apply_topology_result(owner, data.get('profile_id'), r)
+                    except Exception as e:
+                        print(f"Error updating topology store: {e}")
+            db.discovery_runs.update_one(
+                {'crawl_id': data.get('crawl_id'), 'owner': owner},
+                {'$set': {
+                    'status': 'done',
+                    'finished_at': dt.datetime.now(thai_tz),
+                    'summary': data.get('summary', {}),
+                    'inventory': data.get('inventory', []),
+                }}
+            )
+        socketio.emit('topology_crawl_result', {k: v for k, v in data.items() if k != 'results'})
+
 
 # ────────────────────────────────────────────────
 #             API ROUTES
@@ -284,15 +810,106 @@ def handle_register_agent(data):
     join_room(user)
     #บันทึกว่า User นี้มี Agent ออนไลน์อยู่
     agent_connections[request.sid] = user
-    emit('agent_auth_success', {'user': user})
+    # Agent รุ่นเก่าไม่ส่ง compression มา → codec = None (ส่ง JSON ธรรมดา)
+    codec = wire.negotiate(data.get('compression'))
+    agent_codecs[request.sid] = codec
+    # ✅ agent รุ่นใหม่รับ device แบบ credential_id แล้วขอ credential เอง (ถ้า server ตั้ง vault key ไว้)
+    #    credential_vault = X25519 public key ของ agent → ตอบ public key ของ server กลับไป (session key ไม่ขึ้น wire)
+    vault_pub = None
+    if isinstance(data.get('credential_vault'), str) and vault_cipher:
+        private, vault_pub = session_keypair()
+        try:
+            agent_vaults[request.sid] = session_cipher(private, data['credential_vault'])
+        except ValueError:
+            vault_pub = None
+    emit('agent_auth_success', {'user': user, 'compression': codec, 'section_delta': True,
+                                'credential_vault': vault_pub})
     print(f"Agent authenticated and joined room: {user}")
 
 @socketio.on('disconnect')
 def handle_disconnect():
+    agent_codecs.pop(request.sid, None)
+    agent_vaults.pop(request.sid, None)
     if request.sid in agent_connections:
         user = agent_connections.pop(request.sid)
         print(f"⚠️ Agent disconnected for user: {user}")
 
+
+@socketio.on('get_credentials')
+def handle_get_credentials(data):
+    """Agent asks for credential sets by id → re-encrypted with that agent's session key."""
+    owner = agent_connections.get(request.sid)
+    cipher = agent_vaults.get(request.sid)
+    if not owner or not cipher:
+        return {'credentials': {}}
+    ids = [str(i) for i in ((data or {}).get('ids') or [])][:1000]
+    creds = load_credentials(owner, ids)
+    if creds:
+        db.credential_sets.update_many({'cred_id': {'$in': list(creds)}},
+                                       {'$set': {'last_used': dt.datetime.now(thai_tz)}})
+    return {'credentials': {cid: seal(cipher, c) for cid, c in creds.items()}}
+
+@app.route('/api/jobs', methods=['GET'])
+def api_jobs():
+    current_user = request.headers.get('X-Username')
+    if not current_user:
+        return jsonify({'error': 'Unauthorized'}), 401
+    query = {'owner': current_user}
+    if request.args.get('status'):
+        query['status'] = request.args['status']
+    jobs = db.jobs.find(query).sort('created_at', -1).limit(100)
+    return jsonify([serialize_doc(j) for j in jobs])
+
+
+@app.route('/api/jobs/<job_id>/cancel', methods=['POST'])
+def api_cancel_job(job_id):
+    """Stop a running batch: agent cancels queued devices and aborts in-flight backups."""
+    current_user = request.headers.get('X-Username')
+    if not current_user:
+        return jsonify({'error': 'Unauthorized'}), 401
+    job = db.jobs.find_one_and_update(
+        {'job_id': job_id, 'owner': current_user, 'status': {'$in': ['running', 'cancelling']}},
+        {'$set': {'status': 'cancelling', 'cancel_requested_at': dt.datetime.now(thai_tz)}},
+        return_document=ReturnDocument.AFTER
+    )
+    if not job:
+        if db.jobs.find_one({'job_id': job_id, 'owner': current_user}):
+            return jsonify({'error': 'Job already finished'}), 409
+        return jsonify({'error': 'Job not found'}), 404
+
+    if job.get('run_id'):
+        # run ที่ถูกยกเลิกไม่ต้อง retry / resume
+        db.backup_runs.update_one({'run_id': job['run_id']}, {'$set': {'cancelled': True}})
+    sent = 0
+    for sid, user in list(agent_connections.items()):
+        if user == current_user:
+            socketio.emit('cancel_task', {'job_id': job_id}, to=sid)
+            sent += 1
+    if not sent:
+        # ไม่มี agent online ให้ตอบ job_status → ปิด job เลย (agent ที่กลับมาจะถูกปฏิเสธ resume เพราะ run ถูก cancel แล้ว)
+        db.jobs.update_one({'job_id': job_id, 'status': 'cancelling'},
+                           {'$set': {'status': 'cancelled', 'finished_at': dt.datetime.now(thai_tz)}})
+        return jsonify({'status': 'cancelled', 'job_id': job_id, 'agents': 0})
+    return jsonify({'status': 'cancelling', 'job_id': job_id, 'agents': sent})
+
+
+@app.route('/api/agent/wire_stats', methods=['GET'])
+def get_wire_stats():
+    """Bytes-on-wire vs raw JSON size for agent traffic since server start."""
+    current_user = request.headers.get('X-Username')
+    if not current_user:
+        return jsonify({'error': 'Unauthorized'}), 401
+    return jsonify(wire_stats.snapshot())
+
+
+@app.route('/api/agent/lanes', methods=['GET'])
+def get_agent_lanes():
+    """Queue depth and queue-wait percentiles per agent priority lane (as of the last finished job)."""
+    current_user = request.headers.get('X-Username')
+    if not current_user:
+        return jsonify({'error': 'Unauthorized'}), 401
+    return jsonify(agent_lane_stats.get(current_user) or {'lanes': {}, 'reported_at': None})
+
 @app.route('/api/download-agent', methods=['GET'])
 def download_agent():
     """Serve the NetPilot Agent exe for download."""
@@ -317,21 +934,30 @@ def api_batch_config():
     devices = data.get('devices', [])          # list of device dicts
     commands = data.get('commands', [])
     profile_id = data.get('profile_id')  # รับจาก frontend
+    rollout = data.get('rollout')        # ✅ optional: {canary, growth, max_wave, abort_threshold, health_commands, pause_seconds}
 
     if not devices or not commands:
         return jsonify({'error': 'Missing devices or commands'}), 400
+    if rollout is not None:
+        problem = validate_rollout(rollout)
+        if problem:
+            return jsonify({'error': problem}), 400
 
     # ส่งงานไป agent พร้อม profile_id
-    socketio.emit('execute_task', {
+    task = {
         'type': 'batch_config',
         'devices': devices,
         'commands': commands,
         'owner': current_user,
-        'profile_id': profile_id
-    })
+        'profile_id': profile_id,
+        'rollout': rollout,
+        'transactional': bool(data.get('transactional'))
+    }
+    dispatch_task(current_user, task)
 
     return jsonify({
         'status': 'dispatched',
+        'job_id': task['job_id'],
         'message': f'Batch config sent to agents ({len(devices)} devices)'
     })
 
@@ -358,13 +984,407 @@ def api_topology_scan():
 
     devices = [serialize_doc(d) for d in devices]
 
-    socketio.emit('execute_task', {
+    # fingerprint ของตาราง LLDP ที่ server มีอยู่ → agent ส่งมาเฉพาะส่วนที่เปลี่ยน
+    fingerprints = {
+        n['ip']: n['fingerprint']
+        for n in db.topology_nodes.find(
+            {'owner': current_user, 'ip': {'$in': [d.get('ip_address') for d in devices]}},
+            {'ip': 1, 'fingerprint': 1}
+        ) if n.get('fingerprint')
+    }
+
+    task = {
         'type':    'topology_scan',
         'devices': devices,
         'owner':   current_user,
+        'profile_id': profile_id,
+        'fingerprints': fingerprints,
+    }
+    dispatch_task(current_user, task)
+
+    return jsonify({'status': 'dispatched', 'job_id': task['job_id'], 'total_devices': len(devices)})
+
+
+@app.route('/api/topology/crawl', methods=['POST'])
+def api_topology_crawl():
+    """
+    Discover devices by following LLDP neighbors from seed devices.
+    Body: profile_id, seed_ids (optional, default = all devices in profile),
+          max_depth, max_devices, scope (list of CIDR to stay inside)
+    """
+    current_user = request.headers.get('X-Username')
+    if not current_user:
+        return jsonify({'error': 'Unauthorized'}), 401
+    if current_user not in agent_connections.values():
+        return jsonify({'status': 'Failed', 'message': 'Agent Offline: กรุณาเปิดโปรแกรม NETPILOT Agent ก่อน'}), 400
+
+    data       = request.json or {}
+    profile_id = data.get('profile_id')
+    seed_ids   = data.get('seed_ids')
+
+    query = {'owner': current_user}
+    if profile_id:
+        query['profile_id'] = profile_id
+    if seed_ids:
+        query['_id'] = {'$in': [ObjectId(i) for i in seed_ids]}
+    seeds = [serialize_doc(d) for d in db.devices.find(query)]
+    if not seeds:
+        return jsonify({'error': 'No seed devices found'}), 404
+
+    crawl_id = secrets.token_hex(8)
+    params = {
+        'max_depth': int(data.get('max_depth', 3)),
+        'max_devices': int(data.get('max_devices', 500)),
+        'scope': data.get('scope') or [],
+    }
+    db.discovery_runs.insert_one({
+        'crawl_id': crawl_id,
+        'owner': current_user,
+        'profile_id': profile_id,
+        'status': 'running',
+        'params': params,
+        'seed_count': len(seeds),
+        'started_at': dt.datetime.now(thai_tz),
+    })
+
+    task = dict(params, **{
+        'type': 'topology_crawl',
+        'crawl_id': crawl_id,
+        'devices': seeds,
+        'owner': current_user,
+        'profile_id': profile_id,
+    })
+    dispatch_task(current_user, task)
+    return jsonify({'status': 'dispatched', 'job_id': task['job_id'], 'crawl_id': crawl_id, 'seeds': len(seeds)})
+
+
+@app.route('/api/topology/crawl/<crawl_id>', methods=['GET'])
+def api_topology_crawl_result(crawl_id):
+    current_user = request.headers.get('X-Username')
+    if not current_user:
+        return jsonify({'error': 'Unauthorized'}), 401
+    run = db.discovery_runs.find_one({'crawl_id': crawl_id, 'owner': current_user}, {'_id': 0})
+    if not run:
+        return jsonify({'error': 'Crawl not found'}), 404
+    return jsonify(serialize_doc(run))
+
+
+@app.route('/api/topology/graph', methods=['GET'])
+def api_topology_graph():
+    current_user = request.headers.get('X-Username')
+    if not current_user:
+        return jsonify({'error': 'Unauthorized'}), 401
+    graph = get_topology_graph(current_user, request.args.get('profile_id'))
+    return jsonify(graph.to_dict())
+
+
+@app.route('/api/topology/path', methods=['GET'])
+def api_topology_path():
+    """Shortest path between two devices. Query: src, dst (IP or hostname), profile_id"""
+    current_user = request.headers.get('X-Username')
+    if not current_user:
+        return jsonify({'error': 'Unauthorized'}), 401
+    graph = get_topology_graph(current_user, request.args.get('profile_id'))
+    src = graph.resolve(request.args.get('src'))
+    dst = graph.resolve(request.args.get('dst'))
+    if not src or not dst:
+        return jsonify({'error': 'src or dst not found in topology'}), 404
+    hops = graph.shortest_path(src, dst)
+    if hops is None:
+        return jsonify({'src': src, 'dst': dst, 'connected': False, 'hops': []})
+    return jsonify({'src': src, 'dst': dst, 'connected': True, 'hop_count': len(hops) - 1, 'hops': hops})
+
+
+@app.route('/api/topology/impact', methods=['GET'])
+def api_topology_impact():
+    """Devices cut off from the core if a device (or one of its ports) goes down. Query: device, port, root, profile_id"""
+    current_user = request.headers.get('X-Username')
+    if not current_user:
+        return jsonify({'error': 'Unauthorized'}), 401
+    graph = get_topology_graph(current_user, request.args.get('profile_id'))
+    device = graph.resolve(request.args.get('device'))
+    if not device:
+        return jsonify({'error': 'device not found in topology'}), 404
+    result = graph.blast_radius(device, port=request.args.get('port'),
+                                root=graph.resolve(request.args.get('root')))
+    result.update({'device': device, 'port': request.args.get('port'), 'count': len(result['affected'])})
+    return jsonify(result)
+
+
+@app.route('/api/topology/orphans', methods=['GET'])
+def api_topology_orphans():
+    """Inventory devices without any adjacency, and LLDP neighbors that are not in the inventory."""
+    current_user = request.headers.get('X-Username')
+    if not current_user:
+        return jsonify({'error': 'Unauthorized'}), 401
+    profile_id = request.args.get('profile_id')
+    query = {'owner': current_user}
+    if profile_id:
+        query['profile_id'] = profile_id
+    inventory = [d['ip_address'] for d in db.devices.find(query, {'ip_address': 1}) if d.get('ip_address')]
+    graph = get_topology_graph(current_user, profile_id)
+    return jsonify(graph.orphans(inventory))
+
+
+@app.route('/api/state/<table>', methods=['GET'])
+def api_state_query(table):
+    """
+    Query parsed operational state across devices.
+    Filters: mac, ip, prefix, vlan, interface, device_id, profile_id, hostname
+    """
+    current_user = request.headers.get('X-Username')
+    if not current_user:
+        return jsonify({'error': 'Unauthorized'}), 401
+    if table not in STATE_TABLES:
+        return jsonify({'error': f'Unknown table (use one of {", ".join(STATE_TABLES)})'}), 400
+
+    query = {'owner': current_user}
+    args = request.args
+    if args.get('mac'):
+        mac = normalize_mac(args['mac'])
+        if not mac:
+            return jsonify({'error': 'Invalid MAC address'}), 400
+        query['mac'] = mac
+    for field in ('ip', 'prefix', 'interface', 'device_id', 'profile_id', 'hostname'):
+        if args.get(field):
+            query[field] = args[field]
+    if args.get('vlan'):
+        try:
+            query['vlan'] = int(args['vlan'])
+        except ValueError:
+            return jsonify({'error': 'vlan must be a number'}), 400
+
+    limit = min(int(args.get('limit', STATE_QUERY_LIMIT)), STATE_QUERY_LIMIT)
+    rows = [serialize_doc(d) for d in db[f'state_{table}'].find(query).limit(limit)]
+    return jsonify({'table': table, 'count': len(rows), 'rows': rows})
+
+
+@app.route('/api/locate', methods=['GET'])
+def api_locate():
+    """Where is this endpoint plugged in?  ?mac=<any notation>  or  ?ip=<ipv4>"""
+    current_user = request.headers.get('X-Username')
+    if not current_user:
+        return jsonify({'error': 'Unauthorized'}), 401
+
+    ip = request.args.get('ip')
+    mac = request.args.get('mac')
+    arp = None
+    if ip:
+        arp = db.endpoint_ips.find_one({'owner': current_user, 'ip': ip}, {'_id': 0, 'owner': 0})
+        if not arp:
+            return jsonify({'found': False, 'ip': ip, 'message': 'IP not found in any ARP table'}), 404
+        mac = arp['mac']
+    elif mac:
+        mac = normalize_mac(mac)
+        if not mac:
+            return jsonify({'error': 'Invalid MAC address'}), 400
+    else:
+        return jsonify({'error': 'mac or ip is required'}), 400
+
+    loc = db.endpoint_locations.find_one({'owner': current_user, 'mac': mac}, {'_id': 0, 'owner': 0})
+    if arp is None:
+        arp = db.endpoint_ips.find_one({'owner': current_user, 'mac': mac}, {'_id': 0, 'owner': 0})
+    return jsonify({
+        'found': loc is not None,
+        'mac': mac,
+        'ip': arp['ip'] if arp else ip,
+        'location': serialize_doc(loc) if loc else None,
+        'arp': serialize_doc(arp) if arp else None,
+    }), (200 if loc else 404)
+
+
+@app.route('/api/config_diffs', methods=['GET'])
+def api_config_diffs():
+    """Stored before/after diffs from transactional pushes. Filters: ip, hostname, status"""
+    current_user = request.headers.get('X-Username')
+    if not current_user:
+        return jsonify({'error': 'Unauthorized'}), 401
+    query = {'owner': current_user}
+    for field in ('ip', 'hostname', 'status'):
+        if request.args.get(field):
+            query[field] = request.args[field]
+    limit = min(int(request.args.get('limit', 50)), 500)
+    return jsonify([serialize_doc(d) for d in db.config_diffs.find(query).sort('timestamp', -1).limit(limit)])
+
+
+# ────────────────────────────────────────────────
+#   Config templates (Jinja2, body แยกต่อ vendor family)
+# ────────────────────────────────────────────────
+TEMPLATE_PREVIEW_LIMIT = 50
+SPREADSHEET_SECRET_COLS = {'username', 'password', 'secret', 'enable'}
+
+
+def spreadsheet_vars(file):
+    """Excel/CSV upload → {ip: {column: value}} (credential columns are never template vars)."""
+    if file.filename.lower().endswith('.csv'):
+        df = pd.read_csv(file)
+    else:
+        df = pd.read_excel(file)
+    df.columns = df.columns.str.lower().str.strip().str.replace(' ', '_')
+    ip_col = 'ip_address' if 'ip_address' in df.columns else 'ip' if 'ip' in df.columns else None
+    if not ip_col:
+        raise ValueError('Spreadsheet needs an "IP Address" column')
+    out = {}
+    for row in df.to_dict('records'):
+        ip = str(row.pop(ip_col) or '').strip()
+        if not ip or ip == 'nan':
+            continue
+        out[ip] = {k: (v.item() if hasattr(v, 'item') else v) for k, v in row.items()
+                   if k not in SPREADSHEET_SECRET_COLS and pd.notna(v)}
+    return out
+
+
+def template_targets(owner):
+    """
+    Devices + per-device vars for preview/dispatch.
+    JSON: {device_ids | profile_id, vars: {ip: {...}}, common_vars}
+    multipart: form fields profile_id / common_vars (JSON string) + file=<spreadsheet>
+    """
+    if request.files.get('file'):
+        body = dict(request.form)
+        body['common_vars'] = json.loads(body.get('common_vars') or '{}')
+        per_ip = spreadsheet_vars(request.files['file'])
+    else:
+        body = request.json or {}
+        per_ip = body.get('vars') or {}
+
+    query = {'owner': owner}
+    if body.get('device_ids'):
+        query['_id'] = {'$in': [ObjectId(i) for i in body['device_ids']]}
+    elif body.get('profile_id'):
+        query['profile_id'] = body['profile_id']
+    if request.files.get('file') and not body.get('device_ids'):
+        query['ip_address'] = {'$in': list(per_ip)}
+
+    targets = [{'device': serialize_doc(d), 'vars': per_ip.get(d.get('ip_address'), {})}
+               for d in db.devices.find(query)]
+    return targets, body.get('common_vars') or {}, body
+
+
+def _load_template(owner, template_id):
+    try:
+        return db.config_templates.find_one({'_id': ObjectId(template_id), 'owner': owner})
+    except Exception:
+        return None
+
+
+@app.route('/api/templates', methods=['GET', 'POST'])
+def api_templates():
+    current_user = request.headers.get('X-Username')
+    if not current_user:
+        return jsonify({'error': 'Unauthorized'}), 401
+
+    if request.method == 'GET':
+        return jsonify([serialize_doc(t) for t in db.config_templates.find({'owner': current_user})])
+
+    body = request.json or {}
+    bodies = body.get('bodies') or ({'default': body['body']} if body.get('body') else None)
+    if not body.get('name') or not bodies:
+        return jsonify({'error': 'name and bodies (or body) are required'}), 400
+    errors = validate_bodies(bodies)
+    if errors:
+        return jsonify({'error': 'Template syntax error', 'details': errors}), 400
+    if db.config_templates.find_one({'owner': current_user, 'name': body['name']}):
+        return jsonify({'error': 'Template name already exists'}), 409
+
+    doc = {
+        'owner': current_user,
+        'name': body['name'],
+        'description': body.get('description', ''),
+        'bodies': bodies,
+        'version': 1,
+        'updated_at': dt.datetime.now(thai_tz),
+    }
+    _id = db.config_templates.insert_one(doc).inserted_id
+    return jsonify({'id': str(_id)}), 201
+
+
+@app.route('/api/templates/<template_id>', methods=['GET', 'PUT', 'DELETE'])
+def api_template_detail(template_id):
+    current_user = request.headers.get('X-Username')
+    if not current_user:
+        return jsonify({'error': 'Unauthorized'}), 401
+    tpl = _load_template(current_user, template_id)
+    if not tpl:
+        return jsonify({'error': 'Template not found'}), 404
+
+    if request.method == 'GET':
+        return jsonify(serialize_doc(tpl))
+    if request.method == 'DELETE':
+        db.config_templates.delete_one({'_id': tpl['_id']})
+        return jsonify({'deleted': 1})
+
+    body = request.json or {}
+    update = {k: body[k] for k in ('name', 'description', 'bodies') if k in body}
+    if 'bodies' in update:
+        errors = validate_bodies(update['bodies'])
+        if errors:
+            return jsonify({'error': 'Template syntax error', 'details': errors}), 400
+    update['updated_at'] = dt.datetime.now(thai_tz)
+    db.config_templates.update_one({'_id': tpl['_id']}, {'$set': update, '$inc': {'version': 1}})
+    return jsonify(serialize_doc(db.config_templates.find_one({'_id': tpl['_id']})))
+
+
+@app.route('/api/templates/<template_id>/preview', methods=['POST'])
+def api_template_preview(template_id):
+    """Render the template for every target device; returns the first `limit` configs and all errors."""
+    current_user = request.headers.get('X-Username')
+    if not current_user:
+        return jsonify({'error': 'Unauthorized'}), 401
+    tpl = _load_template(current_user, template_id)
+    if not tpl:
+        return jsonify({'error': 'Template not found'}), 404
+    try:
+        targets, common, body = template_targets(current_user)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    t0 = dt.datetime.now()
+    results = render_bulk(tpl['bodies'], targets, common)
+    elapsed_ms = (dt.datetime.now() - t0).total_seconds() * 1000
+    errors = [r for r in results if 'error' in r]
+    limit = int(body.get('limit', TEMPLATE_PREVIEW_LIMIT))
+    return jsonify({
+        'template': tpl['name'],
+        'version': tpl.get('version', 1),
+        'devices': len(results),
+        'rendered': len(results) - len(errors),
+        'errors': errors,
+        'elapsed_ms': round(elapsed_ms, 1),
+        'cache': {'hits': TEMPLATE_CACHE.hits, 'misses': TEMPLATE_CACHE.misses},
+        'results': [r for r in results if 'commands' in r][:limit],
     })
 
-    return jsonify({'status': 'dispatched', 'total_devices': len(devices)})
+
+@app.route('/api/templates/<template_id>/dispatch', methods=['POST'])
+def api_template_dispatch(template_id):
+    """Send template bodies once + per-device vars; the agent renders locally before pushing."""
+    current_user = request.headers.get('X-Username')
+    if not current_user:
+        return jsonify({'error': 'Unauthorized'}), 401
+    if current_user not in agent_connections.values():
+        return jsonify({'status': 'Failed', 'message': 'Agent Offline: กรุณาเปิดโปรแกรม NETPILOT Agent ก่อน'}), 400
+    tpl = _load_template(current_user, template_id)
+    if not tpl:
+        return jsonify({'error': 'Template not found'}), 404
+    try:
+        targets, common, body = template_targets(current_user)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    if not targets:
+        return jsonify({'message': 'No devices found'}), 200
+
+    task = {
+        'type': 'batch_template',
+        'template': {'id': str(tpl['_id']), 'version': tpl.get('version', 1), 'bodies': tpl['bodies']},
+        'targets': targets,
+        'common_vars': common,
+        'owner': current_user,
+        'profile_id': body.get('profile_id'),
+        'transactional': str(body.get('transactional', '')).lower() in ('1', 'true'),
+    }
+    dispatch_task(current_user, task)
+    return jsonify({'status': 'dispatched', 'job_id': task['job_id'], 'total_devices': len(targets)})
 
 
 @app.route('/api/run_backup', methods=['POST'])
@@ -398,15 +1418,20 @@ def run_backup():
     # แปลง ObjectId และ datetime เป็น str ก่อนส่ง
     devices = [serialize_doc(dev) for dev in devices]
 
-    socketio.emit('execute_task', {
+    # ✅ run_id ให้ agent ทำ checkpoint ต่อ device และ resume ได้ถ้า agent ปิด/หลุดกลางทาง
+    run_id = create_backup_run(current_user, profile_id, devices, trigger='manual')
+    dispatch_task(current_user, {
         'type': 'batch_backup',
         'devices': devices,
         'owner': current_user,
-        'profile_id': profile_id
+        'profile_id': profile_id,
+        'run_id': run_id
     })
 
     return jsonify({
         'status': 'dispatched',
+        'run_id': run_id,
+        'job_id': run_id,
         'total_devices': len(devices),
         'message': 'Batch backup task has been sent to agents'
     })
@@ -430,22 +1455,26 @@ def config_vlan_ip():
     if not device or not vlan_range:
         return jsonify({'error': 'Missing parameters'}), 400
 
-    config_lines = generate_bulk_vlan_config(
-        device['device_type'],
-        vlan_range,
-        vlan_name,
-        svi_id,
-        ip_address,
-        subnet_mask
-    )
+    try:
+        config_lines = generate_bulk_vlan_config(
+            device['device_type'],
+            vlan_range,
+            vlan_name,
+            svi_id,
+            ip_address,
+            subnet_mask
+        )
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
 
     # ส่งไป agent พร้อม profile_id
-    socketio.emit('execute_task', {
+    dispatch_task(current_user, {
         'type': 'push_config',
         'device': device,
         'commands': config_lines,
         'owner': current_user,
-        'profile_id': profile_id
+        'profile_id': profile_id,
+        'transactional': bool(data.get('transactional'))
     })
 
     return jsonify({
@@ -561,16 +1590,20 @@ def batch_config_zip():
                 dispatched_count += 1
             
             # Dispatch directly to agent as ONE batch task
+            job_id = None
             if tasks:
-                socketio.emit('execute_task', {
+                task = {
                     'type': 'batch_config_zip',  # Important: trigger zip-specific batch flow
                     'tasks': tasks,
                     'owner': current_user,
                     'profile_id': profile_id
-                })
+                }
+                dispatch_task(current_user, task)
+                job_id = task['job_id']
 
             return jsonify({
                 'status': 'success',
+                'job_id': job_id,
                 'dispatched': dispatched_count,
                 'errors': errors,
                 'message': f'Successfully dispatched {dispatched_count} device configs.'
@@ -652,13 +1685,17 @@ def run_single_command():
     device = serialize_doc(device)
 
     # ส่งงานไป agent พร้อม profile_id
-    socketio.emit('execute_task', {
+    task = {
         'type': 'run_command',
         'device': device,
         'command': command,
         'owner': current_user,
         'profile_id': profile_id
-    })
+    }
+    # ✅ max_age (วินาที): output ใน show cache ของ agent ที่เก่าได้ไม่เกินนี้ (0 = ถามเครื่องจริงเสมอ)
+    if data.get('max_age') is not None:
+        task['max_age'] = float(data['max_age'])
+    dispatch_task(current_user, task)
 
     return jsonify({
         'status': 'dispatched',
@@ -711,6 +1748,146 @@ def get_backups():
     return jsonify(backups)
 
 
+@app.route('/api/backups/<backup_id>/lldp', methods=['GET'])
+def reparse_backup_lldp(backup_id):
+    """Re-parse the LLDP section of a stored backup with the shared lldp_parser."""
+    current_user = request.headers.get('X-Username')
+    if not current_user:
+        return jsonify({'error': 'Unauthorized'}), 401
+    backup = db.backups.find_one({'_id': ObjectId(backup_id), 'owner': current_user})
+    if not backup:
+        return jsonify({'error': 'Backup not found'}), 404
+
+    section = split_backup_sections(backup.get('config_data', '')).get('LLDP Neighbors')
+    if not section:
+        return jsonify({'error': 'Backup has no LLDP section'}), 404
+
+    device = None
+    if backup.get('device_id') and ObjectId.is_valid(backup['device_id']):
+        device = db.devices.find_one({'_id': ObjectId(backup['device_id'])}, {'device_type': 1})
+    fmt = request.args.get('format') or lldp_format((device or {}).get('device_type', ''))
+    cmd, output = section
+    return jsonify({
+        'backup_id': backup_id,
+        'hostname': backup.get('hostname'),
+        'command': cmd,
+        'format': fmt,
+        'neighbors': [n.to_dict() for n in parse_lldp(output, fmt)],
+    })
+
+
+EXPORT_FETCH_BATCH = 50   # จำนวน backup ที่ดึงจาก DB ต่อรอบตอน export
+
+
+def latest_backup_refs(owner, device_ids):
+    """Return [{_id: device_id, backup_id, hostname, timestamp}] for the newest successful backup per device."""
+    pipeline = [
+        {'$match': {'owner': owner, 'device_id': {'$in': device_ids}, 'status': 'Success'}},
+        {'$sort': {'device_id': 1, 'timestamp': -1}},
+        {'$group': {
+            '_id': '$device_id',
+            'backup_id': {'$first': '$_id'},
+            'hostname': {'$first': '$hostname'},
+            'timestamp': {'$first': '$timestamp'},
+        }},
+        {'$sort': {'hostname': 1}},
+    ]
+    return list(db.backups.aggregate(pipeline, allowDiskUse=True))
+
+
+def iter_backup_docs(refs):
+    """
+    Yield (ref, config_data) in ref order, fetching config bodies in small batches.
+    The next batch is fetched in the background while the current one is streamed out.
+    """
+    batches = [refs[i:i + EXPORT_FETCH_BATCH] for i in range(0, len(refs), EXPORT_FETCH_BATCH)]
+
+    def fetch(batch):
+        ids = [r['backup_id'] for r in batch]
+        docs = db.backups.find({'_id': {'$in': ids}}, {'config_data': 1})
+        return {d['_id']: d.get('config_data', '') for d in docs}
+
+    if not batches:
+        return
+    with ThreadPoolExecutor(max_workers=1) as ex:
+        pending = ex.submit(fetch, batches[0])
+        for i, batch in enumerate(batches):
+            bodies = pending.result()
+            if i + 1 < len(batches):
+                pending = ex.submit(fetch, batches[i + 1])
+            for ref in batch:
+                yield ref, bodies.pop(ref['backup_id'], '')
+
+
+@app.route('/api/profiles/<id>/backups/export', methods=['GET'])
+def export_profile_backups(id):
+    """
+    Download the latest successful backup of every device in a profile.
+    Query params: format=zip|tar.gz (default zip), manifest=1 to add manifest.json
+    """
+    current_user = request.headers.get('X-Username')
+    if not current_user:
+        return jsonify({'error': 'Unauthorized'}), 401
+
+    archive_format = request.args.get('format', 'zip')
+    if archive_format not in ('zip', 'tar.gz'):
+        return jsonify({'error': 'format must be zip or tar.gz'}), 400
+    with_manifest = request.args.get('manifest', '').lower() in ('1', 'true', 'yes')
+
+    device_ids = [str(d['_id']) for d in db.devices.find(
+        {'owner': current_user, 'profile_id': id}, {'_id': 1}
+    )]
+    if not device_ids:
+        return jsonify({'error': 'No devices found in this profile'}), 404
+
+    # ✅ หา backup ล่าสุดของทุก device ด้วย aggregation เดียว (ได้แค่ metadata ไม่รวม config)
+    refs = latest_backup_refs(current_user, device_ids)
+    if not refs:
+        return jsonify({'error': 'No backups found in this profile'}), 404
+
+    def backup_entries():
+        manifest = []
+        used_names = set()
+        for ref, config_data in iter_backup_docs(refs):
+            hostname = ref.get('hostname') or ref['_id']
+            ts = ref.get('timestamp')
+            stamp = ts.strftime('%Y%m%d_%H%M%S') if ts else 'unknown'
+            name = f"{secure_filename(hostname) or ref['_id']}_{stamp}.txt"
+            if name in used_names:
+                name = f"{secure_filename(hostname) or 'device'}_{ref['_id']}_{stamp}.txt"
+            used_names.add(name)
+
+            body = (config_data or '').encode('utf-8')
+            if with_manifest:
+                manifest.append({
+                    'file': name,
+                    'device_id': ref['_id'],
+                    'hostname': hostname,
+                    'backup_id': str(ref['backup_id']),
+                    'timestamp': ts.isoformat() if ts else None,
+                    'sha256': hashlib.sha256(body).hexdigest(),
+                    'size': len(body),
+                })
+            yield name, body
+
+        if with_manifest:
+            yield 'manifest.json', json.dumps({
+                'profile_id': id,
+                'owner': current_user,
+                'generated_at': dt.datetime.now(thai_tz).isoformat(),
+                'count': len(manifest),
+                'files': manifest,
+            }, indent=2, ensure_ascii=False)
+
+    if archive_format == 'tar.gz':
+        return Response(
+            stream_with_context(iter_tar_gz(backup_entries())),
+            mimetype='application/gzip',
+            headers={'Content-Disposition': f'attachment; filename="Backups_{id}.tar.gz"'}
+        )
+    return streaming_zip_response(backup_entries(), f'Backups_{id}.zip')
+
+
 # --- USER MANAGEMENT API ---
 
 
@@ -787,54 +1964,30 @@ def convert_bulk_api():
     if not uploaded_files:
         return jsonify({'msg': 'No files provided'}), 400
 
-    try:
-        memory_file = io.BytesIO()
-        with zipfile.ZipFile(memory_file, 'w', zipfile.ZIP_DEFLATED) as zf:
-            for file in uploaded_files:
-                if not file.filename: continue
-                
+    def converted_entries():
+        for file in uploaded_files:
+            if not file.filename: continue
+
+            # Get base filename
+            base_name = file.filename.rsplit('.', 1)[0]
+
+            try:
                 # 1. Read file content and force decode to string
                 log_content = file.read().decode('utf-8', errors='ignore')
-                
+
                 # 2. Convert Config (พร้อม sections filter)
                 converter = ConfigConverter(source_type, target_type, log_content)
                 result_config = converter.process(sections=sections)
-                
-                # Clean headers before Excel generation
-                if isinstance(converter.raw_log, str):
-                    for header in ["display current-configuration", "show running-config"]:
-                        if header in converter.raw_log:
-                            parts = converter.raw_log.split(header, 1)
-                            if len(parts) > 1:
-                                converter.raw_log = parts[1]
-                            
-                # Re-parse for Excel (Commented out per request)
-                # if source_type == "hp_comware":
-                #     converter._parse_comware()
-                # elif source_type == "cisco_ios":
-                #     converter._parse_cisco_ios()
-
-                # Generate Excel (Commented out)
-                # excel_data = converter.export_to_excel()
-                
-                # Get base filename
-                base_name = file.filename.rsplit('.', 1)[0]
-                
-                # 3. Add to ZIP
-                zf.writestr(f"{base_name}_converted.txt", result_config)
-                # zf.writestr(f"{base_name}_mapping.xlsx", excel_data)
+            except Exception as e:
+                # Headers are already sent, so report the failure inside the archive
+                traceback.print_exc()
+                yield f"{base_name}_error.txt", f"Conversion failed: {e}\n"
+                continue
 
-        memory_file.seek(0)
-        return send_file(
-            memory_file,
-            mimetype='application/zip',
-            as_attachment=True,
-            download_name='Batch_Conversion.zip'
-        )
+            # 3. Add to ZIP (ส่งออกทันทีทีละไฟล์)
+            yield f"{base_name}_converted.txt", result_config
 
-    except Exception as e:
-        traceback.print_exc()
-        return jsonify({'status': 'error', 'msg': str(e)}), 500
+    return streaming_zip_response(converted_entries(), 'Batch_Conversion.zip')
 
 
 # ✅ API: Export Excel (แก้เพิ่ม Route และ Clean Header)
@@ -1126,6 +2279,9 @@ def update_device(id):
         update_data['password'] = data['password']
     if data.get('secret'):
         update_data['secret'] = data['secret']
+    # ✅ อ้าง credential set ใน vault แทน password ในตัว device (ส่ง null = กลับไปใช้ login ของ device)
+    if 'credential_id' in data:
+        update_data['credential_id'] = data['credential_id'] or None
 
     # สั่ง Update โดยต้องเช็คว่าเป็นของ Owner คนนี้จริงๆ
     result = db.devices.update_one(
@@ -1247,5 +2403,530 @@ def revoke_agent_key(key):
         return jsonify({'msg': 'Agent Key ถูกยกเลิกเรียบร้อยแล้ว'})
     else:
         return jsonify({'msg': 'ไม่พบ Agent Key หรือไม่มีสิทธิ์'}), 404
+
+
+@app.route('/api/credentials', methods=['GET', 'POST'])
+def api_credentials():
+    """Credential sets for devices to reference by credential_id (secrets never come back out)."""
+    current_user = request.headers.get('X-Username')
+    if not current_user:
+        return jsonify({'error': 'Unauthorized'}), 401
+    if request.method == 'GET':
+        sets = db.credential_sets.find({'owner': current_user}, {'token': 0}).sort('name', 1)
+        return jsonify([serialize_doc(c) for c in sets])
+
+    if not vault_cipher:
+        return jsonify({'error': 'CREDENTIAL_VAULT_KEY is not configured on the server'}), 503
+    data = request.json or {}
+    if not data.get('name') or not data.get('username'):
+        return jsonify({'error': 'name and username are required'}), 400
+    cred_id = 'cs_' + secrets.token_hex(12)
+    db.credential_sets.insert_one({
+        'cred_id': cred_id, 'owner': current_user, 'name': data['name'], 'username': data['username'],
+        'token': seal(vault_cipher, data), 'inline': False, 'created_at': dt.datetime.now(thai_tz),
+    })
+    return jsonify({'cred_id': cred_id}), 201
+
+
+@app.route('/api/credentials/<cred_id>', methods=['DELETE'])
+def delete_credentials(cred_id):
+    current_user = request.headers.get('X-Username')
+    if not current_user:
+        return jsonify({'error': 'Unauthorized'}), 401
+    in_use = db.devices.count_documents({'owner': current_user, 'credential_id': cred_id})
+    if in_use:
+        return jsonify({'error': f'{in_use} device(s) still use this credential set'}), 409
+    result = db.credential_sets.delete_one({'cred_id': cred_id, 'owner': current_user})
+    if not result.deleted_count:
+        return jsonify({'error': 'Credential set not found'}), 404
+    _known_credential_ids.discard(cred_id)
+    return jsonify({'msg': 'Credential set deleted'})
+
+
+# ────────────────────────────────────────────────
+#   Scheduled backups
+#   schedule ต่อ profile เก็บใน backup_schedules, แต่ละรอบเก็บใน backup_runs
+#   next_run อยู่ใน DB → server restart แล้ว catch-up ตาม policy ได้
+# ────────────────────────────────────────────────
+SCHEDULER_TICK      = int(os.getenv('SCHEDULER_TICK', '30'))          # วินาที
+RUN_STALE_SECONDS   = int(os.getenv('BACKUP_RUN_STALE', str(3 * 3600)))
+SCHEDULE_DEFAULTS = {
+    'jitter_seconds': 900,     # กระจายเวลาเริ่มไม่ให้ทุก profile ยิงนาทีเดียวกัน
+    'misfire_grace': 3600,
+    'catchup': 'once',
+    'max_concurrency': 10,     # SSH session พร้อมกันต่อ site (profile)
+    'login_rate': 2.0,         # login ต่อวินาที
+    'max_retries': 2,
+    'retry_base': 120,
+}
+
+
+def _as_local(value):
+    """Mongo คืน datetime แบบ naive UTC — แปลงกลับเป็นเวลาไทยก่อนเทียบ."""
+    if value is None:
+        return None
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return value.astimezone(thai_tz)
+
+
+def _schedule_fields(body, partial=False):
+    """Validate schedule fields from the API body. Returns (fields, error)."""
+    fields = {}
+    if 'cron' in body or not partial:
+        try:
+            fields['cron'] = scheduler.CronSpec(body.get('cron', '')).expr
+        except ValueError as e:
+            return None, f'Invalid cron: {e}'
+    for key, default in SCHEDULE_DEFAULTS.items():
+        if key in body or not partial:
+            value = body.get(key, default)
+            if key == 'catchup':
+                if value not in scheduler.CATCHUP_POLICIES:
+                    return None, f'catchup must be one of {scheduler.CATCHUP_POLICIES}'
+            else:
+                try:
+                    value = type(default)(value)
+                except (TypeError, ValueError):
+                    return None, f'{key} must be a number'
+                if value < 0:
+                    return None, f'{key} must be >= 0'
+            fields[key] = value
+    for key in ('name', 'enabled'):
+        if key in body:
+            fields[key] = bool(body[key]) if key == 'enabled' else str(body[key])
+    return fields, None
+
+
+def create_backup_run(owner, profile_id, devices, trigger, **fields):
+    """Insert a backup_runs doc (pending = device ids) so per-device completion is tracked server-side."""
+    now = dt.datetime.now(thai_tz)
+    run_id = secrets.token_hex(8)
+    db.backup_runs.insert_one({
+        'run_id': run_id,
+        'schedule_id': None,
+        'owner': owner,
+        'profile_id': profile_id,
+        'trigger': trigger,
+        'attempt': 1,
+        'missed_windows': 0,
+        'total': len(devices),
+        'pending': [d['_id'] for d in devices],
+        'results': {},
+        'status': 'running',
+        'started_at': now,
+        'attempt_started_at': now,
+        **fields,
+    })
+    return run_id
+
+
+def start_backup_run(schedule, device_ids=None, attempt=1, run_id=None, missed=0):
+    """Dispatch one scheduled batch_backup (or a retry of the failed devices) through execute_task."""
+    owner = schedule['owner']
+    query = {'owner': owner, 'profile_id': schedule['profile_id']}
+    if device_ids is not None:
+        query['_id'] = {'$in': [ObjectId(i) for i in device_ids]}
+    devices = scheduler.stagger_order([serialize_doc(d) for d in db.devices.find(query)])
+    now = dt.datetime.now(thai_tz)
+
+    if run_id is None:
+        run_id = create_backup_run(owner, schedule['profile_id'], devices, trigger='schedule',
+                                   schedule_id=str(schedule['_id']), attempt=attempt,
+                                   missed_windows=missed)
+    else:
+        db.backup_runs.update_one({'run_id': run_id}, {'$set': {
+            'pending': [d['_id'] for d in devices],
+            'status': 'running',
+            'attempt': attempt,
+            'attempt_started_at': now,
+        }, '$unset': {'retry_at': ''}})
+
+    if not devices:
+        finalize_backup_run(run_id)
+        return run_id
+
+    dispatch_task(owner, {
+        'type': 'batch_backup',
+        'devices': devices,
+        'owner': owner,
+        'profile_id': schedule['profile_id'],
+        'run_id': run_id,
+        'trigger': 'schedule',
+        'max_workers': schedule.get('max_concurrency', SCHEDULE_DEFAULTS['max_concurrency']),
+        'login_rate': schedule.get('login_rate', SCHEDULE_DEFAULTS['login_rate']),
+    })
+    print(f"[SCHEDULER] run {run_id} attempt {attempt} → {len(devices)} devices ({owner})")
+    return run_id
+
+
+def record_run_result(run_id, device_id, status, error=None):
+    """Per-device result from the agent; the run is finalized once nothing is pending."""
+    result = {'status': status, 'at': dt.datetime.now(thai_tz)}
+    if error:
+        result['error'] = error
+    run = db.backup_runs.find_one_and_update(
+        {'run_id': run_id},
+        {'$pull': {'pending': device_id},
+         '$set': {f'results.{device_id}': result, 'last_progress_at': result['at']}},
+        return_document=ReturnDocument.AFTER
+    )
+    if run and run.get('status') == 'running' and not run.get('pending'):
+        finalize_backup_run(run_id)
+
+
+def finalize_backup_run(run_id, stalled=False):
+    # claim ก่อน กันสอง greenlet finalize ซ้ำ
+    run = db.backup_runs.find_one_and_update(
+        {'run_id': run_id, 'status': 'running'},
+        {'$set': {'status': 'finalizing'}},
+        return_document=ReturnDocument.AFTER
+    )
+    if not run:
+        return
+
+    results = run.get('results', {})
+    for device_id in run.get('pending', []):
+        results[device_id] = {'status': 'Failed', 'error': 'No result from agent'}
+    failed = [i for i, r in results.items() if r.get('status') != 'Success']
+
+    schedule = db.backup_schedules.find_one({'_id': ObjectId(run['schedule_id'])}) if run.get('schedule_id') else None
+    max_retries = (schedule or {}).get('max_retries', SCHEDULE_DEFAULTS['max_retries'])
+    now = dt.datetime.now(thai_tz)
+
+    if failed and schedule and run['attempt'] <= max_retries and not run.get('cancelled'):
+        delay = scheduler.retry_delay(run['attempt'], schedule.get('retry_base', SCHEDULE_DEFAULTS['retry_base']))
+        db.backup_runs.update_one({'run_id': run_id}, {'$set': {
+            'status': 'retry_pending',
+            'results': results,
+            'retry_devices': failed,
+            'retry_at': now + timedelta(seconds=delay),
+        }})
+        print(f"[SCHEDULER] run {run_id}: {len(failed)} failed → retry in {delay:.0f}s")
+        return
+
+    summary = {
+        'total': run.get('total', len(results)),
+        'success': len(results) - len(failed),
+        'failed': len(failed),
+        'attempts': run['attempt'],
+        'missed_windows': run.get('missed_windows', 0),
+    }
+    status = 'stalled' if stalled else ('cancelled' if run.get('cancelled') else ('done' if not failed else 'partial'))
+    db.backup_runs.update_one({'run_id': run_id}, {'$set': {
+        'status': status,
+        'results': results,
+        'summary': summary,
+        'finished_at': now,
+    }})
+    socketio.emit('backup_run_summary', {
+        'run_id': run_id,
+        'schedule_id': run.get('schedule_id'),
+        'profile_id': run.get('profile_id'),
+        'owner': run['owner'],
+        'status': status,
+        'summary': summary,
+    })
+    print(f"[SCHEDULER] run {run_id} {status}: {summary}")
+
+
+def run_due_schedules(now):
+    online = set(agent_connections.values())
+    for s in db.backup_schedules.find({'enabled': True, 'next_run': {'$lte': now}}):
+        if s['owner'] not in online:
+            # ไม่เลื่อน next_run — พอ agent กลับมาจะเข้า catch-up policy
+            if s.get('last_skip_reason') != 'agent_offline':
+                db.backup_schedules.update_one({'_id': s['_id']}, {'$set': {'last_skip_reason': 'agent_offline'}})
+            continue
+
+        doc = dict(s, next_run=_as_local(s['next_run']), next_slot=_as_local(s.get('next_slot')))
+        run, next_slot, next_run, missed = scheduler.plan_due(doc, now)
+        claimed = db.backup_schedules.find_one_and_update(
+            {'_id': s['_id'], 'next_run': s['next_run']},
+            {'$set': {'next_slot': next_slot, 'next_run': next_run,
+                      'last_fired_at': now, 'last_skip_reason': None if run else 'misfire_skipped'}}
+        )
+        if not claimed or not run:
+            continue
+        run_id = start_backup_run(s, missed=missed)
+        db.backup_schedules.update_one({'_id': s['_id']}, {'$set': {'last_run_id': run_id}})
+
+
+def run_due_retries(now):
+    online = set(agent_connections.values())
+    for run in db.backup_runs.find({'status': 'retry_pending', 'retry_at': {'$lte': now}}):
+        if run['owner'] not in online:
+            continue
+        claimed = db.backup_runs.find_one_and_update(
+            {'run_id': run['run_id'], 'status': 'retry_pending'},
+            {'$set': {'status': 'dispatching'}}
+        )
+        schedule = db.backup_schedules.find_one({'_id': ObjectId(run['schedule_id'])})
+        if not claimed or not schedule:
+            continue
+        start_backup_run(schedule, device_ids=run.get('retry_devices', []),
+                         attempt=run['attempt'] + 1, run_id=run['run_id'])
+
+
+def expire_stalled_runs(now):
+    cutoff = now - timedelta(seconds=RUN_STALE_SECONDS)
+    # run ใหญ่ที่ยังส่งผลมาเรื่อยๆ ไม่นับว่าค้าง — ดูจากผลล่าสุด ไม่ใช่เวลาเริ่ม
+    query = {'status': 'running', 'attempt_started_at': {'$lt': cutoff},
+             '$or': [{'last_progress_at': {'$exists': False}}, {'last_progress_at': {'$lt': cutoff}}]}
+    for run in db.backup_runs.find(query, {'run_id': 1}):
+        finalize_backup_run(run['run_id'], stalled=True)
+    # agent หลุดหลังรับ cancel_task แต่ก่อนส่ง job_status กลับ
+    db.jobs.update_many(
+        {'status': 'cancelling', 'cancel_requested_at': {'$lt': now - timedelta(seconds=JOB_CANCEL_TIMEOUT)}},
+        {'$set': {'status': 'cancelled', 'finished_at': now, 'note': 'no job_status from agent after cancel'}}
+    )
+
+
+def resume_backup_run(owner, run_id, done_ids, sid):
+    """
+    Agent came back (restart / reconnect) with an unfinished run in its journal.
+    Send that agent only the devices that are neither in its journal nor answered here.
+    An empty device list tells the agent to close the journal entry.
+    """
+    run = db.backup_runs.find_one({'run_id': run_id, 'owner': owner})
+    devices = []
+    if run and run.get('status') in ('running', 'stalled') and not run.get('cancelled'):
+        done = set(done_ids)
+        remaining = [i for i in run.get('pending', []) if i not in done]
+        found = {str(d['_id']): d for d in db.devices.find(
+            {'owner': owner, '_id': {'$in': [ObjectId(i) for i in remaining]}})}
+        for device_id in remaining:
+            if device_id not in found:
+                record_run_result(run_id, device_id, 'Failed', 'Device deleted before resume')
+        devices = scheduler.stagger_order([serialize_doc(d) for d in found.values()])
+        if devices:
+            db.backup_runs.update_one({'run_id': run_id}, {
+                '$set': {'status': 'running', 'last_progress_at': dt.datetime.now(thai_tz)},
+                '$inc': {'resumes': 1},
+            })
+
+    schedule = db.backup_schedules.find_one({'_id': ObjectId(run['schedule_id'])}) \
+        if run and run.get('schedule_id') else None
+    payload = {
+        'type': 'batch_backup',
+        'devices': devices,
+        'owner': owner,
+        'profile_id': run.get('profile_id') if run else None,
+        'run_id': run_id,
+        'job_id': run_id,
+        'trigger': 'resume',
+    }
+    if schedule:
+        payload['max_workers'] = schedule.get('max_concurrency', SCHEDULE_DEFAULTS['max_concurrency'])
+        payload['login_rate'] = schedule.get('login_rate', SCHEDULE_DEFAULTS['login_rate'])
+    # ตอบเฉพาะ agent ที่ขอ resume (owner อาจมีหลาย agent)
+    socketio.emit('execute_task', pack_for_agent(sid, owner, payload), to=sid)
+    print(f"[RESUME] run {run_id} → {len(devices)} devices left ({owner})")
+
+
+def schedule_loop():
+    print(f"[SCHEDULER] started (tick {SCHEDULER_TICK}s)")
+    while True:
+        try:
+            now = dt.datetime.now(thai_tz)
+            run_due_schedules(now)
+            run_due_retries(now)
+            expire_stalled_runs(now)
+        except Exception as e:
+            print(f"[SCHEDULER] tick error: {e}")
+            traceback.print_exc()
+        socketio.sleep(SCHEDULER_TICK)
+
+
+@app.route('/api/schedules', methods=['GET', 'POST'])
+def api_schedules():
+    current_user = request.headers.get('X-Username')
+    if not current_user:
+        return jsonify({'error': 'Unauthorized'}), 401
+
+    if request.method == 'GET':
+        query = {'owner': current_user}
+        if request.args.get('profile_id'):
+            query['profile_id'] = request.args['profile_id']
+        return jsonify([serialize_doc(s) for s in db.backup_schedules.find(query)])
+
+    body = request.json or {}
+    profile_id = body.get('profile_id')
+    if not profile_id:
+        return jsonify({'error': 'profile_id is required'}), 400
+    fields, error = _schedule_fields(body)
+    if error:
+        return jsonify({'error': error}), 400
+
+    now = dt.datetime.now(thai_tz)
+    doc = {
+        'owner': current_user,
+        'profile_id': profile_id,
+        'name': body.get('name', f'Backup {fields["cron"]}'),
+        'enabled': bool(body.get('enabled', True)),
+        'created_at': now,
+        **fields,
+    }
+    _id = db.backup_schedules.insert_one(doc).inserted_id
+    next_slot, next_run = scheduler.first_run(doc['cron'], now, doc['jitter_seconds'], seed=_id)
+    db.backup_schedules.update_one({'_id': _id}, {'$set': {'next_slot': next_slot, 'next_run': next_run}})
+    return jsonify({'id': str(_id), 'next_run': next_run.isoformat()}), 201
+
+
+@app.route('/api/schedules/<schedule_id>', methods=['PUT', 'DELETE'])
+def api_schedule_detail(schedule_id):
+    current_user = request.headers.get('X-Username')
+    if not current_user:
+        return jsonify({'error': 'Unauthorized'}), 401
+    query = {'_id': ObjectId(schedule_id), 'owner': current_user}
+
+    if request.method == 'DELETE':
+        result = db.backup_schedules.delete_one(query)
+        return jsonify({'deleted': result.deleted_count}), (200 if result.deleted_count else 404)
+
+    schedule = db.backup_schedules.find_one(query)
+    if not schedule:
+        return jsonify({'error': 'Schedule not found'}), 404
+    fields, error = _schedule_fields(request.json or {}, partial=True)
+    if error:
+        return jsonify({'error': error}), 400
+
+    merged = {**schedule, **fields}
+    if 'cron' in fields or 'jitter_seconds' in fields or (fields.get('enabled') and not schedule.get('enabled')):
+        # เปลี่ยนรอบเวลา / เปิดใหม่ → เริ่มนับจากตอนนี้ ไม่ catch-up ย้อนหลัง
+        fields['next_slot'], fields['next_run'] = scheduler.first_run(
+            merged['cron'], dt.datetime.now(thai_tz), merged['jitter_seconds'], seed=schedule['_id'])
+    db.backup_schedules.update_one(query, {'$set': fields})
+    return jsonify(serialize_doc(db.backup_schedules.find_one(query)))
+
+
+@app.route('/api/schedules/<schedule_id>/runs', methods=['GET'])
+def api_schedule_runs(schedule_id):
+    current_user = request.headers.get('X-Username')
+    if not current_user:
+        return jsonify({'error': 'Unauthorized'}), 401
+    limit = min(int(request.args.get('limit', 20)), 100)
+    runs = db.backup_runs.find(
+        {'schedule_id': schedule_id, 'owner': current_user},
+        {'results': 0, 'pending': 0}
+    ).sort('started_at', -1).limit(limit)
+    return jsonify([serialize_doc(r) for r in runs])
+
+
+@app.route('/api/backup_runs/<run_id>', methods=['GET'])
+def api_backup_run(run_id):
+    current_user = request.headers.get('X-Username')
+    if not current_user:
+        return jsonify({'error': 'Unauthorized'}), 401
+    run = db.backup_runs.find_one({'run_id': run_id, 'owner': current_user})
+    if not run:
+        return jsonify({'error': 'Run not found'}), 404
+    run['results'] = {k: serialize_doc(v) for k, v in run.get('results', {}).items()}
+    return jsonify(serialize_doc(run))
+
+
+# ────────────────────────────────────────────────
+#   Change-triggered backups (syslog CONFIG_I / CFGLOG → backup เครื่องนั้น)
+#   syslog_server.py upsert config_change_events ต่อ device_ip
+# ────────────────────────────────────────────────
+CHANGE_DEBOUNCE_SECONDS  = int(os.getenv('CHANGE_DEBOUNCE_SECONDS', '120'))   # เงียบกี่วินาทีถึงจะ backup
+CHANGE_MIN_INTERVAL      = int(os.getenv('CHANGE_MIN_INTERVAL', '900'))       # backup ถี่สุดต่อ device
+CHANGE_MAX_PER_TICK      = int(os.getenv('CHANGE_MAX_PER_TICK', '20'))        # กัน backup storm ทั้งระบบ
+CHANGE_TICK              = int(os.getenv('CHANGE_TICK', '15'))
+
+
+def run_change_triggered_backups(now):
+    quiet_before = now - timedelta(seconds=CHANGE_DEBOUNCE_SECONDS)
+    interval_before = now - timedelta(seconds=CHANGE_MIN_INTERVAL)
+    online = set(agent_connections.values())
+    dispatched = 0
+
+    events = db.config_change_events.find(
+        {'status': 'pending', 'last_event_at': {'$lte': quiet_before}}
+    ).sort('last_event_at', 1)
+    for ev in events:
+        if dispatched >= CHANGE_MAX_PER_TICK:
+            break   # ที่เหลือยัง pending รอ tick ถัดไป
+        last = ev.get('last_triggered_at')
+        if last and _as_local(last) > interval_before:
+            continue   # เพิ่ง backup ไป — event ใหม่ถูกรวมไว้ รอให้ครบ interval ก่อน
+
+        devices = list(db.devices.find({'ip_address': ev['device_ip']}))
+        if not devices:
+            db.config_change_events.update_one({'_id': ev['_id']}, {'$set': {'status': 'ignored'}})
+            continue
+        targets = [d for d in devices if d.get('owner') in online]
+        if not targets:
+            continue   # agent offline — ยัง pending ไว้
+
+        # claim: ถ้ามี event ใหม่เข้ามาระหว่างนี้ last_event_at จะเปลี่ยน → debounce ต่อ
+        claimed = db.config_change_events.find_one_and_update(
+            {'_id': ev['_id'], 'status': 'pending', 'last_event_at': ev['last_event_at']},
+            {'$set': {'status': 'dispatched', 'last_triggered_at': now,
+                      'triggered_events': ev.get('event_count', 0)},
+             '$inc': {'trigger_count': 1}}
+        )
+        if not claimed:
+            continue
+
+        users = sorted({r.get('user') for r in ev.get('recent', []) if r.get('user')})
+        for dev in targets:
+            dispatch_task(dev['owner'], {
+                'type': 'batch_backup',
+                'devices': [serialize_doc(dev)],
+                'owner': dev['owner'],
+                'profile_id': dev.get('profile_id'),
+                'trigger': 'syslog',
+                'changed_by': users,
+            })
+            print(f"[CHANGE] {dev.get('hostname')} ({ev['device_ip']}) changed by {users or '?'} → backup")
+        dispatched += 1
+
+
+def change_event_loop():
+    while True:
+        try:
+            run_change_triggered_backups(dt.datetime.now(thai_tz))
+        except Exception as e:
+            print(f"[CHANGE] tick error: {e}")
+        socketio.sleep(CHANGE_TICK)
+
+
+@app.route('/api/config_changes', methods=['GET'])
+def api_config_changes():
+    """Recent config-change events for the user's devices and whether a backup was triggered."""
+    current_user = request.headers.get('X-Username')
+    if not current_user:
+        return jsonify({'error': 'Unauthorized'}), 401
+    ips = [d['ip_address'] for d in db.devices.find({'owner': current_user}, {'ip_address': 1}) if d.get('ip_address')]
+    events = db.config_change_events.find({'device_ip': {'$in': ips}}).sort('last_event_at', -1).limit(200)
+    out = []
+    for ev in events:
+        ev['recent'] = [serialize_doc(r) for r in ev.get('recent', [])]
+        out.append(serialize_doc(ev))
+    return jsonify(out)
+
+
+_background_started = False
+
+
+def start_background_jobs():
+    """Start the schedule and config-change loops (once per process — run them in one server process only)."""
+    global _background_started
+    if _background_started or db is None:
+        return
+    _background_started = True
+    socketio.start_background_task(schedule_loop)
+    socketio.start_background_task(change_event_loop)
+
+
+# gunicorn / WSGI ไม่ผ่าน __main__ → ตั้ง RUN_BACKGROUND_JOBS=1 ให้ process เดียวที่จะรัน loop
+if os.getenv('RUN_BACKGROUND_JOBS') == '1':
+    start_background_jobs()
+
+
 if __name__ == '__main__':
+    # debug reloader: process แม่แค่ watch ไฟล์ — loop รันเฉพาะใน child (WERKZEUG_RUN_MAIN)
+    if os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+        start_background_jobs()
     socketio.run(app, host="0.0.0.0", port=5000, debug=True, allow_unsafe_werkzeug=True)
\ No newline at end of file
@@ -0,0 +1,107 @@
+import io
+import tarfile
+import time
+import zipfile
+
+
+# ────────────────────────────────────────────────
+#   Streaming archive writers
+#   สร้างไฟล์ ZIP แบบทยอยส่ง (chunked) ไม่ต้องเก็บทั้งไฟล์ไว้ใน BytesIO
+# ────────────────────────────────────────────────
+
+CHUNK_SIZE = 64 * 1024
+
+
+class _ChunkSink(io.RawIOBase):
+    """Write-only, non-seekable sink that hands written bytes back to the caller.
+
+    zipfile falls back to data descriptors when the target cannot seek,
+    so every member can be flushed to the client as soon as it is written.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self._parts = []
+        self._size = 0
+
+    def writable(self):
+        return True
+
+    def write(self, b):
+        data = bytes(b)
+        if data:
+            self._parts.append(data)
+            self._size += len(data)
+        return len(data)
+
+    def pending(self):
+        return self._size
+
+    def drain(self):
+        data = b''.join(self._parts)
+        self._parts.clear()
+        self._size = 0
+        return data
+
+
+def _iter_content(content):
+    """Normalise a member body (str / bytes / iterable of either) into byte chunks."""
+    if isinstance(content, str):
+        content = content.encode('utf-8')
+    if isinstance(content, (bytes, bytearray)):
+        for i in range(0, len(content), CHUNK_SIZE):
+            yield bytes(content[i:i + CHUNK_SIZE])
+        return
+    for part in content:
+        if isinstance(part, str):
+            part = part.encode('utf-8')
+        if part:
+            yield bytes(part)
+
+
+def iter_zip(entries, compression=zipfile.ZIP_DEFLATED):
+    """
+    Yield a ZIP archive chunk by chunk.
+
+    entries: iterable of (arcname, content) — content เป็น str, bytes หรือ generator ของ chunk ก็ได้
+    Memory usage is bounded by one member chunk plus the deflate window,
+    and the first bytes reach the client as soon as the first entry is produced.
+    """
+    sink = _ChunkSink()
+    with zipfile.ZipFile(sink, 'w', compression) as zf:
+        for arcname, content in entries:
+            info = zipfile.ZipInfo(arcname, date_time=time.localtime()[:6])
+            info.compress_type = compression
+            with zf.open(info, 'w') as member:
+                for chunk in _iter_content(content):
+                    member.write(chunk)
+                    if sink.pending() >= CHUNK_SIZE:
+                        yield sink.drain()
+            if sink.pending():
+                yield sink.drain()
+    # central directory
+    tail = sink.drain()
+    if tail:
+        yield tail
+
+
+def iter_tar_gz(entries):
+    """
+    Yield a gzip-compressed tar archive chunk by chunk.
+
+    Tar headers need the member size up front, so each member is materialised
+    on its own — memory stays bounded by the largest single member.
+    """
+    sink = _ChunkSink()
+    with tarfile.open(fileobj=sink, mode='w|gz') as tf:
+        for arcname, content in entries:
+            data = b''.join(_iter_content(content))
+            info = tarfile.TarInfo(arcname)
+            info.size = len(data)
+            info.mtime = int(time.time())
+            tf.addfile(info, io.BytesIO(data))
+            if sink.pending():
+                yield sink.drain()
+    tail = sink.drain()
+    if tail:
+        yield tail
@@ -0,0 +1,103 @@
+import difflib
+import hashlib
+
+
+# ────────────────────────────────────────────────
+#   Section-level backup upload (agent ↔ server)
+#   agent จำ hash ของ section ล่าสุดที่ส่งไปแล้วต่อ device:
+#     - section ไม่เปลี่ยน → ส่งแค่ hash
+#     - เปลี่ยน → ส่ง line diff เทียบกับ base ที่ server มีอยู่แล้ว
+#   server ประกอบ output เต็มกลับจาก content store (section_blobs) แล้วเช็ค hash
+# ────────────────────────────────────────────────
+
+SECTION_RULE = '=' * 60
+
+
+def section_hash(text: str) -> str:
+    return hashlib.sha1((text or '').encode('utf-8')).hexdigest()
+
+
+def backup_header(hostname: str, timestamp: str) -> str:
+    return f"=== NETWORK AUDIT BACKUP FOR {hostname} ===\nTimestamp: {timestamp}\n\n"
+
+
+def render_backup(header: str, sections) -> str:
+    """header + [(name, command, body)] → the stored backup text (same layout split_backup_sections reads)."""
+    out = [header]
+    for name, cmd, body in sections:
+        out.append(f"\n{SECTION_RULE}\n👉 {name} ({cmd})\n{SECTION_RULE}\n{body}\n")
+    return ''.join(out)
+
+
+def make_delta(old: str, new: str) -> list:
+    """
+    Line diff of new against old: ['=', i1, i2] copies old lines i1:i2,
+    ['+', line, ...] inserts new lines. Line endings are kept so apply_delta is exact.
+    """
+    a, b = old.splitlines(keepends=True), new.splitlines(keepends=True)
+    ops = []
+    for tag, i1, i2, j1, j2 in difflib.SequenceMatcher(None, a, b, autojunk=False).get_opcodes():
+        if tag == 'equal':
+            ops.append(['=', i1, i2])
+        elif j2 > j1:
+            ops.append(['+', *b[j1:j2]])
+    return ops
+
+
+def apply_delta(old: str, ops: list) -> str:
+    a = old.splitlines(keepends=True)
+    out = []
+    for op in ops:
+        if op[0] == '=':
+            out.extend(a[op[1]:op[2]])
+        else:
+            out.extend(op[1:])
+    return ''.join(out)
+
+
+def encode_sections(sections, previous: dict):
+    """
+    sections: [(name, command, body)], previous: {name: (hash, body)} last uploaded for this device.
+    Returns (wire sections, new index {name: (hash, body)}).
+    """
+    wire, index = [], {}
+    for name, cmd, body in sections:
+        h = section_hash(body)
+        entry = {'name': name, 'cmd': cmd, 'hash': h}
+        prev = previous.get(name)
+        if prev and prev[0] == h:
+            pass                                        # ไม่เปลี่ยน — hash อย่างเดียว
+        elif prev:
+            delta = make_delta(prev[1], body)
+            # diff ใหญ่กว่าตัวจริง (เช่น output เปลี่ยนทั้งก้อน) → ส่งเต็มดีกว่า
+            if len(repr(delta)) < len(body):
+                entry.update(base=prev[0], delta=delta)
+            else:
+                entry['text'] = body
+        else:
+            entry['text'] = body
+        wire.append(entry)
+        index[name] = (h, body)
+    return wire, index
+
+
+def decode_sections(wire, fetch):
+    """
+    Inverse of encode_sections on the server. fetch(hash) → stored body or None.
+    Returns [(name, command, body)]; raises LookupError when a base is missing
+    and ValueError when the rebuilt body does not match its hash.
+    """
+    out = []
+    for entry in wire:
+        if 'text' in entry:
+            body = entry['text']
+        else:
+            base_hash = entry.get('base', entry['hash'])
+            base = fetch(base_hash)
+            if base is None:
+                raise LookupError(f"section '{entry['name']}': base {base_hash[:12]} not in store")
+            body = apply_delta(base, entry['delta']) if 'delta' in entry else base
+        if section_hash(body) != entry['hash']:
+            raise ValueError(f"section '{entry['name']}': hash mismatch after rebuild")
+        out.append((entry['name'], entry['cmd'], body))
+    return out
@@ -0,0 +1,275 @@
+import difflib
+import hashlib
+import re
+
+from vendors import resolve_vendor
+
+
+# ────────────────────────────────────────────────
+#   Transactional config push (snapshot → push → verify → commit | rollback)
+#   ไม่ import netmiko — agent ส่ง session ที่เปิดแล้ว + ฟังก์ชัน snapshot / reconnect เข้ามา
+#   (test ใช้ connection ปลอมแทนเครื่องจริงได้)
+# ────────────────────────────────────────────────
+
+CLI_ERROR_MARKERS = ('% invalid', '% incomplete', '% ambiguous', '%error', 'error:', 'unrecognized command',
+                     'unknown command', 'syntax error', 'wrong parameter')
+ROLLBACK_FILE = 'netpilot-rollback.cfg'
+# บรรทัดที่เปลี่ยนเองทุกครั้ง ไม่นับเป็น diff
+_VOLATILE_LINE = re.compile(
+    r'^(?:!\s*(?:Last configuration change|NVRAM config last updated|Time:)|Current configuration\s*:|'
+    r'ntp clock-period|Building configuration|#?\s*\d{4}-\d{2}-\d{2}|!Software Version|#time)',
+    re.IGNORECASE
+)
+# บรรทัดที่เปิด sub-mode — ตอนทำ inverse ให้คงไว้เพื่อให้ no/undo อยู่ใน context เดิม
+_CONTEXT_LINE = re.compile(
+    r'^(?:interface|vlan\s+\d+|router|line|policy-map|class-map|ip access-list|acl|ospf|bgp|'
+    r'port-group|aaa|radius|hwtacacs|user-interface|local-user)\b', re.IGNORECASE
+)
+_EXIT_LINE = re.compile(r'^(?:exit|quit|end|return)$', re.IGNORECASE)
+
+
+def cli_error(output: str):
+    """First CLI error marker found in device output, or None."""
+    low = (output or '').lower()
+    return next((m for m in CLI_ERROR_MARKERS if m in low), None)
+
+
+def normalize_config(text: str) -> list:
+    return [l.rstrip() for l in (text or '').splitlines()
+            if l.strip() and not _VOLATILE_LINE.match(l.strip())]
+
+
+def inverse_commands(commands, vendor, before=None) -> list:
+    """
+    Best-effort undo of a flat command list: keep mode-entering lines, negate the rest
+    in reverse order within each block (no ↔ undo depending on vendor).
+    With the pre-change config, lines that were already there are left alone and
+    sub-modes that did not exist before are removed as a whole.
+    """
+    neg = vendor.negate
+    existing = {l.strip() for l in before} if before is not None else None
+    blocks, current = [], [None, []]
+    for cmd in commands:
+        c = cmd.strip()
+        if not c or _EXIT_LINE.match(c):
+            continue
+        if _CONTEXT_LINE.match(c) and not c.lower().startswith(('no ', 'undo ')):
+            blocks.append(current)
+            current = [c, []]
+            continue
+        current[1].append(c)
+    blocks.append(current)
+
+    out = []
+    for ctx, body in blocks:
+        if ctx and existing is not None and ctx not in existing:
+            out.append(neg + ctx)      # sub-mode ใหม่ทั้งก้อน (เช่น vlan 99) → ลบทิ้งทีเดียว
+            continue
+        undo = []
+        for c in reversed(body):
+            low = c.lower()
+            if low.startswith('no '):
+                undo.append(c[3:])
+            elif low.startswith('undo '):
+                undo.append(c[5:])
+            elif existing is not None and c in existing:
+                continue               # มีอยู่แล้วก่อน push — ไม่ต้องถอด
+            else:
+                undo.append(neg + c)
+        if not undo:
+            continue
+        if ctx:
+            out.append(ctx)
+        out.extend(undo)
+        if ctx:
+            out.append(vendor.exit_command)
+    return out
+
+
+def _answer_prompts(conn, command, read_timeout=120):
+    """send_command_timing that confirms the usual [Y/N] / filename prompts of copy, save and replace."""
+    out = reply = conn.send_command_timing(command, read_timeout=read_timeout)
+    for _ in range(3):
+        low = reply.lower()            # ดูเฉพาะคำตอบล่าสุด ไม่งั้น prompt เดิมถูกตอบซ้ำ
+        if '[y/n]' in low or '(y/n)' in low or 'continue?' in low or 'confirm' in low:
+            reply = conn.send_command_timing('Y', read_timeout=read_timeout)
+        elif 'filename' in low or low.rstrip().endswith('?'):
+            reply = conn.send_command_timing('\n', read_timeout=read_timeout)
+        else:
+            break
+        out += reply
+    return out
+
+
+
+
+def flatten_commands(commands) -> list:
+    """str | [str] (แต่ละตัวอาจมีหลายบรรทัด) → flat list of non-empty lines."""
+    if isinstance(commands, str):
+        commands = [commands]
+    return [sub.strip() for cmd in commands for sub in str(cmd).split('\n') if sub.strip()]
+
+
+def replace_method(vendor, rollback_file) -> str:
+    """How a rollback should restore the snapshot: config replace when a rollback file was saved, else inverse commands."""
+    if not rollback_file:
+        return 'inverse'
+    if vendor.rollback == 'configure_replace':
+        return 'configure replace'
+    if vendor.rollback == 'configuration_replace':
+        return 'configuration replace'
+    return 'inverse'
+
+
+class PushTransaction:
+    """
+    Wraps one device push: snapshot the running config (and a rollback file where the
+    platform supports config replace) over the already-open session, then either
+    commit (diff only) or roll back and verify the device is back to the snapshot.
+
+    send(conn, command, timeout) → output (agent: send_timed), reconnect() → new session (used when the old one hung).
+    """
+
+    def __init__(self, conn, device, send, reconnect):
+        self.conn = conn
+        self.device = device
+        self.vendor = resolve_vendor(device.get('device_type', ''))
+        self.show_cmd = self.vendor.running_config
+        self._send = send
+        self._reconnect = reconnect
+        self.before = ''
+        self.rollback_file = None
+
+    def _snapshot(self):
+        return self._send(self.conn, self.show_cmd, 120)
+
+    def begin(self):
+        self.before = self._snapshot()
+        try:
+            if self.vendor.rollback == 'configure_replace':
+                out = _answer_prompts(self.conn, f"copy running-config flash:{ROLLBACK_FILE}")
+                if not cli_error(out):
+                    self.rollback_file = f"flash:{ROLLBACK_FILE}"
+            elif self.vendor.rollback == 'configuration_replace':
+                out = _answer_prompts(self.conn, f"save flash:/{ROLLBACK_FILE}")
+                if not cli_error(out):
+                    self.rollback_file = f"flash:/{ROLLBACK_FILE}"
+        except Exception:
+            self.rollback_file = None   # ใช้ inverse commands แทน
+
+    def verify(self, push_output, verify_commands=None):
+        """Returns None when healthy, otherwise the failure reason."""
+        marker = cli_error(push_output)
+        if marker:
+            return f"device rejected a command ({marker})"
+        try:
+            self.conn.exit_config_mode()
+            self.conn.find_prompt()
+            for cmd in verify_commands or []:
+                out = self._send(self.conn, cmd, 60)
+                if cli_error(out):
+                    return f"verify '{cmd}' → {out.strip()[:200]}"
+        except Exception as e:
+            return f"session lost after push: {e}"
+        return None
+
+    def _diff(self, after):
+        before_lines, after_lines = normalize_config(self.before), normalize_config(after)
+        diff = '\n'.join(difflib.unified_diff(before_lines, after_lines, 'before', 'after', lineterm=''))
+        return {
+            'before_hash': hashlib.sha1('\n'.join(before_lines).encode()).hexdigest(),
+            'after_hash': hashlib.sha1('\n'.join(after_lines).encode()).hexdigest(),
+            'diff': diff,
+        }, before_lines == after_lines
+
+    def commit(self):
+        change, _ = self._diff(self._snapshot())
+        return dict(change, status='committed')
+
+    def rollback(self, reason, commands):
+        # session อาจค้างหลัง timeout → เปิดใหม่
+        try:
+            self.conn.find_prompt()
+        except Exception:
+            try:
+                self.conn.disconnect()
+            except Exception:
+                pass
+            self.conn = self._reconnect()
+
+        try:
+            self.conn.exit_config_mode()
+        except Exception:
+            pass
+        method = replace_method(self.vendor, self.rollback_file)
+        if method == 'configure replace':
+            out = _answer_prompts(self.conn, f"configure replace {self.rollback_file} force", read_timeout=300)
+            if cli_error(out):
+                method = 'inverse'
+        elif method == 'configuration replace':
+            self.conn.config_mode()
+            out = _answer_prompts(self.conn, f"configuration replace file {self.rollback_file}", read_timeout=300)
+            self.conn.exit_config_mode()
+            if cli_error(out):
+                method = 'inverse'
+        if method == 'inverse':
+            undo = inverse_commands(commands, self.vendor, normalize_config(self.before))
+            self.conn.send_config_set(undo, read_timeout=90)
+            self.conn.exit_config_mode()
+
+        after = self._snapshot()
+        change, restored = self._diff(after)
+        change.update(status='rolled_back', reason=reason, rollback_method=method, rollback_verified=restored)
+        return change
+
+
+def apply_push(conn, flat, txn=None, verify_commands=None, save=None):
+    """
+    Push flat config lines over a session already in config mode → task result dict.
+    With a PushTransaction: verify, then commit or roll back — at most one rollback per push,
+    even when the rollback itself fails part-way. save() → output of the vendor save command.
+    """
+    rollback_attempted = False
+    try:
+        try:
+            output = conn.send_config_set(flat, read_timeout=90)
+        except Exception as e:
+            if not txn:
+                raise
+            output, failure = '', f"push failed: {e}"
+        else:
+            failure = txn.verify(output, verify_commands) if txn else None
+
+        # ✅ verify ไม่ผ่าน → rollback (ยังไม่ save จึงไม่กระทบ startup-config)
+        if failure:
+            rollback_attempted = True       # rollback พังกลางทาง → ห้าม rollback ซ้ำใน except ด้านล่าง
+            change = txn.rollback(failure, flat)
+            state = 'verified' if change['rollback_verified'] else 'NOT verified — check device'
+            return {'status': 'Failed', 'output': f"{failure}\nRolled back via {change['rollback_method']} ({state})",
+                    'save_output': '', 'commands_applied': [], 'rolled_back': True, 'change': change}
+
+        save_out = save() if save else ''
+
+        change = None
+        if txn:
+            try:
+                change = txn.commit()
+            except Exception as e:
+                change = {'status': 'committed', 'diff': None, 'error': f"after-snapshot failed: {e}"}
+        result = {'status': 'Success', 'output': output,
+                  'save_output': save_out, 'commands_applied': flat}
+        if change:
+            result['change'] = change
+        return result
+    except Exception as e:
+        result = {'status': 'Failed', 'output': str(e),
+                  'save_output': '', 'commands_applied': []}
+        if txn and rollback_attempted:
+            result['output'] += "\nRollback failed part-way — device may be partially rolled back, check it manually"
+        elif txn:
+            try:
+                result['change'] = txn.rollback(f"error: {e}", flat)
+                result['rolled_back'] = True
+            except Exception as rb_exc:
+                result['output'] += f"\nRollback failed: {rb_exc}"
+        return result
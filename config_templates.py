@@ -0,0 +1,151 @@
+import hashlib
+import re
+import threading
+from collections import OrderedDict
+
+from jinja2 import StrictUndefined, TemplateError, TemplateSyntaxError, UndefinedError
+from jinja2.sandbox import SandboxedEnvironment
+
+from vendors import resolve_vendor
+
+
+# ────────────────────────────────────────────────
+#   Config templates (Jinja2) — ใช้ทั้งฝั่ง server (preview) และ agent (render ตอน push)
+#   template หนึ่งตัวมี body แยกต่อ vendor family, compile ครั้งเดียวแล้ว cache ไว้
+# ────────────────────────────────────────────────
+
+TEMPLATE_CACHE_SIZE = 256
+
+
+def parse_vlan_range(vlan_str):
+    """'10,20-22,30 to 31' → [10, 20, 21, 22, 30, 31] (sorted, no duplicates); ValueError on junk."""
+    vlans = set()
+    for part in str(vlan_str).split(','):
+        part = part.strip()
+        if not part:
+            continue
+        bounds = re.split(r'\s*(?:-|to)\s*', part, maxsplit=1)
+        try:
+            start, end = int(bounds[0]), int(bounds[-1])
+        except ValueError:
+            raise ValueError(f"invalid VLAN range: {part!r}")
+        vlans.update(range(start, end + 1))
+    return sorted(vlans)
+
+
+def _prefix_to_mask(prefix):
+    prefix = int(prefix)
+    bits = (0xFFFFFFFF << (32 - prefix)) & 0xFFFFFFFF
+    return '.'.join(str((bits >> s) & 0xFF) for s in (24, 16, 8, 0))
+
+
+# template มาจาก user → render ใน sandbox (ห้ามเข้า __globals__ / __subclasses__ ฯลฯ)
+_env = SandboxedEnvironment(
+    undefined=StrictUndefined,     # ตัวแปรหาย = error ชัดเจน ดีกว่าได้ config ว่างๆ ไปลงเครื่อง
+    trim_blocks=True,
+    lstrip_blocks=True,
+    keep_trailing_newline=False,
+    autoescape=False,
+)
+_env.filters['vlan_range'] = parse_vlan_range
+_env.filters['mask'] = _prefix_to_mask
+
+
+def template_family(device_type: str) -> str:
+    """Which body of a template applies to this device (vendor CLI syntax)."""
+    return resolve_vendor(device_type).syntax
+
+
+def body_for(bodies: dict, device_type: str):
+    """Vendor body, falling back to 'default' (None when the template has neither)."""
+    return bodies.get(template_family(device_type)) or bodies.get('default')
+
+
+def validate_bodies(bodies: dict):
+    """Compile every body once; returns {family: error} for the ones that do not parse."""
+    errors = {}
+    for family, text in (bodies or {}).items():
+        try:
+            _env.parse(text)
+        except TemplateSyntaxError as e:
+            errors[family] = f"line {e.lineno}: {e.message}"
+    return errors
+
+
+class TemplateCache:
+    """Thread-safe LRU of compiled templates keyed by body hash (แก้ template = hash ใหม่ = compile ใหม่)."""
+
+    def __init__(self, size=TEMPLATE_CACHE_SIZE):
+        self.size = size
+        self._lock = threading.Lock()
+        self._items = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, text: str):
+        key = hashlib.sha1(text.encode('utf-8')).hexdigest()
+        with self._lock:
+            tpl = self._items.get(key)
+            if tpl is not None:
+                self._items.move_to_end(key)
+                self.hits += 1
+                return tpl
+        tpl = _env.from_string(text)
+        with self._lock:
+            self.misses += 1
+            self._items[key] = tpl
+            if len(self._items) > self.size:
+                self._items.popitem(last=False)
+        return tpl
+
+
+CACHE = TemplateCache()
+
+
+def template_vars(device: dict, row_vars=None, common=None) -> dict:
+    """common vars < device fields / device['vars'] < per-device (spreadsheet) vars."""
+    out = dict(common or {})
+    out.update({
+        'hostname': device.get('hostname', ''),
+        'ip_address': device.get('ip_address', ''),
+        'device_type': device.get('device_type', ''),
+    })
+    out.update(device.get('vars') or {})
+    out.update(row_vars or {})
+    return out
+
+
+def render_commands(bodies: dict, device: dict, row_vars=None, common=None) -> list:
+    """Render one device → flat command list. Raises ValueError with a readable reason."""
+    text = body_for(bodies, device.get('device_type', ''))
+    if text is None:
+        raise ValueError(f"no template body for {template_family(device.get('device_type', ''))}")
+    try:
+        rendered = CACHE.get(text).render(**template_vars(device, row_vars, common))
+    except UndefinedError as e:
+        raise ValueError(f"missing variable: {e.message}")
+    except TemplateSyntaxError as e:
+        raise ValueError(f"template error line {e.lineno}: {e.message}")
+    except TemplateError as e:                         # รวม SecurityError จาก sandbox
+        raise ValueError(f"template error: {e.message}")
+    except (TypeError, ValueError, ArithmeticError, LookupError) as e:
+        # เช่น {{ 1 + x }} ที่ x เป็น string จาก spreadsheet → ให้เป็น error ของ device นั้น ไม่ใช่ทั้ง batch
+        raise ValueError(f"render error: {type(e).__name__}: {e}")
+    return [line.strip() for line in rendered.splitlines() if line.strip()]
+
+
+def render_bulk(bodies: dict, targets, common=None):
+    """
+    targets: [{'device': {...}, 'vars': {...}}, ...]
+    Returns [{'ip', 'hostname', 'commands'} | {'ip', 'hostname', 'error'}] in input order.
+    """
+    results = []
+    for t in targets:
+        dev = t['device']
+        item = {'ip': dev.get('ip_address', ''), 'hostname': dev.get('hostname', '')}
+        try:
+            item['commands'] = render_commands(bodies, dev, t.get('vars'), common)
+        except ValueError as e:
+            item['error'] = str(e)
+        results.append(item)
+    return results
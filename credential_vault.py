@@ -0,0 +1,73 @@
+import base64
+import hashlib
+import hmac
+import json
+
+from cryptography.fernet import Fernet, InvalidToken
+from cryptography.hazmat.primitives import hashes, serialization
+from cryptography.hazmat.primitives.asymmetric.x25519 import X25519PrivateKey, X25519PublicKey
+from cryptography.hazmat.primitives.kdf.hkdf import HKDF
+
+
+# ────────────────────────────────────────────────
+#   Credential vault (server ↔ agent)
+#   device ใน execute_task อ้าง credential_id แทน username / password / secret
+#   server เก็บ credential set เข้ารหัสด้วย vault key (Fernet)
+#   ตอนส่งให้ agent เข้ารหัสใหม่ด้วย session key จาก X25519 (ECDH) ตอน register_agent
+#   → key ไม่เคยอยู่บน wire; คนที่แค่ดัก socket ได้ (เห็น agent_key) ก็ถอดไม่ได้
+#   ส่วน active MITM (สลับ public key) ยังต้องพึ่ง TLS ของ connection เหมือนเดิม
+# ────────────────────────────────────────────────
+
+CREDENTIAL_FIELDS = ('username', 'password', 'secret')
+SECRET_FIELDS = ('password', 'secret')
+
+
+def session_keypair():
+    """Ephemeral X25519 key pair for one socket session → (private key, base64 public key)."""
+    private = X25519PrivateKey.generate()
+    public = private.public_key().public_bytes(serialization.Encoding.Raw, serialization.PublicFormat.Raw)
+    return private, base64.b64encode(public).decode()
+
+
+def session_cipher(private_key, peer_public: str) -> Fernet:
+    """Fernet from the ECDH secret of our private key and the peer's base64 public key."""
+    try:
+        peer = X25519PublicKey.from_public_bytes(base64.b64decode(peer_public))
+    except Exception:
+        raise ValueError('invalid credential_vault public key')
+    shared = private_key.exchange(peer)
+    key = HKDF(algorithm=hashes.SHA256(), length=32, salt=None, info=b'netpilot-credentials').derive(shared)
+    return Fernet(base64.urlsafe_b64encode(key))
+
+
+def credential_id(vault_key: bytes, owner: str, creds: dict) -> str:
+    """
+    Stable id for an inline username/password/secret (HMAC under the vault key), so every
+    device or spreadsheet row with the same login maps to one credential set.
+    """
+    msg = json.dumps([owner] + [creds.get(k) or '' for k in CREDENTIAL_FIELDS]).encode('utf-8')
+    return 'cs_' + hmac.new(vault_key, msg, hashlib.sha256).hexdigest()[:24]
+
+
+def seal(cipher: Fernet, creds: dict) -> str:
+    return cipher.encrypt(json.dumps({k: creds.get(k) or '' for k in CREDENTIAL_FIELDS}).encode('utf-8')).decode()
+
+
+def unseal(cipher: Fernet, token: str) -> dict:
+    """Inverse of seal; raises ValueError for a token from another key or a tampered one."""
+    try:
+        return json.loads(cipher.decrypt(token.encode('utf-8')))
+    except InvalidToken:
+        raise ValueError('credential token does not decrypt with this key')
+
+
+def payload_devices(payload: dict):
+    """Every device dict inside an execute_task payload (device / devices / tasks / targets)."""
+    if isinstance(payload.get('device'), dict):
+        yield payload['device']
+    for dev in payload.get('devices') or []:
+        yield dev
+    for key in ('tasks', 'targets'):
+        for item in payload.get(key) or []:
+            if isinstance(item.get('device'), dict):
+                yield item['device']
@@ -0,0 +1,86 @@
+import threading
+from concurrent.futures import Future
+from contextlib import contextmanager
+
+
+# ────────────────────────────────────────────────
+#   Per-device sessions (vty line ของ switch มีจำกัด ~5 — agent ไม่ควรกินหมดเอง)
+#   จำกัด session ต่อเครื่อง + รวม show เดียวกันที่ยิงพร้อมกันให้เหลือครั้งเดียว
+# ────────────────────────────────────────────────
+
+READ_ONLY_PREFIXES = ('show ', 'display ', 'dis ', 'get ')
+
+
+def is_read_only(command: str) -> bool:
+    cmd = ' '.join((command or '').split()).lower() + ' '
+    return cmd.startswith(READ_ONLY_PREFIXES)
+
+
+class DeviceSessions:
+    """
+    Caps concurrent SSH sessions per device (device['max_sessions'] or default_limit)
+    and lets identical read-only commands in flight on one device share a single result.
+    """
+
+    def __init__(self, default_limit: int = 2):
+        self.default_limit = default_limit
+        self._lock     = threading.Lock()
+        self._cv       = threading.Condition()
+        self._active   = {}                  # host → session ที่เปิดอยู่
+        self._inflight = {}                  # (host, username, command) → Future
+        self._held     = threading.local()   # host ที่ thread นี้ถือ slot อยู่ (เรียกซ้อนไม่ต้องขอใหม่)
+        self.coalesced = 0
+
+    @staticmethod
+    def _host(device) -> str:
+        return f"{device.get('ip_address', '')}:{device.get('port', 22)}"
+
+    def limit_for(self, device) -> int:
+        # อ่านใหม่ทุกครั้ง — แก้ max_sessions ของ device หรือ default_limit แล้วมีผลกับ slot ถัดไปทันที
+        return max(1, int(device.get('max_sessions') or self.default_limit))
+
+    @contextmanager
+    def slot(self, device):
+        """Hold one session slot of this device; blocks while the device is at its limit."""
+        host = self._host(device)
+        held = getattr(self._held, 'hosts', None)
+        if held is None:
+            held = self._held.hosts = set()
+        if host in held:
+            yield
+            return
+        limit = self.limit_for(device)
+        with self._cv:
+            while self._active.get(host, 0) >= limit:
+                self._cv.wait()
+            self._active[host] = self._active.get(host, 0) + 1
+        held.add(host)
+        try:
+            yield
+        finally:
+            held.discard(host)
+            with self._cv:
+                self._active[host] -= 1
+                if not self._active[host]:
+                    del self._active[host]
+                self._cv.notify_all()
+
+    def coalesce(self, device, command: str, fn):
+        """fn() for the first caller; callers arriving while it runs get the same result."""
+        key = (self._host(device), device.get('username', ''), ' '.join(command.split()))
+        with self._lock:
+            fut = self._inflight.get(key)
+            first = fut is None
+            if first:
+                fut = self._inflight[key] = Future()
+            else:
+                self.coalesced += 1
+        if first:
+            try:
+                fut.set_result(fn())
+            except BaseException as e:
+                fut.set_exception(e)
+            finally:
+                with self._lock:
+                    self._inflight.pop(key, None)
+        return fut.result()
@@ -0,0 +1,63 @@
+import threading
+from typing import Optional
+
+
+# ────────────────────────────────────────────────
+#   Job control (cancel_task จาก server / agent stop)
+#   งานที่ยังรอคิวถูก cancel ทิ้งเลย งานที่เริ่มแล้วเช็ค event ระหว่างคำสั่ง
+# ────────────────────────────────────────────────
+
+CANCELLED_OUTPUT = 'Cancelled by user'
+SHUTDOWN_OUTPUT  = 'Cancelled — agent stopped before the task started'
+
+
+class JobControl:
+    """
+    Cancellation of one dispatched job: queued futures are cancelled outright,
+    work that already started checks `event` at safe points (between commands).
+    """
+
+    def __init__(self, job_id=None):
+        self.job_id   = job_id
+        self.event    = threading.Event()
+        self.reason   = None        # 'user' (cancel_task) | 'shutdown' (agent stop)
+        self._lock    = threading.Lock()
+        self._futures = []
+
+    @property
+    def cancelled(self) -> bool:
+        return self.event.is_set()
+
+    def track(self, futures):
+        with self._lock:
+            self._futures.extend(futures)
+        if self.cancelled:
+            for f in futures:
+                f.cancel()
+
+    def cancel(self, reason='user') -> int:
+        """Returns how many queued futures were dropped before they started."""
+        with self._lock:
+            if not self.event.is_set():
+                self.reason = reason
+                self.event.set()
+            return sum(1 for f in self._futures if f.cancel())
+
+    def final_status(self) -> Optional[str]:
+        """job_status to report once the job returns; None after a shutdown (the journal resumes it)."""
+        if self.reason == 'shutdown':
+            return None
+        return 'cancelled' if self.cancelled else 'done'
+
+    def guard(self, fn, *args, **kwargs):
+        """Run fn unless the job was cancelled while the call waited in the pool queue."""
+        if self.cancelled:
+            return {'status': 'Cancelled', 'output': CANCELLED_OUTPUT}
+        return fn(*args, **kwargs)
+
+    @staticmethod
+    def outcome(fut, output=CANCELLED_OUTPUT):
+        """fut.result(), or a Cancelled result for a future dropped by cancel() / LaneScheduler.shutdown()."""
+        if fut.cancelled():
+            return {'status': 'Cancelled', 'output': output}
+        return fut.result()
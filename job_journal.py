@@ -0,0 +1,73 @@
+import sqlite3
+import threading
+import time
+
+
+# ────────────────────────────────────────────────
+#   Job journal (checkpoint ต่อ device ของ batch ใหญ่ — SQLite ข้าง agent_config.json)
+#   agent ปิด / crash / หลุดกลางทาง → กลับมาขอ server ส่งเฉพาะเครื่องที่ยังไม่เสร็จ
+# ────────────────────────────────────────────────
+
+JOURNAL_MAX_AGE = 2 * 24 * 3600     # งานค้างเกินนี้ทิ้ง (server ถือว่า stalled ไปแล้ว)
+
+
+class JobJournal:
+    """
+    Per-device completion of batch jobs, one row per device result that reached the server.
+    Only ids and statuses are kept — credentials come back from the server on resume.
+    """
+
+    def __init__(self, path: str, max_age: float = JOURNAL_MAX_AGE):
+        self.max_age = max_age
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.executescript("""
+            CREATE TABLE IF NOT EXISTS jobs (
+                job_id TEXT PRIMARY KEY, task_type TEXT, owner TEXT,
+                total INTEGER, created_at REAL
+            );
+            CREATE TABLE IF NOT EXISTS job_devices (
+                job_id TEXT, device_id TEXT, status TEXT, at REAL,
+                PRIMARY KEY (job_id, device_id)
+            );
+        """)
+        self.prune()
+
+    def open(self, job_id: str, task_type: str, owner: str, total: int) -> set:
+        """Start (or re-open) a job; returns the device ids already checkpointed."""
+        with self._lock:
+            self._db.execute("INSERT OR IGNORE INTO jobs VALUES (?, ?, ?, ?, ?)",
+                             (job_id, task_type, owner, total, time.time()))
+            rows = self._db.execute("SELECT device_id FROM job_devices WHERE job_id = ?", (job_id,))
+            return {r[0] for r in rows}
+
+    def mark(self, job_id: str, device_id: str, status: str):
+        with self._lock:
+            self._db.execute("INSERT OR REPLACE INTO job_devices VALUES (?, ?, ?, ?)",
+                             (job_id, device_id, status, time.time()))
+
+    def finish(self, job_id: str):
+        with self._lock:
+            self._db.execute("DELETE FROM job_devices WHERE job_id = ?", (job_id,))
+            self._db.execute("DELETE FROM jobs WHERE job_id = ?", (job_id,))
+
+    def unfinished(self, owner: str) -> list:
+        """[(job_id, task_type, total, done_ids)] for jobs that never reached finish()."""
+        with self._lock:
+            jobs = self._db.execute("SELECT job_id, task_type, total FROM jobs WHERE owner = ?",
+                                    (owner,)).fetchall()
+            out = []
+            for job_id, task_type, total in jobs:
+                rows = self._db.execute("SELECT device_id FROM job_devices WHERE job_id = ?", (job_id,))
+                out.append((job_id, task_type, total, [r[0] for r in rows]))
+            return out
+
+    def prune(self, now: float = None):
+        """Drop jobs older than max_age."""
+        cutoff = (time.time() if now is None else now) - self.max_age
+        with self._lock:
+            self._db.execute("DELETE FROM job_devices WHERE job_id IN "
+                             "(SELECT job_id FROM jobs WHERE created_at < ?)", (cutoff,))
+            self._db.execute("DELETE FROM jobs WHERE created_at < ?", (cutoff,))
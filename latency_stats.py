@@ -0,0 +1,75 @@
+import json
+import os
+import threading
+from typing import Optional
+
+
+# ────────────────────────────────────────────────
+#   Adaptive timeouts (เรียนรู้จาก latency จริงของแต่ละ device/command)
+#   agent บันทึก latency ทุกครั้งที่ login / ส่งคำสั่ง แล้วใช้ p99 เป็น timeout รอบถัดไป
+# ────────────────────────────────────────────────
+
+class LatencyStats:
+    """
+    Keeps the last few latency samples per (host, command) and derives
+    timeouts as p99 × margin, clamped between a floor and the old fixed value.
+    """
+    MAX_SAMPLES = 20
+    MIN_SAMPLES = 3
+    MARGIN      = 3.0
+
+    def __init__(self, path: str):
+        self.path   = path
+        self._lock  = threading.Lock()
+        self._data  = {}
+        self._dirty = False
+        self._load()
+
+    @staticmethod
+    def _key(host: str, command: str) -> str:
+        return f"{host}|{' '.join(command.lower().split())}"
+
+    def _load(self):
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                self._data = json.load(f)
+        except Exception:
+            self._data = {}
+
+    def save(self):
+        with self._lock:
+            if not self._dirty:
+                return
+            snapshot = dict(self._data)
+            self._dirty = False
+        try:
+            tmp = self.path + '.tmp'
+            with open(tmp, 'w', encoding='utf-8') as f:
+                json.dump(snapshot, f)
+            os.replace(tmp, self.path)
+        except Exception as e:
+            print(f"Error saving latency stats: {e}")
+
+    def record(self, host: str, command: str, seconds: float):
+        key = self._key(host, command)
+        with self._lock:
+            samples = self._data.setdefault(key, [])
+            samples.append(round(seconds, 2))
+            del samples[:-self.MAX_SAMPLES]
+            self._dirty = True
+
+    def percentile(self, host: str, command: str, pct: float = 0.99) -> Optional[float]:
+        with self._lock:
+            samples = sorted(self._data.get(self._key(host, command), []))
+        if len(samples) < self.MIN_SAMPLES:
+            return None
+        idx = min(len(samples) - 1, int(round(pct * (len(samples) - 1))))
+        return samples[idx]
+
+    def timeout_for(self, host: str, command: str, default: float,
+                    floor: float = 10, ceiling: Optional[float] = None) -> float:
+        """Adaptive timeout, or `default` until enough samples exist."""
+        p99 = self.percentile(host, command)
+        if p99 is None:
+            return default
+        return max(floor, min(ceiling or default, p99 * self.MARGIN))
@@ -0,0 +1,331 @@
+import re
+from dataclasses import dataclass, asdict
+
+from vendors import resolve_vendor
+
+
+# ────────────────────────────────────────────────
+#   LLDP neighbor parser (table-driven)
+#   regex ของแต่ละ vendor compile ครั้งเดียวตอน import
+#   แต่ละบรรทัดใช้ regex แค่ 2 ตัว (header + field) แทนการลองทีละ label
+# ────────────────────────────────────────────────
+
+@dataclass
+class LldpNeighbor:
+    local_port:  str = ''
+    neighbor:    str = ''
+    remote_port: str = ''
+    mgmt_ip:     str = ''
+    port_desc:   str = ''
+    update_time: str = ''
+    sys_desc:    str = ''
+    chassis_id:  str = ''
+
+    def to_dict(self) -> dict:
+        return asdict(self)
+
+
+_IPV4_PREFIX = re.compile(r'\d{1,3}(\.\d{1,3}){3}')
+_IPV4_FULL   = re.compile(r'\d{1,3}(\.\d{1,3}){3}$')
+_TTL_SECONDS = re.compile(r'TTL\s+(\d+)\s+seconds?', re.IGNORECASE)
+
+
+def _unquote(v: str) -> str:
+    return v.strip().strip('"').strip("'")
+
+
+def _remote_port(v: str) -> str:
+    return v.split('(')[0].strip() if '(' in v else v
+
+
+def _ttl(v: str) -> str:
+    return f"{v} (TTL)"
+
+
+def _first_csv(v: str) -> str:
+    return v.split(',')[0]
+
+
+def _ipv4_prefix(v: str):
+    return v if _IPV4_PREFIX.match(v) else None
+
+
+def _ipv4_full(v: str):
+    return v if _IPV4_FULL.match(v) else None
+
+
+# field rule = (record field, keep_first, transform)
+#   keep_first=True  → ใช้ค่าแรกที่เจอใน block (เช่น mgmt ip ตัวแรก = IPv4)
+#   keep_first=False → ค่าหลังทับค่าก่อน
+FORMATS = {
+    'ruckus': {
+        'headers': [r'Local port:\s*(\S+)', r'Port\s*:\s*(\S+)'],
+        'strip_plus': True,
+        'unquote': True,
+        'fields': {
+            'System name':                  ('neighbor',    False, None),
+            'Neighbor System-Name':         ('neighbor',    False, None),
+            'System description':           ('sys_desc',    True,  None),
+            'Neighbor System-Description':  ('sys_desc',    True,  None),
+            'Port ID':                      ('remote_port', True,  _remote_port),
+            'Neighbor Port-ID':             ('remote_port', True,  _remote_port),
+            'Port description':             ('port_desc',   False, None),
+            'Neighbor Port-Desc':           ('port_desc',   False, None),
+            'Management address (IPv4)':    ('mgmt_ip',     True,  None),
+            'Neighbor Management-Address':  ('mgmt_ip',     True,  None),
+            'Time to live':                 ('update_time', True,  _ttl),
+            'TTL':                          ('update_time', True,  _ttl),
+            'Chassis ID':                   ('chassis_id',  True,  None),
+        },
+        'ttl_seconds': True,
+    },
+    # Cisco IOS "show lldp neighbors detail" (block เริ่มที่ "Local Intf:")
+    'ios': {
+        'headers': [r'Local Intf:\s*(\S+)', r'Local port:\s*(\S+)'],
+        'strip_plus': False,
+        'unquote': True,
+        'fields': {
+            'System Name':        ('neighbor',    False, None),
+            'System Description': ('sys_desc',    True,  None),
+            'Port id':            ('remote_port', True,  _remote_port),
+            'Port Description':   ('port_desc',   False, None),
+            'IP':                 ('mgmt_ip',     True,  _ipv4_full),
+            'Time remaining':     ('update_time', True,  _ttl),
+            'Chassis id':         ('chassis_id',  True,  None),
+        },
+        # IOS พิมพ์ค่าไว้บรรทัดถัดจาก label ("System Description:\nCisco IOS Software, ...")
+        'next_line': ('System Description',),
+    },
+    'aoscx': {
+        'headers': [r'Port\s*:\s*(\S+)'],
+        'fields': {
+            'Neighbor System-Name':         ('neighbor',    False, None),
+            'Neighbor System-Description':  ('sys_desc',    False, None),
+            'Neighbor Port-ID':             ('remote_port', False, None),
+            'Neighbor Port-Desc':           ('port_desc',   False, None),
+            'TTL':                          ('update_time', False, _ttl),
+            'Neighbor Management-Address':  ('mgmt_ip',     True,  _first_csv),
+            'Neighbor Chassis-ID':          ('chassis_id',  True,  None),
+        },
+    },
+    'procurve': {
+        'headers': [r'Local Port\s*:\s*(\S+)'],
+        'fields': {
+            'SysName':      ('neighbor',    False, None),
+            'System Descr': ('sys_desc',    True,  None),
+            'PortId':       ('remote_port', True,  None),
+            'PortDescr':    ('port_desc',   False, None),
+            'Address':      ('mgmt_ip',     True,  _ipv4_prefix),
+            'ChassisId':    ('chassis_id',  True,  None),
+        },
+    },
+    'comware': {
+        'headers': [r'LLDP neighbor-information of port\s+\d+\[([^\]]+)\]'],
+        'fields': {
+            'System name':        ('neighbor',    False, None),
+            'System description': ('sys_desc',    True,  None),
+            'Port ID':            ('remote_port', True,  None),
+            'Port description':   ('port_desc',   False, None),
+            'Update time':        ('update_time', False, None),
+            'Management address': ('mgmt_ip',     True,  _ipv4_full),
+            'Chassis ID':         ('chassis_id',  True,  None),
+        },
+    },
+}
+
+
+class _CompiledFormat:
+    def __init__(self, spec: dict):
+        self.header = re.compile('|'.join(f'(?:{h})' for h in spec['headers']), re.IGNORECASE)
+        labels = sorted(spec['fields'], key=len, reverse=True)   # label ยาวก่อน กันชนกัน
+        self.field = re.compile(
+            r'(?P<label>' + '|'.join(re.escape(l) for l in labels) + r')(?:\s*\(.*?\))?\s*:\s*(?P<value>.*)',
+            re.IGNORECASE
+        )
+        self.rules = {l.lower(): rule for l, rule in spec['fields'].items()}
+        self.next_line = {l.lower() for l in spec.get('next_line', ())}
+        self.strip_plus  = spec.get('strip_plus', False)
+        self.unquote     = spec.get('unquote', False)
+        self.ttl_seconds = spec.get('ttl_seconds', False)
+
+    def header_port(self, line: str):
+        m = self.header.match(line)
+        if not m:
+            return None
+        return next(g for g in m.groups() if g is not None).strip()
+
+
+_COMPILED = {name: _CompiledFormat(spec) for name, spec in FORMATS.items()}
+
+
+def lldp_format(device_type: str) -> str:
+    """Map a netmiko device_type to an LLDP output format (via the vendor registry)."""
+    return resolve_vendor(device_type).lldp_format or 'comware'
+
+
+def _flush(cur, out):
+    if cur is None:
+        return
+    if not cur.neighbor and cur.remote_port:
+        cur.neighbor = f"Unknown-{cur.remote_port}"
+    if cur.neighbor:
+        out.append(cur)
+
+
+def parse_lldp(output: str, fmt: str) -> list:
+    """Parse LLDP detail output in one pass. Returns a list of LldpNeighbor."""
+    cf = _COMPILED[fmt]
+    neighbors = []
+    cur = None
+    pending = None      # field ที่ label อยู่บรรทัดก่อน ค่ารออยู่บรรทัดนี้
+
+    for line in output.splitlines():
+        stripped = line.strip()
+        if not stripped:
+            continue
+
+        port = cf.header_port(stripped)
+        if port is not None:
+            _flush(cur, neighbors)
+            cur = LldpNeighbor(local_port=port)
+            pending = None
+            continue
+        if cur is None:
+            continue
+
+        clean = stripped[1:].lstrip() if cf.strip_plus and stripped.startswith('+') else stripped
+        m = cf.field.match(clean)
+        if m:
+            pending = None
+            label = m.group('label').lower()
+            field, keep_first, transform = cf.rules[label]
+            if keep_first and getattr(cur, field):
+                continue
+            value = _unquote(m.group('value')) if cf.unquote else m.group('value').strip()
+            if not value and label in cf.next_line:
+                pending = (field, transform)
+                continue
+            if transform:
+                value = transform(value)
+            if value:
+                setattr(cur, field, value)
+            continue
+
+        if pending:
+            field, transform = pending
+            pending = None
+            value = _unquote(clean) if cf.unquote else clean
+            value = transform(value) if transform else value
+            if value:
+                setattr(cur, field, value)
+            continue
+
+        if cf.ttl_seconds and not cur.update_time:
+            m_ttl = _TTL_SECONDS.search(line)
+            if m_ttl:
+                cur.update_time = f"{m_ttl.group(1)} seconds (TTL)"
+
+    _flush(cur, neighbors)
+    return neighbors
+
+
+# ── Serial number ("show version" / "display device manuinfo" / ...) ──
+_SERIAL = re.compile(
+    r'Serial[ \t]+#[ \t]*:[ \t]*(?P<a>\S+)'                       # Ruckus "Serial  #:DUH3221T0BZ"
+    r'|DEVICE_SERIAL_NUMBER[ \t]*[: \t][ \t]*(?P<b>\S+)'          # Comware manuinfo
+    r'|Serial[ \t]*Num(?:ber)?[ \t]*[: \t][ \t]*(?P<c>\S+)'
+    r'|Serial[ \t]+(?:Number|Nbr)[ \t]*:[ \t]*(?P<d>\S+)',        # Aruba CX
+    re.IGNORECASE
+)
+
+
+def parse_serial(output: str) -> str:
+    """First serial number found in the output, or ''."""
+    m = _SERIAL.search(output or '')
+    if not m:
+        return ''
+    return next(v for v in m.groups() if v)
+
+
+# ────────────────────────────────────────────────
+#   Micro-benchmark:  python lldp_parser.py
+# ────────────────────────────────────────────────
+SAMPLES = {
+    'ruckus': """
+Local port: 1/1/24
+  Neighbor: 609c.9f1d.2a40, TTL 105 seconds
+    + Chassis ID (MAC address): 609c.9f1d.2a40
+    + Port ID (MAC address): 609c.9f1d.2a57
+    + Time to live: 120 seconds
+    + System name         : "ICX7150-C12-Floor2"
+    + Port description    : "GigabitEthernet1/2/2"
+    + System description  : "Ruckus Wireless, Inc. ICX7150-C12-POE"
+    + Management address (IPv4): 10.10.2.12
+""",
+    'ios': """
+Local Intf: Gi1/0/48
+Chassis id: 0050.56bf.1a2b
+Port id: Gi0/1
+Port Description: Uplink to core
+System Name: ACC-SW-01
+
+System Description:
+Cisco IOS Software, C2960X Software
+
+Time remaining: 97 seconds
+Management Addresses:
+    IP: 10.20.0.11
+""",
+    'aoscx': """
+Port                           : 1/1/49
+Neighbor Entries               : 1
+Neighbor Chassis-ID            : 88:3a:30:aa:bb:cc
+Neighbor System-Name           : CX6300-CORE
+Neighbor System-Description    : Aruba JL668A FL.10.10.1000
+Neighbor Port-ID               : 1/1/52
+Neighbor Port-Desc             : 1/1/52
+TTL                            : 120
+Neighbor Management-Address    : 10.30.0.1, fe80::1
+""",
+    'procurve': """
+  Local Port   : 25
+  ChassisType  : mac-address
+  ChassisId    : 9c 8c d8 11 22 33
+  PortType     : local
+  PortId       : 49
+  SysName      : HP-2930F-01
+  System Descr : HP J9772A 2530-48G-PoEP Switch
+  PortDescr    : 49
+
+  Remote Management Address
+     Type    : ipv4
+     Address : 10.116.254.1
+""",
+    'comware': """
+LLDP neighbor-information of port 49[GigabitEthernet1/0/49]:
+LLDP neighbor index : 1
+Update time         : 0 days, 0 hours, 1 minutes, 30 seconds
+Chassis type        : MAC address
+Chassis ID          : 3c8c-4011-2233
+Port ID type        : Interface name
+Port ID             : GigabitEthernet1/0/1
+Port description    : GigabitEthernet1/0/1 Interface
+System name         : H3C-ACC-01
+System description  : H3C Comware Platform Software
+Management address type           : IPv4
+Management address                : 10.40.0.21
+""",
+}
+
+
+if __name__ == '__main__':
+    import timeit
+
+    for fmt, sample in SAMPLES.items():
+        text = sample * 48          # ~48 neighbors ต่อ device
+        n = 200
+        secs = timeit.timeit(lambda: parse_lldp(text, fmt), number=n)
+        parsed = parse_lldp(text, fmt)
+        first = parsed[0]
+        print(f"{fmt:9s} {len(parsed):3d} neighbors  {secs / n * 1e3:7.3f} ms/parse  "
+              f"→ {first.neighbor} {first.remote_port} {first.mgmt_ip} {first.chassis_id}")
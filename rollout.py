@@ -0,0 +1,65 @@
+from typing import Optional
+
+
+# ────────────────────────────────────────────────
+#   Rolling rollout (canary → waves ที่ใหญ่ขึ้นเรื่อยๆ + health check ระหว่าง wave)
+#   agent แบ่ง wave / ตัดสินใจ abort, server ใช้ validate_rollout ก่อน dispatch
+# ────────────────────────────────────────────────
+
+ROLLOUT_DEFAULTS = {
+    'canary': 1,
+    'growth': 2,              # wave ถัดไปใหญ่ขึ้นกี่เท่า
+    'max_wave': 50,
+    'abort_threshold': 0.2,   # failure rate สะสมเกินนี้ → หยุด wave ที่เหลือ
+    'health_commands': [],
+    'pause_seconds': 0,
+}
+
+
+def validate_rollout(rollout) -> Optional[str]:
+    """Reason the rollout options are unusable, or None."""
+    if not isinstance(rollout, dict):
+        return 'rollout must be an object'
+    threshold = rollout.get('abort_threshold', ROLLOUT_DEFAULTS['abort_threshold'])
+    if isinstance(threshold, bool) or not isinstance(threshold, (int, float)) or not 0 <= threshold <= 1:
+        return 'rollout.abort_threshold must be between 0 and 1'
+    for key in ('canary', 'growth', 'max_wave', 'pause_seconds'):
+        value = rollout.get(key, ROLLOUT_DEFAULTS[key])
+        if isinstance(value, bool) or not isinstance(value, (int, float)) or value < 0:
+            return f'rollout.{key} must be a non-negative number'
+    if not isinstance(rollout.get('health_commands') or [], list):
+        return 'rollout.health_commands must be a list of commands'
+    return None
+
+
+def plan_waves(total: int, canary: int = 1, growth: float = 2, max_wave: int = 50):
+    """Wave sizes: canary, canary*growth, ... capped at max_wave, summing to total."""
+    sizes, size, left = [], max(1, int(canary)), total
+    while left > 0:
+        take = min(size, left, max(1, int(max_wave)))
+        sizes.append(take)
+        left -= take
+        size = max(size + 1, int(size * growth))
+    return sizes
+
+
+class RolloutProgress:
+    """
+    Cumulative failure rate over the waves pushed so far (devices that failed the pre-scan
+    are not counted) and the abort decision after each wave. threshold=None never aborts.
+    """
+
+    def __init__(self, threshold: Optional[float] = None):
+        self.threshold = threshold
+        self.attempted = 0
+        self.failed    = 0
+
+    def wave_done(self, report: dict, remaining: int) -> Optional[str]:
+        """Adds report['failure_rate']; returns the abort reason when the rest should not be pushed."""
+        self.attempted += report['success'] + report['failed']
+        self.failed    += report['failed']
+        rate = round(self.failed / self.attempted, 3) if self.attempted else 0.0
+        report['failure_rate'] = rate
+        if self.threshold is not None and remaining > 0 and rate > self.threshold:
+            return f"wave {report['wave']}: failure rate {rate:.0%} > {self.threshold:.0%}"
+        return None
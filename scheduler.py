@@ -0,0 +1,144 @@
+import hashlib
+import random
+from datetime import timedelta
+
+
+# ────────────────────────────────────────────────
+#   Backup scheduler helpers (ไม่แตะ DB — app.py เป็นคนเก็บ state ใน Mongo)
+#   cron 5 ช่อง: minute hour day-of-month month day-of-week
+# ────────────────────────────────────────────────
+
+_FIELDS = (
+    ('minute', 0, 59),
+    ('hour',   0, 23),
+    ('dom',    1, 31),
+    ('month',  1, 12),
+    ('dow',    0, 7),     # 0 = Sunday (7 ก็รับเป็น Sunday)
+)
+
+CATCHUP_POLICIES = ('once', 'skip')
+
+
+def _parse_field(text, lo, hi, name):
+    values = set()
+    for part in text.split(','):
+        step = 1
+        if '/' in part:
+            part, step_s = part.split('/', 1)
+            step = int(step_s)
+            if step < 1:
+                raise ValueError(f"{name}: step must be >= 1")
+        if part in ('*', ''):
+            start, end = lo, hi
+        elif '-' in part:
+            a, b = part.split('-', 1)
+            start, end = int(a), int(b)
+        else:
+            start = int(part)
+            end = hi if step > 1 else start
+        if start < lo or end > hi or start > end:
+            raise ValueError(f"{name}: {part} out of range {lo}-{hi}")
+        values.update(range(start, end + 1, step))
+    if name == 'dow' and 7 in values:
+        values.discard(7)
+        values.add(0)
+    return values
+
+
+class CronSpec:
+    """Minimal cron expression (*, a-b, a,b, */n) with next_after()."""
+
+    def __init__(self, expr: str):
+        parts = (expr or '').split()
+        if len(parts) != 5:
+            raise ValueError("cron expression needs 5 fields: minute hour day month weekday")
+        self.expr = ' '.join(parts)
+        parsed = [_parse_field(p, lo, hi, name) for p, (name, lo, hi) in zip(parts, _FIELDS)]
+        self.minutes, self.hours, self.doms, self.months, self.dows = parsed
+        self._dom_any = parts[2] == '*'
+        self._dow_any = parts[4] == '*'
+
+    def _day_matches(self, t):
+        dow = (t.weekday() + 1) % 7          # Python Monday=0 → cron Sunday=0
+        if self._dom_any and self._dow_any:
+            return True
+        if self._dom_any:
+            return dow in self.dows
+        if self._dow_any:
+            return t.day in self.doms
+        return t.day in self.doms or dow in self.dows   # cron: ถ้าระบุทั้งคู่ใช้ OR
+
+    def next_after(self, t):
+        """First matching minute strictly after t (keeps t's tzinfo)."""
+        t = t.replace(second=0, microsecond=0) + timedelta(minutes=1)
+        limit = t + timedelta(days=8 * 366)    # 29 ก.พ. ห่างกันได้ถึง 8 ปี (เช่น 2096 → 2104)
+        while t <= limit:
+            if t.month not in self.months:
+                t = (t.replace(day=1, hour=0, minute=0) + timedelta(days=32)).replace(day=1)
+                continue
+            if not self._day_matches(t):
+                t = t.replace(hour=0, minute=0) + timedelta(days=1)
+                continue
+            if t.hour not in self.hours:
+                t = t.replace(minute=0) + timedelta(hours=1)
+                continue
+            if t.minute not in self.minutes:
+                t += timedelta(minutes=1)
+                continue
+            return t
+        raise ValueError(f"cron '{self.expr}' never fires")
+
+
+def jittered(slot, jitter_seconds, seed=None):
+    """Spread schedules that share the same slot; seeded so a schedule keeps a stable offset."""
+    if not jitter_seconds:
+        return slot
+    rng = random.Random(seed) if seed is not None else random
+    return slot + timedelta(seconds=rng.uniform(0, jitter_seconds))
+
+
+def plan_due(schedule: dict, now):
+    """
+    Decide what to do with a schedule whose next_run <= now.
+    Returns (run: bool, next_slot, next_run, missed: int)
+      - อยู่ใน misfire grace → run ตามปกติ
+      - เลย grace: policy 'once' = run หนึ่งครั้งแทนรอบที่พลาดทั้งหมด, 'skip' = ข้ามไปรอบถัดไป
+    """
+    cron = CronSpec(schedule['cron'])
+    slot = schedule.get('next_slot') or schedule['next_run']
+    grace = timedelta(seconds=schedule.get('misfire_grace', 300))
+    late = now - slot > grace
+
+    missed = 0
+    next_slot = cron.next_after(slot)
+    while next_slot <= now:
+        missed += 1
+        next_slot = cron.next_after(next_slot)
+
+    seed = f"{schedule.get('_id')}:{next_slot.isoformat()}"
+    next_run = jittered(next_slot, schedule.get('jitter_seconds', 0), seed)
+    run = not late or schedule.get('catchup', 'once') == 'once'
+    return run, next_slot, next_run, missed
+
+
+def first_run(cron_expr, now, jitter_seconds=0, seed=None):
+    """(next_slot, next_run) for a newly created or re-enabled schedule."""
+    slot = CronSpec(cron_expr).next_after(now)
+    return slot, jittered(slot, jitter_seconds, f"{seed}:{slot.isoformat()}")
+
+
+def retry_delay(attempt, base_seconds=120, cap_seconds=3600):
+    """
+    Exponential backoff with equal jitter: a random delay between half and all of the
+    ceiling (attempt 1 → base/2..base, 2 → base..2×base, ...), so retries never bunch at ~0.
+    """
+    ceiling = min(cap_seconds, base_seconds * (2 ** max(0, attempt - 1)))
+    return random.uniform(ceiling / 2, ceiling)
+
+
+def stagger_order(devices, key='_id'):
+    """
+    Stable, hash-based shuffle so consecutive devices (often the same site / AAA server)
+    are not logged into back-to-back every night in the same order.
+    """
+    return sorted(devices, key=lambda d: hashlib.sha1(str(d.get(key)).encode()).hexdigest())
@@ -0,0 +1,78 @@
+import re
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional
+
+
+# ────────────────────────────────────────────────
+#   Show-command cache (หลายคนยิง show เดียวกันใส่ core switch ภายในไม่กี่วินาที)
+#   TTL สั้น + push เข้าเครื่องเมื่อไหร่ cache ของเครื่องนั้นทิ้งทันที
+# ────────────────────────────────────────────────
+
+SHOW_CACHE_SIZE = 512
+# allowlist (regex คั่นด้วย ;) — output ที่เปลี่ยนทุกวินาทีอย่าง clock / log ไม่ cache
+DEFAULT_ALLOW = r'^(?:show|display|dis|get)\s+(?!clock|logging|logbuffer|log\b|tech|users)'
+
+
+class ShowCache:
+    """
+    Read-through cache of run_command output per (device, username, command) with a short TTL.
+    A push to the device bumps its generation: existing entries are dropped, and reads that
+    started before the push finished are not stored.
+    """
+
+    def __init__(self, ttl: float = 15, allow: str = DEFAULT_ALLOW, size: int = SHOW_CACHE_SIZE):
+        self.ttl   = ttl
+        self.size  = size
+        self.allow = [re.compile(p.strip(), re.IGNORECASE) for p in allow.split(';') if p.strip()]
+        self._lock = threading.Lock()
+        self._items = OrderedDict()          # key → (stored_at, generation, result)
+        self._gen   = {}                     # host → generation
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def _host(device) -> str:
+        return f"{device.get('ip_address', '')}:{device.get('port', 22)}"
+
+    def _key(self, device, command: str):
+        return self._host(device), device.get('username', ''), ' '.join(command.split())
+
+    def cacheable(self, command: str) -> bool:
+        cmd = ' '.join((command or '').split())
+        return self.ttl > 0 and any(p.match(cmd) for p in self.allow)
+
+    def generation(self, device) -> int:
+        with self._lock:
+            return self._gen.get(self._host(device), 0)
+
+    def get(self, device, command: str, max_age: Optional[float] = None):
+        """Cached result marked cached=True, or None when missing / older than min(ttl, max_age)."""
+        limit = self.ttl if max_age is None else min(self.ttl, float(max_age))
+        key = self._key(device, command)
+        with self._lock:
+            entry = self._items.get(key)
+            if entry and entry[1] == self._gen.get(key[0], 0) and time.monotonic() - entry[0] <= limit:
+                self._items.move_to_end(key)
+                self.hits += 1
+                return dict(entry[2], cached=True, cache_age=round(time.monotonic() - entry[0], 1))
+            self.misses += 1
+            return None
+
+    def put(self, device, command: str, result: dict, generation: int):
+        key = self._key(device, command)
+        with self._lock:
+            if generation != self._gen.get(key[0], 0):
+                return                       # มี push ระหว่างที่อ่าน — output นี้อาจเก่าแล้ว
+            self._items[key] = (time.monotonic(), generation, result)
+            self._items.move_to_end(key)
+            while len(self._items) > self.size:
+                self._items.popitem(last=False)
+
+    def invalidate(self, device):
+        host = self._host(device)
+        with self._lock:
+            self._gen[host] = self._gen.get(host, 0) + 1
+            for key in [k for k in self._items if k[0] == host]:
+                del self._items[key]
@@ -0,0 +1,247 @@
+import re
+
+from vendors import resolve_vendor
+
+
+# ────────────────────────────────────────────────
+#   Operational-state parsers
+#   แปลง section ใน backup (MAC / ARP / Route / Interface) เป็น row ที่ query ได้
+#   template = regex ต่อบรรทัดแบบ TTP-style, compile ครั้งเดียวตอน import
+# ────────────────────────────────────────────────
+
+SECTION_TABLES = {
+    'MAC Address Table': 'mac',
+    'ARP Table':         'arp',
+    'Routing Table':     'routes',
+    'Interface Status':  'interfaces',
+}
+
+_MAC_DOT    = r'[0-9a-fA-F]{4}\.[0-9a-fA-F]{4}\.[0-9a-fA-F]{4}'
+_MAC_DASH3  = r'[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}'
+_MAC_DASH2  = r'[0-9a-fA-F]{6}-[0-9a-fA-F]{6}'
+_MAC_COLON  = r'(?:[0-9a-fA-F]{2}[:-]){5}[0-9a-fA-F]{2}'
+_MAC_ANY    = f'(?:{_MAC_DOT}|{_MAC_DASH3}|{_MAC_DASH2}|{_MAC_COLON})'
+_IPV4       = r'\d{1,3}(?:\.\d{1,3}){3}'
+
+_T = {
+    'MAC_DOT': _MAC_DOT, 'MAC_DASH3': _MAC_DASH3, 'MAC_DASH2': _MAC_DASH2,
+    'MAC_COLON': _MAC_COLON, 'MAC_ANY': _MAC_ANY, 'IPV4': _IPV4,
+}
+
+# table → family → [row patterns]  (ลองตามลำดับ ตัวแรกที่ match ใช้ได้เลย)
+TEMPLATES = {
+    'mac': {
+        'ios': [
+            r'^\s*(?P<vlan>\d+)\s+(?P<mac>{MAC_DOT})\s+(?P<type>\S+)\s+(?:\S+\s+)*?(?P<port>\S+)\s*$',
+            r'^\s*(?P<mac>{MAC_COLON})\s+(?P<vlan>\d+)\s+(?P<type>\S+)\s+(?P<port>\S+)',        # Aruba CX
+        ],
+        'procurve': [
+            r'^\s*(?P<mac>{MAC_DASH2})\s+(?P<port>\S+)\s+(?P<vlan>\d+)',
+        ],
+        'comware': [
+            r'^\s*(?P<mac>{MAC_DASH3})\s+(?P<vlan>\d+)/\S*\s+(?P<port>\S+)\s+(?P<type>\S+)',     # Huawei
+            r'^\s*(?P<mac>{MAC_DASH3})\s+(?P<vlan>\d+)\s+(?P<type>\S+)\s+(?P<port>\S+)',         # Comware
+        ],
+    },
+    'arp': {
+        'ios': [
+            r'^\s*Internet\s+(?P<ip>{IPV4})\s+(?P<age>\S+)\s+(?P<mac>{MAC_ANY})\s+\S+\s+(?P<interface>\S+)',
+            r'^\s*(?P<ip>{IPV4})\s+(?P<mac>{MAC_COLON})\s+(?P<interface>\S+)\s+(?P<port>\S+)?',  # Aruba CX
+        ],
+        'procurve': [
+            r'^\s*(?P<ip>{IPV4})\s+(?P<mac>{MAC_DASH2})\s+(?P<type>\S+)\s+(?P<port>\S+)',
+        ],
+        'comware': [
+            r'^\s*(?P<ip>{IPV4})\s+(?P<mac>{MAC_DASH3})\s+(?P<vlan>\d+)\s+(?P<interface>\S+)\s+(?P<age>\S+)\s+(?P<type>\S+)',
+            r'^\s*(?P<ip>{IPV4})\s+(?P<mac>{MAC_DASH3})\s+(?P<age>\d*)\s*(?P<type>[DSI]\S*)\s+(?P<interface>\S+)',  # Huawei
+        ],
+        'juniper': [
+            r'^\s*(?P<mac>{MAC_COLON})\s+(?P<ip>{IPV4})\s+\S+\s+(?P<interface>\S+)',
+        ],
+        'fortinet': [
+            r'^\s*(?P<ip>{IPV4})\s+(?P<age>\d+)\s+(?P<mac>{MAC_COLON})\s+(?P<interface>\S+)',
+        ],
+    },
+    'routes': {
+        'ios': [
+            r'^(?P<protocol>[A-Za-z][A-Za-z0-9*]?\*?(?:\s+[A-Z][A-Z0-9]?)?)\s+(?P<prefix>{IPV4}(?:/\d+)?)\s+'
+            r'\[(?P<distance>\d+)/(?P<metric>\d+)\]\s+via\s+(?P<next_hop>{IPV4})(?:,\s*(?:[\dwdhms:]+,\s*)?(?P<interface>\S+))?',
+            r'^(?P<protocol>[CL])\s+(?P<prefix>{IPV4}(?:/\d+)?)\s+is directly connected,\s*(?P<interface>\S+)',
+        ],
+        'procurve': [
+            r'^\s*(?P<prefix>{IPV4}/\d+)\s+(?P<next_hop>\S+)\s+(?P<interface>\S+)\s+(?P<protocol>connected|static|ospf|rip|bgp)\b',
+        ],
+        'comware': [
+            r'^\s*(?P<prefix>{IPV4}/\d+)\s+(?P<protocol>[A-Za-z_-]+)\s+(?P<distance>\d+)\s+(?P<metric>\d+)\s+'
+            r'(?:[A-Z]{1,2}\s+)?(?P<next_hop>{IPV4})\s+(?P<interface>\S+)',
+        ],
+        'juniper': [
+            r'^(?P<prefix>{IPV4}/\d+)\s+\*?\[(?P<protocol>[\w-]+)/(?P<distance>\d+)\].*?'
+            r'(?:to (?P<next_hop>{IPV4}))?\s*(?:via (?P<interface>\S+))?\s*$',
+        ],
+        'fortinet': [
+            r'^(?P<protocol>[A-Za-z]\*?)\s+(?P<prefix>{IPV4}/\d+)\s+\[(?P<distance>\d+)/(?P<metric>\d+)\]\s+'
+            r'via\s+(?P<next_hop>{IPV4}),\s*(?P<interface>\S+)',
+            r'^(?P<protocol>C)\s+(?P<prefix>{IPV4}/\d+)\s+is directly connected,\s*(?P<interface>\S+)',
+        ],
+    },
+    'interfaces': {
+        'ios': [
+            r'^(?P<interface>\S+)\s+(?P<ip>{IPV4}|unassigned)\s+\S+\s+\S+\s+'
+            r'(?P<status>administratively down|up|down|deleted)\s+(?P<protocol>\S+)',
+            r'^(?P<interface>\S+)\s+(?P<ip>{IPV4}/\d+|unassigned)\s+(?P<status>up|down)',        # Aruba CX
+        ],
+        'procurve': [
+            r'^\s*(?P<interface>[A-Z]?\d+(?:/\d+)?)\s+\S+\s+\|\s+\S+\s+\S+\s+(?P<status>Up|Down)\b',
+        ],
+        'comware': [
+            r'^(?P<interface>\S+)\s+(?P<ip>{IPV4}/\d+|unassigned)\s+(?P<status>\*?(?:up|down))\s+(?P<protocol>\S+)',  # Huawei
+            r'^(?P<interface>\S+)\s+(?P<status>\*?(?:up|down|ADM))\s+(?P<protocol>\S+)\s+(?P<ip>{IPV4}|--)',
+        ],
+        'juniper': [
+            r'^(?P<interface>[a-z]{2,}[\w/.:-]*)\s+(?P<status>up|down)\s+(?P<protocol>up|down)'
+            r'(?:\s+\S+\s+(?P<ip>{IPV4}/\d+))?',
+        ],
+    },
+}
+
+_PLACEHOLDER = re.compile(r'\{(' + '|'.join(_T) + r')\}')
+
+
+def _expand(pattern: str) -> str:
+    # แทน {IPV4} / {MAC_*} ด้วย regex จริง (ไม่ใช้ str.format เพราะชนกับ {1,3})
+    return _PLACEHOLDER.sub(lambda m: _T[m.group(1)], pattern)
+
+
+_COMPILED = {
+    table: {
+        family: [re.compile(_expand(p), re.IGNORECASE) for p in patterns]
+        for family, patterns in families.items()
+    }
+    for table, families in TEMPLATES.items()
+}
+
+
+def normalize_mac(value: str):
+    """Any vendor MAC notation → 'aa:bb:cc:dd:ee:ff' (None if not a MAC)."""
+    hexdigits = re.sub(r'[^0-9a-fA-F]', '', value or '')
+    if len(hexdigits) != 12:
+        return None
+    hexdigits = hexdigits.lower()
+    return ':'.join(hexdigits[i:i + 2] for i in range(0, 12, 2))
+
+
+def state_family(device_type: str) -> str:
+    """Which template family a device's show-command output follows."""
+    return resolve_vendor(device_type).syntax
+
+
+def _clean_row(table, row):
+    row = {k: v.strip() for k, v in row.items() if v is not None and v.strip() != ''}
+    if 'mac' in row:
+        row['mac'] = normalize_mac(row['mac'])
+        if not row['mac']:
+            return None
+    for key in ('vlan', 'distance', 'metric'):
+        if key in row:
+            try:
+                row[key] = int(row[key])
+            except ValueError:
+                pass
+    if table == 'routes' and 'protocol' in row:
+        row['protocol'] = ' '.join(row['protocol'].split())
+    return row
+
+
+def parse_section(table: str, family: str, text: str) -> list:
+    """Run one table's templates over a section's output, one regex pass per line."""
+    patterns = _COMPILED.get(table, {}).get(family)
+    if patterns is None:
+        return []
+    rows = []
+    for line in (text or '').splitlines():
+        if not line.strip():
+            continue
+        for pat in patterns:
+            m = pat.match(line)
+            if m:
+                row = _clean_row(table, m.groupdict())
+                if row:
+                    rows.append(row)
+                break
+    return rows
+
+
+def parse_backup_state(sections: dict, device_type: str) -> dict:
+    """
+    sections: {section_name: (command, output)} from a stored backup
+    Returns {table: [rows]} for every section we have a template for.
+    """
+    family = state_family(device_type)
+    out = {}
+    for section_name, table in SECTION_TABLES.items():
+        if section_name in sections:
+            _, output = sections[section_name]
+            out[table] = parse_section(table, family, output)
+    return out
+
+
+# ── Port helpers (ใช้กับ endpoint locator) ──
+_LAG_PORT = re.compile(
+    r'^(?:po|port-channel|bagg|bridge-aggregation|eth-trunk|trk|lag|ae)\s*\d', re.IGNORECASE
+)
+_NON_EDGE_PORT = re.compile(r'^(?:cpu|router|self|switch|vlan|vlanif|drop|sup-eth)', re.IGNORECASE)
+_PORT_NUMBER = re.compile(r'\d[\d/:.]*$')
+
+
+def port_key(port: str) -> str:
+    """
+    Loose port identity so LLDP and MAC-table spellings compare equal:
+    'GigabitEthernet1/0/49' / 'Gi1/0/49' → 'g1/0/49', '25' → '25'
+    """
+    port = (port or '').strip()
+    m = _PORT_NUMBER.search(port)
+    if not m:
+        return port.lower()
+    prefix = port[:m.start()].strip().lower()
+    return (prefix[:1] if prefix else '') + m.group(0)
+
+
+def is_edge_candidate(port: str) -> bool:
+    """False for LAG / CPU / VLAN interfaces that never carry a single endpoint."""
+    port = (port or '').strip()
+    return bool(port) and not _LAG_PORT.match(port) and not _NON_EDGE_PORT.match(port)
+
+
+def uplink_ports(lldp_ports, mac_rows, threshold: int) -> set:
+    """port_key of ports that face another switch: an LLDP neighbor on the port, or more than `threshold` MACs."""
+    uplinks = {port_key(p) for p in lldp_ports}
+    per_port = {}
+    for row in mac_rows:
+        k = port_key(row.get('port'))
+        per_port[k] = per_port.get(k, 0) + 1
+    uplinks.update(k for k, n in per_port.items() if n > threshold)
+    return uplinks
+
+
+def endpoint_entries(parsed: dict, lldp_ports=(), threshold: int = 64):
+    """
+    What the endpoint locator should hold for one device after a backup:
+    ({mac: {'port', 'vlan'}} on edge ports only, {ip: {'mac', 'interface'}}).
+    Either side is None when the backup had no such table (leave the index alone).
+    """
+    locations = None
+    if 'mac' in parsed:
+        uplinks = uplink_ports(lldp_ports, parsed['mac'], threshold)
+        locations = {}
+        for row in parsed['mac']:
+            port = row.get('port')
+            if not is_edge_candidate(port) or port_key(port) in uplinks:
+                continue
+            locations[row['mac']] = {'port': port, 'vlan': row.get('vlan')}
+
+    ips = None
+    if 'arp' in parsed:
+        ips = {row['ip']: {'mac': row['mac'], 'interface': row.get('interface')}
+               for row in parsed['arp'] if row.get('ip') and row.get('mac')}
+    return locations, ips
@@ -1,13 +1,26 @@
 import socket
 import re
-from datetime import datetime
+from datetime import datetime, timezone
 from pymongo import MongoClient
+import certifi
+
+import env
+from dotenv import load_dotenv
+load_dotenv()
 
 # ตั้งค่า Database
 client = MongoClient('mongodb://localhost:27017/')
 db = client['network_automation_db']
 collection = db['syslogs']  # เก็บ Log แยกไว้ที่นี่
 
+# ✅ Config-change events → DB ของ app.py (app จะ debounce แล้วสั่ง backup เครื่องนั้น)
+#    ใช้ URI / TLS เดียวกับ app.py — ไม่มี PYTHON_MONGODB_URI = หยุดเลย (ห้าม fallback ไป localhost ที่ app ไม่ได้อ่าน)
+APP_MONGO_URI = env.get_env_variable('PYTHON_MONGODB_URI')
+app_client = MongoClient(APP_MONGO_URI, tlsCAFile=certifi.where())
+change_events = app_client['net_automation']['config_change_events']
+change_events.create_index('device_ip', unique=True)
+CHANGE_EVENT_HISTORY = 20   # เก็บ event ล่าสุดต่อ device ไว้ดูว่าใครแก้อะไร
+
 # ตั้งค่า UDP Server
 UDP_IP = "0.0.0.0" # ฟังทุก IP ในเครื่อง
 UDP_PORT = 514     # Port มาตรฐาน Syslog
@@ -48,6 +61,31 @@ def parse_cisco_log(message):
     
     return None
 
+
+def record_config_change(device_ip, entry):
+    """
+    One document per device: every event pushes last_event_at forward and re-arms it as pending.
+    The app waits for a quiet period before backing the device up, so a long CLI session
+    (dozens of LOGGEDCMD lines) collapses into a single backup.
+    """
+    now = datetime.now(timezone.utc)
+    change_events.update_one(
+        {'device_ip': device_ip},
+        {
+            '$set': {'last_event_at': now, 'status': 'pending'},
+            '$inc': {'event_count': 1},
+            '$setOnInsert': {'first_event_at': now},
+            '$push': {'recent': {'$each': [{
+                'at': now,
+                'type': entry['log_type'],
+                'user': entry.get('user'),
+                'details': entry.get('details'),
+            }], '$slice': -CHANGE_EVENT_HISTORY}},
+        },
+        upsert=True
+    )
+
+
 while True:
     try:
         data, addr = sock.recvfrom(1024) # รับข้อมูล (Buffer size 1024)
@@ -69,6 +107,7 @@ while True:
             
             # บันทึกลง MongoDB
             collection.insert_one(log_entry)
+            record_config_change(device_ip, log_entry)
             print(f"🚨 Captured: {device_ip} -> {parsed_data['user']} did {parsed_data.get('command')}")
 
     except Exception as e:
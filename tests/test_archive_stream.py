@@ -0,0 +1,38 @@
+import io
+import tarfile
+import zipfile
+
+from archive_stream import CHUNK_SIZE, iter_tar_gz, iter_zip
+
+
+def entries():
+    yield 'a.txt', 'hello'
+    yield 'dir/b.cfg', b'\x00binary\xff' * 10
+    yield 'big.txt', ('x' * 1000 for _ in range(200))     # generator of chunks
+
+
+def expected():
+    return {'a.txt': b'hello', 'dir/b.cfg': b'\x00binary\xff' * 10, 'big.txt': b'x' * 200000}
+
+
+def test_zip_round_trip():
+    data = b''.join(iter_zip(entries()))
+    with zipfile.ZipFile(io.BytesIO(data)) as zf:
+        assert zf.testzip() is None
+        assert {n: zf.read(n) for n in zf.namelist()} == expected()
+
+
+def test_zip_is_streamed_in_chunks():
+    chunks = list(iter_zip(('f%d' % i, 'y' * CHUNK_SIZE) for i in range(4)))
+    assert len(chunks) > 1
+
+
+def test_empty_zip_is_valid():
+    with zipfile.ZipFile(io.BytesIO(b''.join(iter_zip([])))) as zf:
+        assert zf.namelist() == []
+
+
+def test_tar_gz_round_trip():
+    data = b''.join(iter_tar_gz(entries()))
+    with tarfile.open(fileobj=io.BytesIO(data), mode='r:gz') as tf:
+        assert {m.name: tf.extractfile(m).read() for m in tf.getmembers()} == expected()
@@ -0,0 +1,75 @@
+import pytest
+
+from backup_delta import (
+    apply_delta, backup_header, decode_sections, encode_sections, make_delta, render_backup, section_hash,
+)
+
+
+CONFIG = ''.join(f"interface Gi1/0/{i}\n description port {i}\n!\n" for i in range(1, 40))
+
+
+@pytest.mark.parametrize('old, new', [
+    ('', ''),
+    ('', 'a\nb\n'),
+    ('a\nb\n', ''),
+    ('a\nb\nc\n', 'a\nB\nc\n'),
+    ('a\nb', 'a\nb\n'),                 # trailing newline only
+    ('a\r\nb\r\n', 'a\r\nc\r\n'),       # CRLF kept exactly
+    (CONFIG, CONFIG.replace('port 7\n', 'uplink\n') + 'end\n'),
+])
+def test_delta_round_trip(old, new):
+    assert apply_delta(old, make_delta(old, new)) == new
+
+
+def store_of(*bodies):
+    blobs = {section_hash(b): b for b in bodies}
+    return blobs.get
+
+
+def test_first_upload_sends_full_text():
+    sections = [('Running Config', 'show run', CONFIG), ('Version', 'show version', 'IOS 15.2\n')]
+    wire, index = encode_sections(sections, {})
+    assert all('text' in e for e in wire)
+    assert index == {'Running Config': (section_hash(CONFIG), CONFIG), 'Version': (section_hash('IOS 15.2\n'), 'IOS 15.2\n')}
+    assert decode_sections(wire, store_of()) == sections
+
+
+def test_unchanged_and_changed_sections_round_trip():
+    _, previous = encode_sections([('Running Config', 'show run', CONFIG), ('Version', 'show version', 'IOS 15.2\n')], {})
+    changed = CONFIG.replace('port 7\n', 'uplink\n')
+    sections = [('Running Config', 'show run', changed), ('Version', 'show version', 'IOS 15.2\n')]
+    wire, _ = encode_sections(sections, previous)
+
+    run, ver = wire
+    assert run['base'] == section_hash(CONFIG) and 'delta' in run and 'text' not in run
+    assert set(ver) == {'name', 'cmd', 'hash'}                   # unchanged → hash only
+    assert decode_sections(wire, store_of(CONFIG, 'IOS 15.2\n')) == sections
+
+
+def test_rewritten_section_falls_back_to_text():
+    _, previous = encode_sections([('ARP', 'show arp', 'x\n' * 50)], {})
+    wire, _ = encode_sections([('ARP', 'show arp', 'y\n' * 50)], previous)
+    assert wire[0]['text'] == 'y\n' * 50
+
+
+def test_decode_missing_base():
+    _, previous = encode_sections([('Version', 'show version', 'IOS 15.2\n')], {})
+    wire, _ = encode_sections([('Version', 'show version', 'IOS 15.2\n')], previous)
+    with pytest.raises(LookupError):
+        decode_sections(wire, store_of())
+
+
+def test_decode_hash_mismatch():
+    _, previous = encode_sections([('Running Config', 'show run', CONFIG)], {})
+    wire, _ = encode_sections([('Running Config', 'show run', CONFIG + 'end\n')], previous)
+    wrong_base = CONFIG.replace('port 1\n', 'port one\n')
+    fetch = lambda h: wrong_base if h == section_hash(CONFIG) else None
+    with pytest.raises(ValueError):
+        decode_sections(wire, fetch)
+
+
+def test_render_backup_layout():
+    text = render_backup(backup_header('SW1', '2024-01-01 02:00:00'), [('Version', 'show version', 'IOS 15.2')])
+    assert text.startswith('=== NETWORK AUDIT BACKUP FOR SW1 ===\nTimestamp: 2024-01-01 02:00:00\n\n')
+    assert '\n👉 Version (show version)\n' in text
+    assert text.endswith('IOS 15.2\n')
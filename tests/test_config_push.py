@@ -0,0 +1,227 @@
+import pytest
+
+from config_push import (
+    PushTransaction, apply_push, cli_error, flatten_commands, inverse_commands, normalize_config, replace_method,
+)
+from vendors import resolve_vendor
+
+
+BASE = ['hostname SW1', 'interface Gi1/0/1', 'description uplink', 'vlan 10', 'name users']
+
+
+class FakeDevice:
+    """Running config as a flat, ordered line list; enough to check snapshot / push / rollback."""
+
+    def __init__(self, running=BASE):
+        self.running = list(running)
+        self.files = {}
+        self.replace_fails = False
+        self.outputs = {}
+        self.log = []
+
+
+class FakeConn:
+    def __init__(self, device):
+        self.device = device
+        self.hung = False
+        self.push_raises = None
+        self.closed = False
+
+    def send_command(self, command, read_timeout=None):
+        if command == 'show running-config':
+            return "Building configuration...\n\nCurrent configuration : 123 bytes\n" + '\n'.join(self.device.running)
+        return self.device.outputs.get(command, '')
+
+    def send_config_set(self, commands, read_timeout=None):
+        if self.push_raises:
+            raise self.push_raises
+        self.device.log.append(list(commands))
+        out = []
+        for c in commands:
+            if 'bogus' in c:
+                out.append("% Invalid input detected at '^' marker.")
+            elif c.startswith('no '):
+                if c[3:] in self.device.running:
+                    self.device.running.remove(c[3:])
+            elif c not in ('exit', 'end') and c not in self.device.running:
+                self.device.running.append(c)
+        return '\n'.join(out)
+
+    def send_command_timing(self, command, read_timeout=None):
+        self.device.log.append(command)
+        if command.startswith('copy running-config '):
+            self.device.files[command.split()[-1]] = list(self.device.running)
+            return 'Destination filename [netpilot-rollback.cfg]? '
+        if command == '\n':
+            return '2311 bytes copied in 0.1 secs'
+        if command.startswith('configure replace '):
+            if self.device.replace_fails:
+                return '%Error opening flash:netpilot-rollback.cfg (No such file or directory)'
+            self.device.running = list(self.device.files[command.split()[2]])
+            return 'Rollback Done'
+        return ''
+
+    def find_prompt(self):
+        if self.hung:
+            raise OSError('Socket is closed')
+        return 'SW1#'
+
+    def exit_config_mode(self):
+        return ''
+
+    def config_mode(self):
+        return ''
+
+    def disconnect(self):
+        self.closed = True
+
+
+def send(conn, command, timeout):
+    return conn.send_command(command, read_timeout=timeout)
+
+
+def begin(device, device_type='cisco_ios'):
+    conn = FakeConn(device)
+    txn = PushTransaction(conn, {'ip_address': '10.0.0.1', 'device_type': device_type},
+                          send=send, reconnect=lambda: FakeConn(device))
+    txn.begin()
+    return conn, txn
+
+
+def test_commit_records_diff_and_saves():
+    dev = FakeDevice()
+    conn, txn = begin(dev)
+    assert txn.rollback_file == 'flash:netpilot-rollback.cfg'
+    assert dev.log.count('\n') == 1                     # filename prompt answered once
+
+    result = apply_push(conn, ['interface Gi1/0/2', 'description new'], txn, save=lambda: 'saved')
+    assert result['status'] == 'Success'
+    assert result['save_output'] == 'saved'
+    assert result['commands_applied'] == ['interface Gi1/0/2', 'description new']
+    change = result['change']
+    assert change['status'] == 'committed'
+    assert '+description new' in change['diff']
+    assert change['before_hash'] != change['after_hash']
+
+
+def test_rejected_command_rolls_back_via_configure_replace():
+    dev = FakeDevice()
+    conn, txn = begin(dev)
+    result = apply_push(conn, ['vlan 99', 'name guests', 'bogus command'], txn, save=lambda: pytest.fail('saved'))
+    assert result['status'] == 'Failed'
+    assert result['rolled_back'] is True
+    assert result['commands_applied'] == []
+    assert result['change']['rollback_method'] == 'configure replace'
+    assert result['change']['rollback_verified'] is True
+    assert dev.running == BASE
+    assert 'Rolled back via configure replace (verified)' in result['output']
+
+
+def test_failed_replace_falls_back_to_inverse_commands():
+    dev = FakeDevice()
+    dev.replace_fails = True
+    conn, txn = begin(dev)
+    result = apply_push(conn, ['vlan 99', 'bogus command'], txn)
+    assert result['change']['rollback_method'] == 'inverse'
+    assert result['change']['rollback_verified'] is True
+    assert dev.log[-1] == ['no vlan 99']
+    assert dev.running == BASE
+
+
+def test_vendor_without_replace_uses_inverse_commands():
+    dev = FakeDevice()
+    conn, txn = begin(dev, device_type='aruba_os')
+    assert txn.rollback_file is None
+    result = apply_push(conn, ['interface Gi1/0/1', 'description changed', 'bogus'], txn)
+    assert result['change']['rollback_method'] == 'inverse'
+    assert dev.log[-1] == ['interface Gi1/0/1', 'no bogus', 'no description changed', 'exit']
+    assert dev.running == BASE
+
+
+def test_failed_verify_command_rolls_back():
+    dev = FakeDevice()
+    dev.outputs['show vlan id 99'] = '% Invalid input detected'
+    conn, txn = begin(dev)
+    result = apply_push(conn, ['vlan 99'], txn, verify_commands=['show vlan id 99'])
+    assert result['rolled_back'] is True
+    assert result['change']['reason'].startswith("verify 'show vlan id 99'")
+    assert dev.running == BASE
+
+
+def test_push_exception_rolls_back_hung_session_on_a_new_one():
+    dev = FakeDevice()
+    conn, txn = begin(dev)
+    dev.running.append('vlan 99')                      # half-applied before the session died
+    conn.push_raises = OSError('timed out')
+    conn.hung = True
+    result = apply_push(conn, ['vlan 99'], txn)
+    assert result['change']['reason'] == 'push failed: timed out'
+    assert conn.closed and txn.conn is not conn
+    assert dev.running == BASE
+
+
+def test_rollback_failing_part_way_is_not_repeated():
+    dev = FakeDevice()
+    conn, txn = begin(dev)
+    calls = []
+
+    def broken_rollback(reason, commands):
+        calls.append(reason)
+        raise OSError('connection reset')
+
+    txn.rollback = broken_rollback
+    result = apply_push(conn, ['bogus'], txn)
+    assert calls == ["device rejected a command (% invalid)"]
+    assert result['status'] == 'Failed'
+    assert 'Rollback failed part-way' in result['output']
+    assert 'rolled_back' not in result
+
+
+def test_error_after_verified_push_rolls_back_once():
+    dev = FakeDevice()
+    conn, txn = begin(dev)
+
+    def save():
+        raise OSError('write memory timed out')
+
+    result = apply_push(conn, ['vlan 99'], txn, save=save)
+    assert result['status'] == 'Failed'
+    assert result['rolled_back'] is True
+    assert result['change']['reason'] == 'error: write memory timed out'
+    assert dev.running == BASE
+
+
+def test_push_without_transaction_reports_failure():
+    conn = FakeConn(FakeDevice())
+    conn.push_raises = OSError('timed out')
+    assert apply_push(conn, ['vlan 99']) == {'status': 'Failed', 'output': 'timed out',
+                                            'save_output': '', 'commands_applied': []}
+
+
+@pytest.mark.parametrize('device_type, rollback_file, method', [
+    ('cisco_ios', 'flash:x', 'configure replace'),
+    ('cisco_ios', None, 'inverse'),
+    ('hp_comware', 'flash:/x', 'configuration replace'),
+    ('huawei', 'flash:/x', 'inverse'),
+    ('aruba_os', 'flash:x', 'inverse'),
+])
+def test_replace_method(device_type, rollback_file, method):
+    assert replace_method(resolve_vendor(device_type), rollback_file) == method
+
+
+def test_inverse_commands():
+    ios, comware = resolve_vendor('cisco_ios'), resolve_vendor('hp_comware')
+    assert inverse_commands(['interface Gi1/0/1', 'shutdown', 'no cdp enable', 'exit'], ios) == \
+        ['interface Gi1/0/1', 'cdp enable', 'no shutdown', 'exit']
+    assert inverse_commands(['vlan 20', 'description x'], comware) == ['vlan 20', 'undo description x', 'quit']
+    before = ['vlan 10', 'name users']
+    assert inverse_commands(['vlan 99', 'name guests', 'vlan 10', 'name users', 'name staff'], ios, before) == \
+        ['no vlan 99', 'vlan 10', 'no name staff', 'exit']
+
+
+def test_helpers():
+    assert flatten_commands('vlan 10\n name x\n\n') == ['vlan 10', 'name x']
+    assert flatten_commands(['a', 'b\nc', '  ']) == ['a', 'b', 'c']
+    assert cli_error('ok') is None
+    assert cli_error('% Incomplete command.') == '% incomplete'
+    assert normalize_config('Building configuration...\n!\nhostname A  \n\n') == ['!', 'hostname A']
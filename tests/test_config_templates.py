@@ -0,0 +1,114 @@
+import pytest
+
+pytest.importorskip('jinja2')
+
+from jinja2.exceptions import SecurityError
+
+import config_templates
+from config_templates import (
+    TemplateCache, body_for, parse_vlan_range, render_bulk, render_commands, template_family,
+    template_vars, validate_bodies,
+)
+
+
+BODIES = {
+    'default': "hostname {{ hostname }}\n{% for v in vlans | vlan_range %}\nvlan {{ v }}\n{% endfor %}",
+    'comware': "sysname {{ hostname }}\n{% for v in vlans | vlan_range %}\nvlan {{ v }}\n{% endfor %}",
+}
+
+
+def test_parse_vlan_range():
+    assert parse_vlan_range('10,20-22') == [10, 20, 21, 22]
+    assert parse_vlan_range(' 5 , ,7') == [5, 7]
+    assert parse_vlan_range(30) == [30]
+    assert parse_vlan_range('30 to 31, 10-11, 11') == [10, 11, 30, 31]
+    assert parse_vlan_range('20-18') == []
+    with pytest.raises(ValueError):
+        parse_vlan_range('10,abc')
+
+
+def test_mask_filter():
+    assert config_templates._prefix_to_mask(24) == '255.255.255.0'
+    assert config_templates._prefix_to_mask('30') == '255.255.255.252'
+    assert config_templates._prefix_to_mask(0) == '0.0.0.0'
+
+
+def test_body_for_falls_back_to_default():
+    assert template_family('huawei') == 'comware'
+    assert body_for(BODIES, 'huawei') == BODIES['comware']
+    assert body_for(BODIES, 'cisco_ios') == BODIES['default']
+    assert body_for({'huawei': 'x'}, 'cisco_ios') is None
+
+
+def test_validate_bodies_reports_only_broken_families():
+    errors = validate_bodies({'default': '{{ ok }}', 'huawei': '{% for x in %}'})
+    assert list(errors) == ['huawei']
+    assert errors['huawei'].startswith('line 1:')
+
+
+def test_template_vars_precedence():
+    dev = {'hostname': 'sw1', 'ip_address': '10.0.0.1', 'device_type': 'cisco_ios',
+           'vars': {'site': 'dev', 'vlan': 10}}
+    out = template_vars(dev, row_vars={'vlan': 20}, common={'site': 'common', 'ntp': '1.1.1.1', 'hostname': 'x'})
+    assert out == {'hostname': 'sw1', 'ip_address': '10.0.0.1', 'device_type': 'cisco_ios',
+                   'site': 'dev', 'vlan': 20, 'ntp': '1.1.1.1'}
+
+
+def test_render_commands_per_vendor():
+    dev = {'hostname': 'sw1', 'device_type': 'huawei'}
+    assert render_commands(BODIES, dev, {'vlans': '10-11'}) == ['sysname sw1', 'vlan 10', 'vlan 11']
+    dev = {'hostname': 'sw2', 'device_type': 'cisco_ios'}
+    assert render_commands(BODIES, dev, {'vlans': '5'}) == ['hostname sw2', 'vlan 5']
+
+
+def test_render_commands_errors():
+    with pytest.raises(ValueError, match='missing variable'):
+        render_commands(BODIES, {'hostname': 'sw1', 'device_type': 'cisco_ios'})
+    with pytest.raises(ValueError, match='no template body'):
+        render_commands({'huawei': 'x'}, {'device_type': 'cisco_ios'})
+
+
+def test_render_bulk_keeps_order_and_isolates_errors():
+    targets = [
+        {'device': {'hostname': 'a', 'ip_address': '10.0.0.1', 'device_type': 'cisco_ios'}, 'vars': {'vlans': '1'}},
+        {'device': {'hostname': 'b', 'ip_address': '10.0.0.2', 'device_type': 'cisco_ios'}},
+        {'device': {'hostname': 'c', 'ip_address': '10.0.0.3', 'device_type': 'huawei'}},
+    ]
+    out = render_bulk(BODIES, targets, common={'vlans': '2'})
+    assert [r['ip'] for r in out] == ['10.0.0.1', '10.0.0.2', '10.0.0.3']
+    assert out[0]['commands'] == ['hostname a', 'vlan 1']
+    assert out[1]['commands'] == ['hostname b', 'vlan 2']
+    assert out[2]['commands'] == ['sysname c', 'vlan 2']
+    assert 'error' not in out[0]
+
+    out = render_bulk({'default': '{{ nope }}'}, targets[:1])
+    assert out[0]['error'].startswith('missing variable')
+
+
+def test_template_cache_lru():
+    cache = TemplateCache(size=2)
+    a = cache.get('a')
+    assert cache.get('a') is a
+    cache.get('b')
+    cache.get('c')                      # evicts 'a'
+    assert cache.get('a') is not a
+    assert (cache.hits, cache.misses) == (1, 4)
+
+
+def test_templates_render_in_a_sandbox():
+    tpl = config_templates.CACHE.get("{{ cycler.__init__.__globals__.os.popen('id').read() }}")
+    with pytest.raises(SecurityError):
+        tpl.render()
+
+
+@pytest.mark.parametrize('body, row_vars, reason', [
+    ('{{ 1 + x }}', {'x': 'ten'}, 'render error: TypeError'),
+    ('{{ 1 // x }}', {'x': 0}, 'render error: ZeroDivisionError'),
+    ('{{ x | vlan_range }}', {'x': 'ten'}, 'render error: ValueError'),
+    ("{{ cycler.__init__.__globals__ }}", {}, 'template error'),
+])
+def test_runtime_errors_become_value_errors(body, row_vars, reason):
+    with pytest.raises(ValueError, match=reason):
+        render_commands({'default': body}, {'device_type': 'cisco_ios'}, row_vars)
+    out = render_bulk({'default': body}, [{'device': {'ip_address': '10.0.0.9'}, 'vars': row_vars}])
+    assert out[0]['error'].startswith(reason.split(':')[0])
@@ -0,0 +1,69 @@
+import pytest
+
+pytest.importorskip('cryptography')
+
+from cryptography.fernet import Fernet
+
+from credential_vault import credential_id, payload_devices, seal, session_cipher, session_keypair, unseal
+
+
+CREDS = {'username': 'admin', 'password': 'p@ss', 'secret': 'en4ble'}
+
+
+def test_seal_round_trip_and_normalises_fields():
+    cipher = Fernet(Fernet.generate_key())
+    assert unseal(cipher, seal(cipher, CREDS)) == CREDS
+    assert unseal(cipher, seal(cipher, {'username': 'u', 'extra': 'x'})) == {'username': 'u', 'password': '', 'secret': ''}
+
+
+def test_unseal_with_wrong_key():
+    token = seal(Fernet(Fernet.generate_key()), CREDS)
+    with pytest.raises(ValueError):
+        unseal(Fernet(Fernet.generate_key()), token)
+
+
+def test_session_ciphers_agree():
+    server_priv, server_pub = session_keypair()
+    agent_priv, agent_pub = session_keypair()
+    server = session_cipher(server_priv, agent_pub)
+    agent = session_cipher(agent_priv, server_pub)
+    assert unseal(agent, seal(server, CREDS)) == CREDS
+
+
+def test_session_key_differs_per_session():
+    server_priv, _ = session_keypair()
+    _, agent_pub = session_keypair()
+    eve_priv, eve_pub = session_keypair()
+    token = seal(session_cipher(server_priv, agent_pub), CREDS)
+    with pytest.raises(ValueError):
+        unseal(session_cipher(eve_priv, eve_pub), token)
+
+
+@pytest.mark.parametrize('bad', ['', 'not base64!', 'AAAA'])
+def test_session_cipher_rejects_bad_public_key(bad):
+    priv, _ = session_keypair()
+    with pytest.raises(ValueError):
+        session_cipher(priv, bad)
+
+
+def test_credential_id_is_stable_and_keyed():
+    key = b'k' * 32
+    a = credential_id(key, 'alice', CREDS)
+    assert a == credential_id(key, 'alice', dict(CREDS))
+    assert a.startswith('cs_') and len(a) == 27
+    assert a != credential_id(key, 'bob', CREDS)
+    assert a != credential_id(b'x' * 32, 'alice', CREDS)
+    assert a != credential_id(key, 'alice', {**CREDS, 'secret': ''})
+    assert credential_id(key, 'alice', {'username': 'u'}) == credential_id(key, 'alice', {'username': 'u', 'secret': None})
+
+
+def test_payload_devices():
+    d1, d2, d3, d4 = ({'ip_address': f'10.0.0.{i}'} for i in range(1, 5))
+    payload = {
+        'device': d1,
+        'devices': [d2],
+        'tasks': [{'device': d3}, {'command': 'x'}],
+        'targets': [{'device': d4, 'vars': {}}],
+    }
+    assert list(payload_devices(payload)) == [d1, d2, d3, d4]
+    assert list(payload_devices({'command_type': 'ping'})) == []
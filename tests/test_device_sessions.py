@@ -0,0 +1,109 @@
+import threading
+import time
+
+import pytest
+
+from device_sessions import DeviceSessions, is_read_only
+
+SW = {'ip_address': '10.0.0.1', 'username': 'admin'}
+
+
+@pytest.mark.parametrize('command, expected', [
+    ('show run', True),
+    ('  SHOW   version', True),
+    ('display current-configuration', True),
+    ('dis int brief', True),
+    ('get system status', True),
+    ('showx', False),
+    ('configure terminal', False),
+    ('', False),
+])
+def test_is_read_only(command, expected):
+    assert is_read_only(command) is expected
+
+
+def test_limit_for_prefers_device_setting():
+    sessions = DeviceSessions(default_limit=3)
+    assert sessions.limit_for(SW) == 3
+    assert sessions.limit_for(dict(SW, max_sessions=1)) == 1
+    assert sessions.limit_for(dict(SW, max_sessions=0)) == 3
+    assert DeviceSessions(default_limit=0).limit_for(SW) == 1
+
+
+def peak_concurrency(sessions, device, workers=6):
+    lock, state = threading.Lock(), {'now': 0, 'peak': 0}
+
+    def work():
+        with sessions.slot(device):
+            with lock:
+                state['now'] += 1
+                state['peak'] = max(state['peak'], state['now'])
+            time.sleep(0.02)
+            with lock:
+                state['now'] -= 1
+
+    threads = [threading.Thread(target=work) for _ in range(workers)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join(5)
+    return state['peak']
+
+
+def test_slot_caps_concurrent_sessions_per_device():
+    assert peak_concurrency(DeviceSessions(default_limit=2), SW) == 2
+    assert peak_concurrency(DeviceSessions(default_limit=5), dict(SW, max_sessions=1)) == 1
+
+
+def test_nested_slot_on_same_device_does_not_deadlock():
+    sessions = DeviceSessions(default_limit=1)
+    with sessions.slot(SW):
+        with sessions.slot(SW):
+            pass
+    assert sessions._active == {}
+
+
+def test_identical_commands_in_flight_share_one_call():
+    sessions = DeviceSessions()
+    started, release = threading.Event(), threading.Event()
+    calls, results = [], []
+
+    def fn():
+        calls.append(1)
+        started.set()
+        release.wait(5)
+        return {'output': 'ok'}
+
+    first = threading.Thread(target=lambda: results.append(sessions.coalesce(SW, 'show  run', fn)))
+    first.start()
+    started.wait(5)
+    second = threading.Thread(target=lambda: results.append(sessions.coalesce(SW, 'show run', fn)))
+    second.start()
+    while not sessions.coalesced:
+        time.sleep(0.001)
+    release.set()
+    first.join(5)
+    second.join(5)
+    assert len(calls) == 1
+    assert results == [{'output': 'ok'}, {'output': 'ok'}]
+
+
+def test_coalesce_is_per_user_and_not_cached_after_completion():
+    sessions = DeviceSessions()
+    calls = []
+    fn = lambda: calls.append(1) or len(calls)
+    assert sessions.coalesce(SW, 'show run', fn) == 1
+    assert sessions.coalesce(SW, 'show run', fn) == 2
+    assert sessions.coalesce(dict(SW, username='bob'), 'show run', fn) == 3
+    assert sessions.coalesced == 0
+
+
+def test_coalesce_propagates_errors_and_clears_inflight():
+    sessions = DeviceSessions()
+
+    def boom():
+        raise TimeoutError('read timed out')
+
+    with pytest.raises(TimeoutError):
+        sessions.coalesce(SW, 'show run', boom)
+    assert sessions._inflight == {}
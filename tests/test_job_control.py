@@ -0,0 +1,67 @@
+from concurrent.futures import Future
+
+import pytest
+
+from job_control import CANCELLED_OUTPUT, SHUTDOWN_OUTPUT, JobControl
+
+
+def running_future():
+    fut = Future()
+    assert fut.set_running_or_notify_cancel()
+    return fut
+
+
+def test_cancel_drops_queued_futures_only():
+    ctl = JobControl('job-1')
+    queued, started = Future(), running_future()
+    ctl.track([queued, started])
+    assert ctl.cancel() == 1
+    assert queued.cancelled() and not started.cancelled()
+    assert ctl.cancelled and ctl.reason == 'user'
+
+
+def test_first_reason_wins():
+    ctl = JobControl('job-1')
+    ctl.cancel('user')
+    ctl.cancel('shutdown')
+    assert ctl.reason == 'user'
+
+
+def test_futures_tracked_after_cancel_are_cancelled_too():
+    ctl = JobControl('job-1')
+    ctl.cancel()
+    late = Future()
+    ctl.track([late])
+    assert late.cancelled()
+
+
+def test_guard_skips_work_once_cancelled():
+    ctl = JobControl()
+    calls = []
+    assert ctl.guard(lambda x: calls.append(x) or {'status': 'Success'}, 1) == {'status': 'Success'}
+    ctl.cancel()
+    assert ctl.guard(calls.append, 2) == {'status': 'Cancelled', 'output': CANCELLED_OUTPUT}
+    assert calls == [1]
+
+
+def test_outcome_of_cancelled_and_finished_futures():
+    dropped = Future()
+    dropped.cancel()
+    assert JobControl.outcome(dropped) == {'status': 'Cancelled', 'output': CANCELLED_OUTPUT}
+    assert JobControl.outcome(dropped, SHUTDOWN_OUTPUT)['output'] == SHUTDOWN_OUTPUT
+
+    done = Future()
+    done.set_result({'status': 'Success'})
+    assert JobControl.outcome(done) == {'status': 'Success'}
+
+
+@pytest.mark.parametrize('reason, expected', [
+    (None,       'done'),
+    ('user',     'cancelled'),
+    ('shutdown', None),          # ไม่รายงาน — journal จะ resume เอง
+])
+def test_final_status(reason, expected):
+    ctl = JobControl('job-1')
+    if reason:
+        ctl.cancel(reason)
+    assert ctl.final_status() == expected
@@ -0,0 +1,48 @@
+import time
+
+from job_journal import JobJournal
+
+
+def test_resume_after_restart_returns_only_checkpointed_devices(tmp_path):
+    path = str(tmp_path / 'jobs.db')
+    journal = JobJournal(path)
+    assert journal.open('run-1', 'batch_backup', 'alice', 4) == set()
+    journal.mark('run-1', 'd1', 'Success')
+    journal.mark('run-1', 'd2', 'Failed')
+    journal.mark('run-1', 'd2', 'Success')          # retried device keeps one row
+
+    restarted = JobJournal(path)
+    [(job_id, task_type, total, done)] = restarted.unfinished('alice')
+    assert (job_id, task_type, total) == ('run-1', 'batch_backup', 4)
+    assert sorted(done) == ['d1', 'd2']
+    # server resends the run → re-opening must not reset the checkpoints
+    assert restarted.open('run-1', 'batch_backup', 'alice', 4) == {'d1', 'd2'}
+
+
+def test_finish_clears_the_job(tmp_path):
+    journal = JobJournal(str(tmp_path / 'jobs.db'))
+    journal.open('run-1', 'batch_backup', 'alice', 2)
+    journal.mark('run-1', 'd1', 'Success')
+    journal.finish('run-1')
+    assert journal.unfinished('alice') == []
+    assert journal.open('run-1', 'batch_backup', 'alice', 2) == set()
+
+
+def test_unfinished_is_per_owner(tmp_path):
+    journal = JobJournal(str(tmp_path / 'jobs.db'))
+    journal.open('run-a', 'batch_backup', 'alice', 1)
+    journal.open('run-b', 'batch_config', 'bob', 1)
+    assert [j[0] for j in journal.unfinished('alice')] == ['run-a']
+    assert [j[0] for j in journal.unfinished('bob')] == ['run-b']
+    assert journal.unfinished('carol') == []
+
+
+def test_prune_drops_jobs_past_max_age(tmp_path):
+    journal = JobJournal(str(tmp_path / 'jobs.db'), max_age=60)
+    journal.open('old', 'batch_backup', 'alice', 2)
+    journal.mark('old', 'd1', 'Success')
+    journal.prune(now=time.time() + 30)
+    assert [j[0] for j in journal.unfinished('alice')] == ['old']
+    journal.prune(now=time.time() + 120)
+    assert journal.unfinished('alice') == []
+    assert journal.open('old', 'batch_backup', 'alice', 2) == set()    # device rows went too
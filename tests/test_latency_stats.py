@@ -0,0 +1,66 @@
+import json
+
+import pytest
+
+from latency_stats import LatencyStats
+
+
+@pytest.fixture
+def stats(tmp_path):
+    return LatencyStats(str(tmp_path / 'latency.json'))
+
+
+def test_default_until_enough_samples(stats):
+    assert stats.timeout_for('10.0.0.1', 'show run', default=90) == 90
+    stats.record('10.0.0.1', 'show run', 2.0)
+    stats.record('10.0.0.1', 'show run', 2.0)
+    assert stats.percentile('10.0.0.1', 'show run') is None
+    stats.record('10.0.0.1', 'show run', 2.0)
+    assert stats.percentile('10.0.0.1', 'show run') == 2.0
+
+
+def test_timeout_is_p99_times_margin_clamped(stats):
+    for s in (1.0, 2.0, 4.0, 5.0):
+        stats.record('h', 'show version', s)
+    assert stats.timeout_for('h', 'show version', default=60) == 15.0             # 5.0 × 3
+    assert stats.timeout_for('h', 'show version', default=60, floor=20) == 20      # floor
+    assert stats.timeout_for('h', 'show version', default=12) == 12                # old fixed value = ceiling
+    assert stats.timeout_for('h', 'show version', default=60, ceiling=8) == 10     # floor wins over ceiling
+
+
+def test_slow_device_learns_upwards_to_the_default(stats):
+    for _ in range(5):
+        stats.record('slow', 'show run', 100.0)
+    assert stats.timeout_for('slow', 'show run', default=120) == 120
+
+
+def test_command_key_ignores_case_and_spacing(stats):
+    for _ in range(3):
+        stats.record('h', 'Show   Running-Config', 4.0)
+    assert stats.percentile('h', 'show running-config') == 4.0
+    assert stats.percentile('other', 'show running-config') is None
+
+
+def test_keeps_only_recent_samples(stats):
+    for _ in range(LatencyStats.MAX_SAMPLES):
+        stats.record('h', 'c', 50.0)
+    for _ in range(LatencyStats.MAX_SAMPLES):
+        stats.record('h', 'c', 1.0)
+    assert stats.percentile('h', 'c') == 1.0
+
+
+def test_save_and_reload(tmp_path):
+    path = str(tmp_path / 'latency.json')
+    stats = LatencyStats(path)
+    stats.save()
+    assert not (tmp_path / 'latency.json').exists()     # nothing recorded → nothing written
+    for s in (1.234, 2.0, 3.0):
+        stats.record('h', 'c', s)
+    stats.save()
+    assert json.loads((tmp_path / 'latency.json').read_text()) == {'h|c': [1.23, 2.0, 3.0]}
+    assert LatencyStats(path).percentile('h', 'c') == 3.0
+
+
+def test_corrupt_file_starts_empty(tmp_path):
+    (tmp_path / 'latency.json').write_text('{not json')
+    assert LatencyStats(str(tmp_path / 'latency.json')).percentile('h', 'c') is None
@@ -0,0 +1,78 @@
+import pytest
+
+from lldp_parser import SAMPLES, parse_lldp, parse_serial, lldp_format
+
+
+EXPECTED = {
+    'ruckus': {
+        'local_port': '1/1/24', 'neighbor': 'ICX7150-C12-Floor2', 'remote_port': '609c.9f1d.2a57',
+        'mgmt_ip': '10.10.2.12', 'port_desc': 'GigabitEthernet1/2/2', 'update_time': '105 seconds (TTL)',
+        'sys_desc': 'Ruckus Wireless, Inc. ICX7150-C12-POE', 'chassis_id': '609c.9f1d.2a40',
+    },
+    'ios': {
+        'local_port': 'Gi1/0/48', 'neighbor': 'ACC-SW-01', 'remote_port': 'Gi0/1',
+        'mgmt_ip': '10.20.0.11', 'port_desc': 'Uplink to core', 'update_time': '97 seconds (TTL)',
+        'sys_desc': 'Cisco IOS Software, C2960X Software', 'chassis_id': '0050.56bf.1a2b',
+    },
+    'aoscx': {
+        'local_port': '1/1/49', 'neighbor': 'CX6300-CORE', 'remote_port': '1/1/52',
+        'mgmt_ip': '10.30.0.1', 'port_desc': '1/1/52', 'update_time': '120 (TTL)',
+        'sys_desc': 'Aruba JL668A FL.10.10.1000', 'chassis_id': '88:3a:30:aa:bb:cc',
+    },
+    'procurve': {
+        'local_port': '25', 'neighbor': 'HP-2930F-01', 'remote_port': '49',
+        'mgmt_ip': '10.116.254.1', 'port_desc': '49', 'update_time': '',
+        'sys_desc': 'HP J9772A 2530-48G-PoEP Switch', 'chassis_id': '9c 8c d8 11 22 33',
+    },
+    'comware': {
+        'local_port': 'GigabitEthernet1/0/49', 'neighbor': 'H3C-ACC-01', 'remote_port': 'GigabitEthernet1/0/1',
+        'mgmt_ip': '10.40.0.21', 'port_desc': 'GigabitEthernet1/0/1 Interface',
+        'update_time': '0 days, 0 hours, 1 minutes, 30 seconds',
+        'sys_desc': 'H3C Comware Platform Software', 'chassis_id': '3c8c-4011-2233',
+    },
+}
+
+
+@pytest.mark.parametrize('fmt', sorted(SAMPLES))
+def test_fixture_parses_to_expected_neighbor(fmt):
+    assert [n.to_dict() for n in parse_lldp(SAMPLES[fmt], fmt)] == [EXPECTED[fmt]]
+
+
+@pytest.mark.parametrize('fmt', sorted(SAMPLES))
+def test_repeated_blocks_give_one_neighbor_each(fmt):
+    parsed = parse_lldp(SAMPLES[fmt] * 3, fmt)
+    assert [n.to_dict() for n in parsed] == [EXPECTED[fmt]] * 3
+
+
+def test_ios_description_on_next_line_does_not_swallow_following_field():
+    text = "Local Intf: Gi1/0/1\nSystem Description:\nSystem Name: SW-2\n"
+    [n] = parse_lldp(text, 'ios')
+    assert n.neighbor == 'SW-2'
+    assert n.sys_desc == ''
+
+
+def test_neighbor_without_name_falls_back_to_remote_port():
+    [n] = parse_lldp("Local Intf: Gi1/0/2\nPort id: Gi0/9\n", 'ios')
+    assert n.neighbor == 'Unknown-Gi0/9'
+
+
+def test_lines_before_first_header_are_ignored():
+    assert parse_lldp("System Name: stray\n", 'ios') == []
+
+
+@pytest.mark.parametrize('device_type, fmt', [
+    ('cisco_ios', 'ios'), ('aruba_aoscx', 'aoscx'), ('hp_procurve', 'procurve'),
+    ('hp_comware', 'comware'), ('ruckus_fastiron', 'ruckus'), ('juniper_junos', 'comware'),
+])
+def test_lldp_format_by_device_type(device_type, fmt):
+    assert lldp_format(device_type) == fmt
+
+
+@pytest.mark.parametrize('text, serial', [
+    ("System Serial Number : FOC1234X0AB", 'FOC1234X0AB'),
+    ("Serial  #:DUH3221T0BZ", 'DUH3221T0BZ'),
+    ("DEVICE_SERIAL_NUMBER : 210235A1ABC", '210235A1ABC'),
+    ("no serial here", ''),
+])
+def test_parse_serial(text, serial):
+    assert parse_serial(text) == serial
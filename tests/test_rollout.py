@@ -0,0 +1,72 @@
+import pytest
+
+from rollout import ROLLOUT_DEFAULTS, RolloutProgress, plan_waves, validate_rollout
+
+
+@pytest.mark.parametrize('total, kwargs, expected', [
+    (10, {},                                   [1, 2, 4, 3]),
+    (1,  {},                                   [1]),
+    (0,  {},                                   []),
+    (20, {'canary': 2, 'growth': 3},           [2, 6, 12]),
+    (12, {'growth': 1},                        [1, 2, 3, 4, 2]),     # growth ≤ 1 still grows by one
+    (9,  {'canary': 1, 'max_wave': 3},         [1, 2, 3, 3]),
+    (3,  {'canary': 0, 'max_wave': 0},         [1, 1, 1]),           # never a zero-size wave
+])
+def test_plan_waves(total, kwargs, expected):
+    waves = plan_waves(total, **kwargs)
+    assert waves == expected
+    assert sum(waves) == total
+
+
+def wave(no, success, failed, skipped=0):
+    return {'wave': no, 'success': success, 'failed': failed, 'skipped': skipped}
+
+
+def test_failure_rate_is_cumulative_and_aborts_with_devices_left():
+    progress = RolloutProgress(0.2)
+    first = wave(1, 1, 0)
+    assert progress.wave_done(first, remaining=9) is None
+    assert first['failure_rate'] == 0.0
+
+    second = wave(2, 1, 1)
+    reason = progress.wave_done(second, remaining=7)
+    assert second['failure_rate'] == pytest.approx(0.333)
+    assert reason == 'wave 2: failure rate 33% > 20%'
+
+
+def test_rate_equal_to_threshold_does_not_abort():
+    progress = RolloutProgress(0.5)
+    assert progress.wave_done(wave(1, 1, 1), remaining=4) is None
+
+
+def test_last_wave_never_aborts():
+    report = wave(3, 0, 4)
+    assert RolloutProgress(0.2).wave_done(report, remaining=0) is None
+    assert report['failure_rate'] == 1.0
+
+
+def test_prescan_skips_are_not_counted():
+    progress = RolloutProgress(0.2)
+    report = wave(1, 0, 0, skipped=5)
+    assert progress.wave_done(report, remaining=5) is None
+    assert report['failure_rate'] == 0.0
+    assert progress.attempted == 0
+
+
+def test_plain_batch_never_aborts():
+    report = wave(1, 0, 10)
+    assert RolloutProgress(None).wave_done(report, remaining=10) is None
+    assert report['failure_rate'] == 1.0
+
+
+def test_validate_rollout():
+    assert validate_rollout({}) is None
+    assert validate_rollout(dict(ROLLOUT_DEFAULTS)) is None
+    assert validate_rollout({'abort_threshold': 1, 'canary': 5, 'growth': 1.5}) is None
+    assert 'object' in validate_rollout([1])
+    assert 'abort_threshold' in validate_rollout({'abort_threshold': 1.5})
+    assert 'abort_threshold' in validate_rollout({'abort_threshold': '0.2'})
+    assert 'abort_threshold' in validate_rollout({'abort_threshold': True})
+    assert 'canary' in validate_rollout({'canary': 'two'})
+    assert 'max_wave' in validate_rollout({'max_wave': -1})
+    assert 'health_commands' in validate_rollout({'health_commands': 'show ver'})
@@ -0,0 +1,94 @@
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+import scheduler
+from scheduler import CronSpec, first_run, jittered, plan_due, retry_delay, stagger_order
+
+TZ = timezone(timedelta(hours=7))
+
+
+def at(*args):
+    return datetime(*args, tzinfo=TZ)
+
+
+@pytest.mark.parametrize('expr, now, expected', [
+    ('0 2 * * *',    at(2024, 1, 1, 1, 59), at(2024, 1, 1, 2, 0)),
+    ('0 2 * * *',    at(2024, 1, 1, 2, 0),  at(2024, 1, 2, 2, 0)),     # strictly after
+    ('*/15 * * * *', at(2024, 1, 1, 10, 7), at(2024, 1, 1, 10, 15)),
+    ('30 1 * * 0',   at(2024, 1, 1, 0, 0),  at(2024, 1, 7, 1, 30)),    # 2024-01-07 is a Sunday
+    ('30 1 * * 7',   at(2024, 1, 1, 0, 0),  at(2024, 1, 7, 1, 30)),    # 7 = Sunday too
+    ('0 0 1 * *',    at(2024, 1, 15, 0, 0), at(2024, 2, 1, 0, 0)),
+    ('0 0 29 2 *',   at(2024, 3, 1, 0, 0),  at(2028, 2, 29, 0, 0)),
+    ('0 0 1 * 1',    at(2024, 1, 2, 0, 0),  at(2024, 1, 8, 0, 0)),     # dom OR dow
+])
+def test_next_after(expr, now, expected):
+    nxt = CronSpec(expr).next_after(now)
+    assert nxt == expected
+    assert nxt.tzinfo is TZ
+
+
+@pytest.mark.parametrize('expr', ['', '* * * *', '61 * * * *', '* * * * 8', '*/0 * * * *', '5-1 * * * *'])
+def test_invalid_cron(expr):
+    with pytest.raises(ValueError):
+        CronSpec(expr)
+
+
+def test_dow_range_ending_in_7_includes_sunday():
+    assert CronSpec('0 0 * * 5-7').dows == {5, 6, 0}
+
+
+def test_cron_that_never_fires():
+    with pytest.raises(ValueError):
+        CronSpec('0 0 31 2 *').next_after(at(2024, 1, 1))
+
+
+def test_jitter_is_seeded_and_bounded():
+    slot = at(2024, 1, 1, 2, 0)
+    assert jittered(slot, 0, 'x') == slot
+    a, b = jittered(slot, 600, 'sched-1'), jittered(slot, 600, 'sched-1')
+    assert a == b
+    assert slot <= a <= slot + timedelta(seconds=600)
+
+
+def test_first_run_returns_slot_and_jittered_run():
+    slot, run = first_run('0 2 * * *', at(2024, 1, 1, 0, 0), jitter_seconds=300, seed='s')
+    assert slot == at(2024, 1, 1, 2, 0)
+    assert slot <= run <= slot + timedelta(seconds=300)
+
+
+def schedule(**kw):
+    base = {'_id': 's1', 'cron': '0 * * * *', 'next_slot': at(2024, 1, 1, 2, 0), 'next_run': at(2024, 1, 1, 2, 0),
+            'misfire_grace': 300}
+    base.update(kw)
+    return base
+
+
+def test_plan_due_on_time():
+    run, next_slot, _, missed = plan_due(schedule(), at(2024, 1, 1, 2, 1))
+    assert (run, next_slot, missed) == (True, at(2024, 1, 1, 3, 0), 0)
+
+
+def test_plan_due_late_catchup_once_runs_a_single_time():
+    run, next_slot, _, missed = plan_due(schedule(catchup='once'), at(2024, 1, 1, 5, 30))
+    assert (run, next_slot, missed) == (True, at(2024, 1, 1, 6, 0), 3)
+
+
+def test_plan_due_late_skip_does_not_run():
+    run, next_slot, _, missed = plan_due(schedule(catchup='skip'), at(2024, 1, 1, 5, 30))
+    assert (run, next_slot, missed) == (False, at(2024, 1, 1, 6, 0), 3)
+
+
+def test_retry_delay_is_equal_jitter_capped(monkeypatch):
+    monkeypatch.setattr(scheduler.random, 'uniform', lambda a, b: (a, b))
+    assert retry_delay(1) == (60, 120)
+    assert retry_delay(3) == (240, 480)
+    assert retry_delay(20) == (1800, 3600)
+
+
+def test_stagger_order_is_stable_and_complete():
+    devices = [{'_id': str(i)} for i in range(50)]
+    once = stagger_order(devices)
+    assert once == stagger_order(list(reversed(devices)))
+    assert sorted(d['_id'] for d in once) == sorted(d['_id'] for d in devices)
+    assert once != devices
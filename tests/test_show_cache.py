@@ -0,0 +1,88 @@
+import pytest
+
+import show_cache
+from show_cache import ShowCache
+
+SW = {'ip_address': '10.0.0.1', 'username': 'admin'}
+RESULT = {'status': 'Success', 'output': 'Vlan1 up'}
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(show_cache.time, 'monotonic', lambda: now[0])
+    return now
+
+
+@pytest.mark.parametrize('command, expected', [
+    ('show vlan brief', True),
+    ('display  interface brief', True),
+    ('show clock', False),
+    ('show logging', False),
+    ('show tech-support', False),
+    ('configure terminal', False),
+])
+def test_cacheable(command, expected):
+    assert ShowCache().cacheable(command) is expected
+
+
+def test_zero_ttl_disables_caching():
+    assert not ShowCache(ttl=0).cacheable('show vlan')
+
+
+def test_entry_expires_after_ttl(clock):
+    cache = ShowCache(ttl=15)
+    cache.put(SW, 'show vlan', RESULT, cache.generation(SW))
+    clock[0] += 10
+    hit = cache.get(SW, 'show  vlan')
+    assert hit == dict(RESULT, cached=True, cache_age=10.0)
+    clock[0] += 6
+    assert cache.get(SW, 'show vlan') is None
+    assert (cache.hits, cache.misses) == (1, 1)
+
+
+def test_max_age_only_shortens_the_ttl(clock):
+    cache = ShowCache(ttl=15)
+    cache.put(SW, 'show vlan', RESULT, 0)
+    clock[0] += 5
+    assert cache.get(SW, 'show vlan', max_age=2) is None
+    assert cache.get(SW, 'show vlan', max_age=60) is not None
+
+
+def test_entries_are_per_device_and_user(clock):
+    cache = ShowCache()
+    cache.put(SW, 'show vlan', RESULT, 0)
+    assert cache.get(dict(SW, username='bob'), 'show vlan') is None
+    assert cache.get(dict(SW, ip_address='10.0.0.2'), 'show vlan') is None
+    assert cache.get(dict(SW, port=22), 'show vlan') is not None
+
+
+def test_invalidate_drops_device_entries_only(clock):
+    cache = ShowCache()
+    other = dict(SW, ip_address='10.0.0.2')
+    cache.put(SW, 'show vlan', RESULT, 0)
+    cache.put(other, 'show vlan', RESULT, 0)
+    cache.invalidate(SW)
+    assert cache.get(SW, 'show vlan') is None
+    assert cache.get(other, 'show vlan') is not None
+
+
+def test_read_that_started_before_a_push_is_not_stored(clock):
+    cache = ShowCache()
+    generation = cache.generation(SW)
+    cache.invalidate(SW)                      # push finished while the show was running
+    cache.put(SW, 'show vlan', RESULT, generation)
+    assert cache.get(SW, 'show vlan') is None
+    cache.put(SW, 'show vlan', RESULT, cache.generation(SW))
+    assert cache.get(SW, 'show vlan') is not None
+
+
+def test_size_bound_evicts_least_recently_used(clock):
+    cache = ShowCache(size=2)
+    for cmd in ('show a', 'show b'):
+        cache.put(SW, cmd, RESULT, 0)
+    assert cache.get(SW, 'show a') is not None      # a is now most recent
+    cache.put(SW, 'show c', RESULT, 0)
+    assert cache.get(SW, 'show b') is None
+    assert cache.get(SW, 'show a') is not None
+    assert cache.get(SW, 'show c') is not None
@@ -0,0 +1,127 @@
+import pytest
+
+from state_parsers import (endpoint_entries, is_edge_candidate, normalize_mac, parse_backup_state, parse_section,
+                           port_key, state_family, uplink_ports)
+
+
+@pytest.mark.parametrize('raw', ['aabb.ccdd.eeff', 'aabb-ccdd-eeff', 'aabbcc-ddeeff', 'AA:BB:CC:DD:EE:FF', 'aa-bb-cc-dd-ee-ff'])
+def test_normalize_mac_accepts_every_vendor_notation(raw):
+    assert normalize_mac(raw) == 'aa:bb:cc:dd:ee:ff'
+
+
+@pytest.mark.parametrize('raw', ['', None, 'aabb.ccdd', 'not a mac'])
+def test_normalize_mac_rejects_non_macs(raw):
+    assert normalize_mac(raw) is None
+
+
+def test_ios_mac_table():
+    text = """
+          Mac Address Table
+-------------------------------------------
+Vlan    Mac Address       Type        Ports
+----    -----------       --------    -----
+  10    0050.56bf.1a2b    DYNAMIC     Gi1/0/5
+ All    0100.0ccc.cccc    STATIC      CPU
+"""
+    assert parse_section('mac', 'ios', text) == [
+        {'vlan': 10, 'mac': '00:50:56:bf:1a:2b', 'type': 'DYNAMIC', 'port': 'Gi1/0/5'},
+    ]
+
+
+def test_comware_mac_table():
+    text = "MAC Address    VLAN ID  State            Port/NickName\n3c8c-4011-2233  20       Learned          GE1/0/3\n"
+    assert parse_section('mac', 'comware', text) == [
+        {'mac': '3c:8c:40:11:22:33', 'vlan': 20, 'type': 'Learned', 'port': 'GE1/0/3'},
+    ]
+
+
+def test_procurve_mac_table():
+    text = "  MAC Address   Port  VLAN\n  9c8cd8-112233 25    1\n"
+    assert parse_section('mac', 'procurve', text) == [{'mac': '9c:8c:d8:11:22:33', 'port': '25', 'vlan': 1}]
+
+
+def test_ios_arp_table():
+    text = ("Protocol  Address          Age (min)  Hardware Addr   Type   Interface\n"
+            "Internet  10.1.1.20               3   0050.56bf.1a2b  ARPA   Vlan10\n")
+    assert parse_section('arp', 'ios', text) == [
+        {'ip': '10.1.1.20', 'age': '3', 'mac': '00:50:56:bf:1a:2b', 'interface': 'Vlan10'},
+    ]
+
+
+def test_ios_routes():
+    text = ("S*    0.0.0.0/0 [1/0] via 10.0.0.254\n"
+            "C        10.1.1.0/24 is directly connected, Vlan10\n"
+            "O     10.2.0.0/16 [110/20] via 10.0.0.2, 00:10:11, Vlan2\n")
+    rows = parse_section('routes', 'ios', text)
+    assert rows[0] == {'protocol': 'S*', 'prefix': '0.0.0.0/0', 'distance': 1, 'metric': 0, 'next_hop': '10.0.0.254'}
+    assert rows[1] == {'protocol': 'C', 'prefix': '10.1.1.0/24', 'interface': 'Vlan10'}
+    assert rows[2]['interface'] == 'Vlan2'
+    assert rows[2]['distance'] == 110
+
+
+def test_ios_interfaces():
+    text = ("Interface              IP-Address      OK? Method Status                Protocol\n"
+            "Vlan10                 10.1.1.1        YES NVRAM  up                    up\n"
+            "GigabitEthernet1/0/1   unassigned      YES unset  administratively down down\n")
+    assert parse_section('interfaces', 'ios', text) == [
+        {'interface': 'Vlan10', 'ip': '10.1.1.1', 'status': 'up', 'protocol': 'up'},
+        {'interface': 'GigabitEthernet1/0/1', 'ip': 'unassigned', 'status': 'administratively down',
+         'protocol': 'down'},
+    ]
+
+
+def test_unknown_table_or_family_gives_no_rows():
+    assert parse_section('mac', 'juniper', 'anything') == []
+    assert parse_section('nope', 'ios', 'anything') == []
+
+
+def test_parse_backup_state_uses_vendor_family():
+    sections = {
+        'MAC Address Table': ('display mac-address', '3c8c-4011-2233  20  Learned  GE1/0/3'),
+        'Running Configuration': ('display current-configuration', 'sysname X'),
+    }
+    assert state_family('hp_comware') == 'comware'
+    assert parse_backup_state(sections, 'hp_comware') == {
+        'mac': [{'mac': '3c:8c:40:11:22:33', 'vlan': 20, 'type': 'Learned', 'port': 'GE1/0/3'}],
+    }
+
+
+def test_port_key_matches_long_and_short_names():
+    assert port_key('GigabitEthernet1/0/49') == port_key('Gi1/0/49') == 'g1/0/49'
+    assert port_key('25') == '25'
+    assert port_key('CPU') == 'cpu'
+
+
+@pytest.mark.parametrize('port, edge', [
+    ('Gi1/0/5', True), ('25', True), ('Po1', False), ('Bridge-Aggregation2', False),
+    ('Trk1', False), ('CPU', False), ('Vlan10', False), ('', False),
+])
+def test_is_edge_candidate(port, edge):
+    assert is_edge_candidate(port) is edge
+
+
+def mac(n, port, vlan=10):
+    return {'mac': f'00:00:00:00:00:{n:02x}', 'vlan': vlan, 'type': 'DYNAMIC', 'port': port}
+
+
+def test_uplink_ports_from_lldp_and_mac_count():
+    rows = [mac(i, 'Gi1/0/48') for i in range(5)] + [mac(9, 'Gi1/0/5')]
+    assert uplink_ports(['GigabitEthernet1/0/1'], rows, threshold=4) == {'g1/0/1', 'g1/0/48'}
+    assert uplink_ports([], rows, threshold=5) == set()
+
+
+def test_endpoint_entries_keep_only_edge_ports():
+    parsed = {
+        'mac': [mac(1, 'Gi1/0/5'), mac(2, 'Gi1/0/1'), mac(3, 'Po1'), mac(4, 'CPU', vlan=None)]
+               + [mac(10 + i, 'Gi1/0/48') for i in range(3)],
+        'arp': [{'ip': '10.0.10.5', 'mac': '00:00:00:00:00:01', 'interface': 'Vlan10'},
+                {'ip': '10.0.10.6', 'mac': None, 'interface': 'Vlan10'}],
+    }
+    locations, ips = endpoint_entries(parsed, lldp_ports=['GigabitEthernet1/0/1'], threshold=2)
+    assert locations == {'00:00:00:00:00:01': {'port': 'Gi1/0/5', 'vlan': 10}}
+    assert ips == {'10.0.10.5': {'mac': '00:00:00:00:00:01', 'interface': 'Vlan10'}}
+
+
+def test_endpoint_entries_missing_tables_leave_index_alone():
+    assert endpoint_entries({}) == (None, None)
+    assert endpoint_entries({'mac': [], 'arp': []}) == ({}, {})
@@ -0,0 +1,90 @@
+from topology_crawl import CrawlFrontier, in_crawl_scope
+
+
+def link(ip, name, chassis=None, sys_desc='Cisco IOS Software'):
+    return {'mgmt_ip': ip, 'neighbor': name, 'chassis_id': chassis or f"cc:{ip}", 'sys_desc': sys_desc}
+
+
+# ip → (serial, neighbors)
+NETWORK = {
+    '10.0.0.1': ('SN-CORE', [link('10.0.1.1', 'DIST-1'), link('10.0.1.2', 'DIST-2')]),
+    '10.0.1.1': ('SN-D1', [link('10.0.0.1', 'CORE'), link('10.0.2.1', 'ACC-1', sys_desc='H3C Comware'),
+                           link('10.0.1.2', 'DIST-2')]),
+    '10.0.1.2': ('SN-D2', [link('10.0.0.1', 'CORE'), link('10.0.2.2', 'ACC-2'),
+                           link('10.0.2.9', 'ACC-1-SVI', chassis='cc:10.0.2.1')]),   # same box as ACC-1
+    '10.0.2.1': ('SN-A1', [link('192.168.50.1', 'OUTSIDE')]),
+    '10.0.2.2': ('SN-D1', []),                                                     # another IP of DIST-1
+}
+
+
+def scan(d):
+    if d['ip_address'] not in NETWORK:
+        return {'hostname': d['hostname'], 'sn': '', 'neighbors': [], 'status': 'Failed', 'error': 'timeout'}
+    sn, neighbors = NETWORK[d['ip_address']]
+    return {'hostname': d['hostname'], 'sn': sn, 'neighbors': neighbors, 'status': 'Success'}
+
+
+def crawl(**kw):
+    seed = {'ip_address': '10.0.0.1', 'hostname': 'CORE', 'device_type': 'cisco_ios',
+            'username': 'u', 'password': 'p', 'credential_id': 'cs_1'}
+    c = CrawlFrontier([seed], **kw)
+    levels = []
+    while True:
+        level = c.next_level()
+        if not level:
+            return c, levels
+        levels.append([d['ip_address'] for d in level])
+        for d in level:
+            c.record(d, scan(d))
+
+
+def test_breadth_first_with_dedup_by_ip_chassis_and_serial():
+    c, levels = crawl(scope=['10.0.0.0/16'])
+    assert levels == [['10.0.0.1'], ['10.0.1.1', '10.0.1.2'], ['10.0.2.1', '10.0.2.2']]
+    by_ip = {e['ip']: e for e in c.inventory}
+    assert by_ip['10.0.2.2']['status'] == 'Duplicate'              # serial SN-D1 already seen
+    assert '10.0.2.9' not in by_ip                                  # chassis of ACC-1 already queued
+    assert '192.168.50.1' not in by_ip                              # out of scope
+    assert by_ip['10.0.2.1']['parent'] == 'DIST-1' and by_ip['10.0.2.1']['depth'] == 2
+    assert by_ip['10.0.2.1']['device_type'] == 'hp_comware'         # guessed from LLDP sys_desc
+    assert [r['sn'] for r in c.results] == ['SN-CORE', 'SN-D1', 'SN-D2', 'SN-A1']
+    assert not c.truncated
+
+
+def test_neighbors_inherit_the_parent_login():
+    c = CrawlFrontier([{'ip_address': '10.0.0.1', 'hostname': 'CORE', 'device_type': 'cisco_ios',
+                        'username': 'u', 'password': 'p', 'credential_id': 'cs_1', 'vars': {'x': 1}}])
+    seed = c.next_level()[0]
+    c.record(seed, scan(seed))
+    child = c.pending[0]
+    assert {k: child[k] for k in ('username', 'password', 'credential_id')} == \
+        {'username': 'u', 'password': 'p', 'credential_id': 'cs_1'}
+    assert 'vars' not in child
+
+
+def test_max_depth_stops_expansion():
+    c, levels = crawl(max_depth=1)
+    assert levels == [['10.0.0.1'], ['10.0.1.1', '10.0.1.2']]
+    assert not c.truncated
+
+
+def test_max_devices_trims_level_and_reports_truncation():
+    c, levels = crawl(max_devices=2)
+    assert levels == [['10.0.0.1'], ['10.0.1.1']]
+    assert len(c.inventory) == 2
+    assert c.truncated and c.skipped == 2          # DIST-2 trimmed, ACC-1 (found by DIST-1) never scanned
+
+
+def test_failed_device_is_listed_but_not_expanded():
+    c = CrawlFrontier([{'ip_address': '10.9.9.9', 'hostname': 'GONE'}])
+    d = c.next_level()[0]
+    entry = c.record(d, scan(d))
+    assert entry['status'] == 'Failed' and entry['error'] == 'timeout'
+    assert c.next_level() == []
+
+
+def test_in_crawl_scope():
+    assert in_crawl_scope('10.1.2.3', [])
+    assert in_crawl_scope('10.1.2.3', ['bogus', '10.0.0.0/8'])
+    assert not in_crawl_scope('172.16.0.1', ['10.0.0.0/8'])
+    assert not in_crawl_scope('not-an-ip', [])
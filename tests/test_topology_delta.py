@@ -0,0 +1,91 @@
+import time
+
+from topology_delta import TopologyCache, link_changes, neighbor_key, neighbors_fingerprint, topology_delta
+
+
+def nbr(port, neighbor, remote, update_time='00:01:00'):
+    return {'local_port': port, 'neighbor': neighbor, 'remote_port': remote, 'mgmt_ip': '',
+            'port_desc': '', 'sys_desc': '', 'update_time': update_time}
+
+
+TABLE = [nbr('Gi1/0/1', 'DIST-1', 'Gi0/1'), nbr('Gi1/0/2', 'DIST-2', 'Gi0/1'), nbr('Gi1/0/3', 'AP-1', 'eth0')]
+
+
+def test_key_ignores_update_time_and_server_key():
+    a = nbr('Gi1/0/1', 'DIST-1', 'Gi0/1', update_time='00:01:00')
+    b = dict(nbr('Gi1/0/1', 'DIST-1', 'Gi0/1', update_time='00:09:30'), key='whatever')
+    assert neighbor_key(a) == neighbor_key(b)
+    assert neighbor_key(a) != neighbor_key(nbr('Gi1/0/1', 'DIST-1', 'Gi0/2'))
+
+
+def test_fingerprint_is_order_independent():
+    assert neighbors_fingerprint(TABLE) == neighbors_fingerprint(list(reversed(TABLE)))
+    assert neighbors_fingerprint(TABLE) != neighbors_fingerprint(TABLE[:2])
+
+
+def apply(stored: dict, fingerprint, r):
+    """In-memory version of app.apply_topology_result → (links, fingerprint)."""
+    changes = link_changes(fingerprint, r)
+    if changes is None:
+        return stored, None
+    replace_all, upserts, removed = changes
+    links = {} if replace_all else {k: v for k, v in stored.items() if k not in removed}
+    links.update({n['key']: n for n in upserts})
+    return links, r['fingerprint']
+
+
+def test_first_scan_is_full_then_unchanged_scan_is_empty_delta(tmp_path):
+    cache = TopologyCache(str(tmp_path / 'topo.json'))
+    r = topology_delta(cache, '10.0.0.1', TABLE, None)
+    assert r['mode'] == 'full' and r['neighbors'] == TABLE
+    links, fp = apply({}, None, r)
+    assert len(links) == 3 and fp == neighbors_fingerprint(TABLE)
+
+    aged = [dict(n, update_time='00:05:00') for n in TABLE]
+    r = topology_delta(cache, '10.0.0.1', aged, fp)
+    assert r['mode'] == 'delta'
+    assert (r['added'], r['removed'], r['neighbor_count']) == ([], [], 3)
+
+
+def test_delta_round_trip(tmp_path):
+    cache = TopologyCache(str(tmp_path / 'topo.json'))
+    links, fp = apply({}, None, topology_delta(cache, '10.0.0.1', TABLE, None))
+
+    moved = [TABLE[0], nbr('Gi1/0/2', 'DIST-3', 'Gi0/1'), TABLE[2], nbr('Gi1/0/4', 'AP-2', 'eth0')]
+    r = topology_delta(cache, '10.0.0.1', moved, fp)
+    assert r['mode'] == 'delta'
+    assert [n['neighbor'] for n in r['added']] == ['DIST-3', 'AP-2']
+    assert r['removed'] == [neighbor_key(TABLE[1])]
+
+    links, fp = apply(links, fp, r)
+    assert set(links) == {neighbor_key(n) for n in moved}
+    assert fp == neighbors_fingerprint(moved)
+
+
+def test_stale_base_asks_for_full_table(tmp_path):
+    cache = TopologyCache(str(tmp_path / 'topo.json'))
+    r = topology_delta(cache, '10.0.0.1', TABLE, None)
+    # server lost / cleared its fingerprint but the agent was told a different one
+    r = topology_delta(cache, '10.0.0.1', TABLE[:2], r['fingerprint'])
+    assert r['mode'] == 'delta'
+    assert link_changes('some-other-fingerprint', r) is None
+    # agent cache does not match what the server holds → full table
+    r = topology_delta(cache, '10.0.0.1', TABLE, 'server-has-something-else')
+    assert r['mode'] == 'full'
+
+
+def test_full_table_drops_duplicate_rows():
+    replace_all, upserts, removed = link_changes(None, {'mode': 'full', 'neighbors': [TABLE[0], dict(TABLE[0])]})
+    assert replace_all is True and removed == [] and len(upserts) == 1
+
+
+def test_cache_serial_ttl_and_persistence(tmp_path):
+    path = str(tmp_path / 'topo.json')
+    cache = TopologyCache(path)
+    cache.update('10.0.0.1', sn='FOC123', sn_at=time.time())
+    cache.update('10.0.0.2', sn='FOC456', sn_at=time.time() - 8 * 24 * 3600)
+    cache.save()
+    reloaded = TopologyCache(path)
+    assert reloaded.fresh_serial('10.0.0.1') == 'FOC123'
+    assert reloaded.fresh_serial('10.0.0.2') == ''
+    assert reloaded.fresh_serial('10.0.0.3') == ''
@@ -0,0 +1,84 @@
+from topology_graph import TopologyGraph
+
+
+def link(dev, lp, neighbor, rp, mgmt=''):
+    return {'device_ip': dev, 'local_port': lp, 'neighbor': neighbor, 'remote_port': rp, 'mgmt_ip': mgmt}
+
+
+#   core ── dist1 ── acc1
+#     └──── dist2 ── acc2 ── phone (not in inventory, no mgmt IP)
+NODES = [
+    {'ip': '10.0.0.1', 'hostname': 'CORE'},
+    {'ip': '10.0.0.2', 'hostname': 'DIST1'},
+    {'ip': '10.0.0.3', 'hostname': 'DIST2'},
+    {'ip': '10.0.0.4', 'hostname': 'ACC1'},
+    {'ip': '10.0.0.5', 'hostname': 'ACC2'},
+]
+LINKS = [
+    link('10.0.0.1', 'Gi1/0/1', 'DIST1', 'Gi0/1', '10.0.0.2'),
+    link('10.0.0.2', 'Gi0/1', 'CORE', 'Gi1/0/1', '10.0.0.1'),      # same link seen from the other side
+    link('10.0.0.1', 'Gi1/0/2', 'DIST2', 'Gi0/1', '10.0.0.3'),
+    link('10.0.0.2', 'Gi0/2', 'ACC1', 'Gi0/48', '10.0.0.4'),
+    link('10.0.0.3', 'Gi0/2', 'acc2', 'Gi0/48'),                    # resolved by name (case-insensitive)
+    link('10.0.0.5', 'Gi0/5', 'PHONE-1', 'eth0'),
+]
+
+
+def graph():
+    return TopologyGraph.from_links(NODES, LINKS)
+
+
+def test_links_are_deduplicated_and_names_resolved():
+    g = graph()
+    assert g.link_count == 5
+    assert set(g.adj['10.0.0.3']) == {'10.0.0.1', '10.0.0.5'}
+    assert 'name:PHONE-1' in g.adj
+    assert g.resolve('dist2') == '10.0.0.3'
+    assert g.resolve('nope') is None
+
+
+def test_shortest_path_reports_ports():
+    hops = graph().shortest_path('10.0.0.4', '10.0.0.5')
+    assert [h['hostname'] for h in hops] == ['ACC1', 'DIST1', 'CORE', 'DIST2', 'ACC2']
+    assert hops[0]['egress_port'] == 'Gi0/48'
+    assert hops[0]['next_ingress_port'] == 'Gi0/2'
+    assert 'egress_port' not in hops[-1]
+
+
+def test_shortest_path_unknown_or_disconnected():
+    g = graph()
+    assert g.shortest_path('10.0.0.1', '10.9.9.9') is None
+    g._add_node('10.0.0.9', 'LONELY')
+    assert g.shortest_path('10.0.0.1', '10.0.0.9') is None
+
+
+def test_blast_radius_of_device_and_port():
+    g = graph()
+    down = g.blast_radius('10.0.0.3', root='10.0.0.1')
+    assert down['root'] == '10.0.0.1'
+    assert [a['node'] for a in down['affected']] == ['10.0.0.5', 'name:PHONE-1']
+    port = g.blast_radius('10.0.0.1', port='Gi1/0/1', root='10.0.0.1')
+    assert [a['node'] for a in port['affected']] == ['10.0.0.2', '10.0.0.4']
+    assert g.blast_radius('10.9.9.9') is None
+
+
+def test_default_root_is_highest_degree_node():
+    g = graph()
+    g.adj['10.0.0.1']['10.0.0.4'] = [('Gi1/0/3', 'Gi0/47')]
+    g.adj['10.0.0.4']['10.0.0.1'] = [('Gi0/47', 'Gi1/0/3')]
+    assert g.default_root() == '10.0.0.1'
+    assert g.default_root(exclude='10.0.0.1') != '10.0.0.1'
+
+
+def test_orphans():
+    g = graph()
+    g._add_node('10.0.0.9', 'LONELY')
+    out = g.orphans([n['ip'] for n in NODES] + ['10.0.0.9'])
+    assert [o['node'] for o in out['isolated']] == ['10.0.0.9']
+    assert [o['node'] for o in out['unmanaged']] == ['name:PHONE-1']
+
+
+def test_to_dict_lists_each_edge_once():
+    d = graph().to_dict()
+    assert len(d['edges']) == 5
+    assert {n['id']: n['degree'] for n in d['nodes']}['10.0.0.1'] == 2
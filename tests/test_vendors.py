@@ -0,0 +1,78 @@
+import pytest
+
+import vendors
+from vendors import VENDORS, VendorProfile, guess_device_type, register, resolve_vendor
+
+
+@pytest.mark.parametrize('device_type, name', [
+    ('cisco_ios', 'cisco_ios'),
+    ('cisco_xe', 'cisco_ios'),
+    ('cisco_nxos', 'cisco_nxos'),
+    ('aruba_os', 'aruba'),
+    ('aruba_aoscx', 'aruba_aoscx'),
+    ('aruba_osswitch', 'hp_procurve'),
+    ('hp_procurve', 'hp_procurve'),
+    ('hp_comware', 'hp_comware'),
+    ('huawei_vrpv8', 'huawei'),
+    ('ruckus_fastiron', 'ruckus_fastiron'),
+    ('juniper_junos', 'juniper'),
+    ('fortinet', 'fortinet'),
+    ('HP_Comware', 'hp_comware'),
+    ('linux', 'default'),
+    ('', 'default'),
+    (None, 'default'),
+])
+def test_resolve_vendor_longest_match(device_type, name):
+    assert resolve_vendor(device_type).name == name
+
+
+def test_syntax_properties():
+    assert resolve_vendor('huawei').negate == 'undo '
+    assert resolve_vendor('huawei').exit_command == 'quit'
+    assert resolve_vendor('cisco_ios').negate == 'no '
+    assert resolve_vendor('cisco_ios').exit_command == 'exit'
+    assert resolve_vendor('fortinet').pipelining is False
+    assert resolve_vendor('cisco_ios').pipelining is True
+
+
+@pytest.mark.parametrize('device_type, prompt, hostname', [
+    ('cisco_ios', 'CORE-SW1#', 'CORE-SW1'),
+    ('cisco_ios', 'CORE-SW1(config)#', 'CORE-SW1(config)'),
+    ('hp_comware', '<H3C-01>', 'H3C-01'),
+    ('huawei', '[HW-AGG]', 'HW-AGG'),
+    ('juniper_junos', 'admin@mx-edge>', 'mx-edge'),
+    ('ruckus_fastiron', 'SSH@ICX7150#', 'ICX7150'),
+    ('fortinet', 'FGT-60F (global) #', 'FGT-60F'),
+    ('cisco_ios', 'garbage', 'garbage'),
+])
+def test_hostname_from_prompt(device_type, prompt, hostname):
+    assert resolve_vendor(device_type).hostname_from_prompt(prompt) == hostname
+
+
+@pytest.mark.parametrize('sys_desc, expected', [
+    ('Cisco IOS Software, C2960X Software', 'cisco_ios'),
+    ('Cisco Nexus Operating System (NX-OS) Software', 'cisco_nxos'),
+    ('H3C Comware Platform Software', 'hp_comware'),
+    ('Huawei Versatile Routing Platform Software VRP (R) software', 'huawei'),
+    ('Juniper Networks, Inc. ex2300 , version 21.4R3 JUNOS', 'juniper_junos'),
+    ('ArubaOS-CX Version FL.10.08', 'aruba_aoscx'),
+    ('Ruckus ICX7150-48P', 'ruckus_fastiron'),
+    ('Linux 5.10', 'autodetect'),
+    ('', 'autodetect'),
+])
+def test_guess_device_type(sys_desc, expected):
+    assert guess_device_type(sys_desc, 'autodetect') == expected
+
+
+def test_register_plugs_in_new_vendor():
+    saved_vendors, saved_order = dict(VENDORS), list(vendors._ORDER)
+    try:
+        assert resolve_vendor('mikrotik_routeros').name == 'default'   # cached miss
+        register(VendorProfile(name='mikrotik', match=('mikrotik',), syntax='routeros',
+                               running_config='export', backup_commands=(('Configuration', 'export'),)))
+        assert resolve_vendor('mikrotik_routeros').name == 'mikrotik'  # cache was cleared
+    finally:
+        VENDORS.clear()
+        VENDORS.update(saved_vendors)
+        vendors._ORDER[:] = saved_order
+        resolve_vendor.cache_clear()
@@ -0,0 +1,57 @@
+import pytest
+
+import wire
+
+
+def big_payload():
+    return {'type': 'batch_backup', 'devices': [{'ip_address': f'10.0.{i // 256}.{i % 256}', 'hostname': f'SW-{i}'}
+                                                for i in range(2000)]}
+
+
+def test_small_payload_is_sent_as_plain_json():
+    payload = {'type': 'run_command', 'command': 'show ver'}
+    assert wire.pack(payload, 'zlib') is payload
+    assert wire.unpack(payload) is payload
+
+
+def test_no_codec_never_compresses():
+    payload = big_payload()
+    assert wire.pack(payload, None) is payload
+
+
+def test_zlib_round_trip_shrinks_large_payload():
+    payload = big_payload()
+    packed = wire.pack(payload, 'zlib')
+    assert packed[wire.ENVELOPE_KEY] == 'zlib'
+    assert len(packed['data']) < packed['size']
+    assert wire.unpack(packed) == payload
+
+
+@pytest.mark.skipif(not wire.HAS_ZSTD, reason='zstandard not installed')
+def test_zstd_round_trip():
+    payload = big_payload()
+    assert wire.unpack(wire.pack(payload, 'zstd')) == payload
+
+
+def test_unknown_codec_is_rejected():
+    with pytest.raises(ValueError):
+        wire.unpack({wire.ENVELOPE_KEY: 'lzma', 'size': 1, 'data': b'x'})
+
+
+def test_negotiate_picks_shared_codec():
+    assert wire.negotiate(['zlib']) == 'zlib'
+    assert wire.negotiate(['brotli']) is None
+    assert wire.negotiate(None) is None
+    assert wire.negotiate(wire.supported_codecs()) == wire.supported_codecs()[0]
+
+
+def test_stats_count_raw_and_wire_bytes():
+    stats = wire.WireStats()
+    packed = wire.pack(big_payload(), 'zlib', stats=stats, direction='down')
+    wire.pack({'a': 1}, 'zlib', stats=stats, direction='down')
+    snap = stats.snapshot()['down']
+    assert snap['messages'] == 2
+    assert snap['compressed_messages'] == 1
+    assert snap['wire_bytes'] < snap['raw_bytes']
+    assert snap['ratio'] < 1
+    assert len(packed['data']) <= snap['wire_bytes']
@@ -0,0 +1,102 @@
+import ipaddress
+
+from vendors import guess_device_type
+
+
+# ────────────────────────────────────────────────
+#   Topology crawl (discover devices ตาม LLDP neighbor)
+#   CrawlFrontier ถือ state ของ BFS: dedup ด้วย IP / chassis id / serial, จำกัด depth / จำนวนเครื่อง
+#   agent เป็นคน scan แต่ละ level (prescan + task_topology) แล้วส่งผลกลับมาที่ record()
+# ────────────────────────────────────────────────
+
+CRAWL_MAX_DEPTH   = 3
+CRAWL_MAX_DEVICES = 500
+CREDENTIAL_FIELDS = ('username', 'password', 'secret', 'port', 'credential_id')   # neighbor ใช้ login เดียวกับ parent
+
+
+def in_crawl_scope(ip: str, scope) -> bool:
+    """scope = list of CIDR strings; empty = no restriction."""
+    try:
+        addr = ipaddress.ip_address(ip)
+    except ValueError:
+        return False
+    if not scope:
+        return True
+    for net in scope:
+        try:
+            if addr in ipaddress.ip_network(net, strict=False):
+                return True
+        except ValueError:
+            continue
+    return False
+
+
+class CrawlFrontier:
+    """
+    Breadth-first crawl state: next_level() hands out the devices to scan,
+    record() takes each scan result and queues the neighbors worth following.
+    """
+
+    def __init__(self, seeds, max_depth: int = CRAWL_MAX_DEPTH, max_devices: int = CRAWL_MAX_DEVICES, scope=None):
+        self.max_depth    = max_depth
+        self.max_devices  = max_devices
+        self.scope        = scope or []
+        self.visited_ips  = {d.get('ip_address') for d in seeds}
+        self.seen_chassis = set()
+        self.seen_serials = set()
+        self.inventory    = []      # ทุกเครื่องที่ scan แล้ว (รวม Failed / Duplicate)
+        self.results      = []      # ผล task_topology ของเครื่องที่ไม่ซ้ำ
+        self.pending      = [dict(d, _depth=0, _parent=None) for d in seeds]
+        self.skipped      = 0       # เจอแล้วแต่ไม่ได้ scan เพราะเกิน max_devices
+
+    def next_level(self) -> list:
+        """Queued devices as the next level, trimmed to what is left of max_devices ([] = done)."""
+        level, self.pending = self.pending, []
+        budget = max(0, self.max_devices - len(self.inventory))
+        self.skipped += max(0, len(level) - budget)
+        return level[:budget]
+
+    @property
+    def truncated(self) -> bool:
+        return bool(self.skipped or self.pending)
+
+    def record(self, d: dict, r: dict) -> dict:
+        """Inventory entry for one scanned device; queues its LLDP neighbors for the next level."""
+        entry = {
+            'ip': d.get('ip_address'), 'hostname': r.get('hostname') or d.get('hostname'),
+            'device_type': d.get('device_type'), 'sn': r.get('sn', ''),
+            'depth': d['_depth'], 'parent': d['_parent'],
+            'status': r['status'], 'error': r.get('error', ''),
+            'neighbor_count': len(r.get('neighbors', [])),
+        }
+        if r.get('sn') and r['sn'] in self.seen_serials:
+            # IP อื่นของเครื่องเดิม (เช่น SVI หลายตัว) ไม่ต้องขยายต่อ
+            entry['status'] = 'Duplicate'
+            self.inventory.append(entry)
+            return entry
+        if r.get('sn'):
+            self.seen_serials.add(r['sn'])
+        self.inventory.append(entry)
+        self.results.append(r)
+
+        if r['status'] == 'Success' and d['_depth'] < self.max_depth:
+            for n in r.get('neighbors', []):
+                ip = n.get('mgmt_ip')
+                chassis = n.get('chassis_id')
+                if not ip or ip in self.visited_ips or not in_crawl_scope(ip, self.scope):
+                    continue
+                if chassis and chassis in self.seen_chassis:
+                    continue
+                self.visited_ips.add(ip)
+                if chassis:
+                    self.seen_chassis.add(chassis)
+                new_dev = {k: d[k] for k in CREDENTIAL_FIELDS if k in d}
+                new_dev.update({
+                    'ip_address': ip,
+                    'hostname': n.get('neighbor') or ip,
+                    'device_type': guess_device_type(n.get('sys_desc'), d.get('device_type', 'cisco_ios')),
+                    '_depth': d['_depth'] + 1,
+                    '_parent': r.get('hostname') or d.get('ip_address'),
+                })
+                self.pending.append(new_dev)
+        return entry
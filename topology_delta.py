@@ -0,0 +1,112 @@
+import hashlib
+import json
+import os
+import threading
+import time
+from typing import Optional
+
+
+# ────────────────────────────────────────────────
+#   Incremental topology scan (agent ↔ server)
+#   agent จำตาราง LLDP ล่าสุดที่ส่งไปต่อ device + fingerprint:
+#     - server ถือ fingerprint เดียวกับ cache → ส่งแค่ adjacency ที่เพิ่ม / key ที่หาย
+#     - ไม่ตรง → ส่งตารางเต็ม
+#   server ใช้ link_changes() ตัดสินว่าจะ apply ยังไง (topology_links ใน Mongo)
+# ────────────────────────────────────────────────
+
+SERIAL_TTL        = 7 * 24 * 3600     # S/N แทบไม่เปลี่ยน ดึงใหม่สัปดาห์ละครั้งพอ
+NEIGHBOR_VOLATILE = ('update_time', 'key')   # field ที่เปลี่ยนทุกรอบ / server เติมเอง ไม่นับเป็น change
+
+
+def neighbor_key(n: dict) -> str:
+    """Stable identity of one adjacency (ignores TTL / update time)."""
+    stable = {k: v for k, v in n.items() if k not in NEIGHBOR_VOLATILE}
+    return hashlib.sha1(json.dumps(stable, sort_keys=True).encode('utf-8')).hexdigest()[:16]
+
+
+def neighbors_fingerprint(neighbors: list) -> str:
+    return hashlib.sha1('|'.join(sorted(neighbor_key(n) for n in neighbors)).encode('utf-8')).hexdigest()
+
+
+class TopologyCache:
+    """Per-device serial number and last reported LLDP table, persisted between runs."""
+
+    def __init__(self, path: str):
+        self.path  = path
+        self._lock = threading.Lock()
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                self._data = json.load(f)
+        except Exception:
+            self._data = {}
+
+    def get(self, ip: str) -> dict:
+        with self._lock:
+            return dict(self._data.get(ip, {}))
+
+    def fresh_serial(self, ip: str) -> str:
+        entry = self.get(ip)
+        if entry.get('sn') and time.time() - entry.get('sn_at', 0) < SERIAL_TTL:
+            return entry['sn']
+        return ''
+
+    def update(self, ip: str, **fields):
+        with self._lock:
+            self._data.setdefault(ip, {}).update(fields)
+
+    def save(self):
+        with self._lock:
+            snapshot = dict(self._data)
+        try:
+            tmp = self.path + '.tmp'
+            with open(tmp, 'w', encoding='utf-8') as f:
+                json.dump(snapshot, f)
+            os.replace(tmp, self.path)
+        except Exception as e:
+            print(f"Error saving topology cache: {e}")
+
+
+def topology_delta(cache: TopologyCache, ip: str, neighbors: list, known_fingerprint: Optional[str]) -> dict:
+    """
+    Compare a fresh LLDP table with what the server already has.
+    Sends only added/removed adjacencies when the server holds the same base as our cache,
+    otherwise falls back to the full table.
+    """
+    fp = neighbors_fingerprint(neighbors)
+    cached = cache.get(ip)
+    cache.update(ip, fingerprint=fp, neighbors=neighbors)
+
+    if not known_fingerprint or cached.get('fingerprint') != known_fingerprint:
+        return {'mode': 'full', 'fingerprint': fp, 'neighbors': neighbors}
+
+    old = {neighbor_key(n): n for n in cached.get('neighbors', [])}
+    new = {neighbor_key(n): n for n in neighbors}
+    return {
+        'mode': 'delta',
+        'base_fingerprint': known_fingerprint,
+        'fingerprint': fp,
+        'added':   [n for k, n in new.items() if k not in old],
+        'removed': [k for k in old if k not in new],
+        'neighbors': [],
+        'neighbor_count': len(neighbors),
+    }
+
+
+def link_changes(stored_fingerprint: Optional[str], r: dict):
+    """
+    Server side: how to apply one scan result to the stored links of that device.
+    Returns (replace_all, upserts, removed_keys) with a 'key' set on every upserted neighbor,
+    or None when a delta was computed against a base the server does not hold (→ ask for full).
+    """
+    if r.get('mode') == 'delta':
+        if stored_fingerprint != r.get('base_fingerprint'):
+            return None
+        added = r.get('added', [])
+        for n in added:
+            n['key'] = neighbor_key(n)
+        return False, added, list(r.get('removed') or [])
+    unique = {}
+    for n in r.get('neighbors', []):
+        n['key'] = neighbor_key(n)
+        unique[n['key']] = n
+    return True, list(unique.values()), []
@@ -0,0 +1,177 @@
+from collections import defaultdict, deque
+
+
+# ────────────────────────────────────────────────
+#   Topology graph (in-memory, สร้างจาก topology_links)
+#   node id = IP ของอุปกรณ์ ถ้าไม่รู้ IP ใช้ "name:<system name>"
+# ────────────────────────────────────────────────
+
+class TopologyGraph:
+    """Undirected adjacency graph with BFS-based path, impact and orphan queries."""
+
+    def __init__(self):
+        self.adj = defaultdict(dict)   # node -> {neighbor_node: [(local_port, remote_port), ...]}
+        self.labels = {}               # node -> hostname
+        self._by_name = {}             # lower(hostname) -> node
+        self.link_count = 0
+
+    # ── Build ─────────────────────────────────
+    @classmethod
+    def from_links(cls, nodes, links):
+        """
+        nodes: topology_nodes docs ({ip, hostname})
+        links: topology_links docs ({device_ip, local_port, neighbor, remote_port, mgmt_ip})
+        """
+        g = cls()
+        for n in nodes:
+            g._add_node(n['ip'], n.get('hostname') or n['ip'])
+        for l in links:
+            g._add_node(l['device_ip'], l.get('device_hostname') or g.labels.get(l['device_ip']) or l['device_ip'])
+        for l in links:
+            u = l['device_ip']
+            v = g._resolve_neighbor(l.get('mgmt_ip'), l.get('neighbor'))
+            if not v or v == u:
+                continue
+            if v not in g.labels:
+                g.labels[v] = l.get('neighbor') or v
+                if l.get('neighbor'):
+                    g._by_name.setdefault(l['neighbor'].lower(), v)
+            lp, rp = l.get('local_port', ''), l.get('remote_port', '')
+            ports = g.adj[u].setdefault(v, [])
+            if (lp, rp) in ports:
+                continue   # link เดียวกันที่เห็นจากทั้งสองฝั่ง
+            ports.append((lp, rp))
+            g.adj[v].setdefault(u, []).append((rp, lp))
+            g.link_count += 1
+        return g
+
+    def _add_node(self, node, label):
+        self.adj.setdefault(node, {})
+        if node not in self.labels or self.labels[node] == node:
+            self.labels[node] = label
+        if label:
+            self._by_name.setdefault(label.lower(), node)
+
+    def _resolve_neighbor(self, mgmt_ip, name):
+        if mgmt_ip and mgmt_ip in self.adj:
+            return mgmt_ip
+        if name and name.lower() in self._by_name:
+            return self._by_name[name.lower()]
+        if mgmt_ip:
+            return mgmt_ip
+        return f"name:{name}" if name else None
+
+    def resolve(self, ref):
+        """Find a node by IP, node id or hostname (case-insensitive)."""
+        if not ref:
+            return None
+        if ref in self.adj:
+            return ref
+        return self._by_name.get(ref.lower())
+
+    # ── Queries ───────────────────────────────
+    def shortest_path(self, src, dst):
+        """Hop list from src to dst (BFS, unweighted), or None when disconnected."""
+        if src not in self.adj or dst not in self.adj:
+            return None
+        prev = {src: None}
+        q = deque([src])
+        while q:
+            u = q.popleft()
+            if u == dst:
+                break
+            for v in self.adj[u]:
+                if v not in prev:
+                    prev[v] = u
+                    q.append(v)
+        if dst not in prev:
+            return None
+
+        path = []
+        node = dst
+        while node is not None:
+            path.append(node)
+            node = prev[node]
+        path.reverse()
+
+        hops = []
+        for i, node in enumerate(path):
+            hop = {'node': node, 'hostname': self.labels.get(node, node)}
+            if i + 1 < len(path):
+                out_port, in_port = self.adj[node][path[i + 1]][0]
+                hop['egress_port'] = out_port
+                hop['next_ingress_port'] = in_port
+            hops.append(hop)
+        return hops
+
+    def _reachable(self, start, removed_node=None, removed_edges=()):
+        seen = {start}
+        q = deque([start])
+        cut = set(removed_edges)
+        while q:
+            u = q.popleft()
+            for v in self.adj[u]:
+                if v in seen or v == removed_node or (u, v) in cut or (v, u) in cut:
+                    continue
+                seen.add(v)
+                q.append(v)
+        return seen
+
+    def default_root(self, exclude=None):
+        """Highest-degree node — usually the core switch."""
+        candidates = [n for n in self.adj if n != exclude]
+        if not candidates:
+            return None
+        return max(candidates, key=lambda n: (len(self.adj[n]), n))
+
+    def blast_radius(self, device, port=None, root=None):
+        """
+        Nodes that lose their path to `root` when `device` fails
+        (or only the link(s) on `port` of that device, when port is given).
+        """
+        if device not in self.adj:
+            return None
+        excluded = None if port else device
+        if root not in self.adj or root == excluded:
+            root = self.default_root(exclude=excluded)
+        if root is None:
+            return {'root': None, 'affected': []}
+
+        if port:
+            # ตัดเฉพาะ neighbor ที่ทุก link ไปถึงอยู่บน port นี้ (มี link สำรองถือว่ายังไม่หลุด)
+            edges = [(device, v) for v, ports in self.adj[device].items()
+                     if ports and all(lp == port for lp, _ in ports)]
+            reached = self._reachable(root, removed_edges=edges)
+        else:
+            reached = self._reachable(root, removed_node=device)
+
+        affected = sorted(n for n in self.adj if n not in reached and n != excluded)
+        return {
+            'root': root,
+            'affected': [{'node': n, 'hostname': self.labels.get(n, n)} for n in affected],
+        }
+
+    def orphans(self, inventory_ips):
+        """
+        isolated:  inventory devices with no adjacency at all
+        unmanaged: neighbors seen via LLDP that are not in the inventory
+        """
+        inventory_ips = set(inventory_ips)
+        isolated = sorted(ip for ip in inventory_ips if not self.adj.get(ip))
+        unmanaged = sorted(n for n in self.adj if n not in inventory_ips and self.adj[n])
+        return {
+            'isolated': [{'node': n, 'hostname': self.labels.get(n, n)} for n in isolated],
+            'unmanaged': [{'node': n, 'hostname': self.labels.get(n, n)} for n in unmanaged],
+        }
+
+    def to_dict(self):
+        edges = []
+        for u, nbrs in self.adj.items():
+            for v, ports in nbrs.items():
+                if u < v:
+                    for lp, rp in ports:
+                        edges.append({'source': u, 'target': v, 'source_port': lp, 'target_port': rp})
+        return {
+            'nodes': [{'id': n, 'hostname': self.labels.get(n, n), 'degree': len(self.adj[n])} for n in self.adj],
+            'edges': edges,
+        }
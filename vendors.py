@@ -0,0 +1,261 @@
+import re
+from dataclasses import dataclass
+from functools import lru_cache
+from typing import Optional
+
+
+# ────────────────────────────────────────────────
+#   Vendor profile registry
+#   ทุก module ถาม vendor ผ่าน resolve_vendor(device_type) ที่นี่ที่เดียว
+#   แทน chain ของ "cisco" in dtype / "hp" in dtype ที่เคยกระจายอยู่หลายไฟล์
+# ────────────────────────────────────────────────
+
+@dataclass(frozen=True)
+class VendorProfile:
+    name: str
+    match: tuple                        # substring ของ netmiko device_type (ตัวที่ยาวที่สุดที่ match ชนะ)
+    syntax: str                         # ตระกูล CLI: ios | procurve | comware | juniper | fortinet
+    running_config: str
+    backup_commands: tuple              # ((section name, command), ...)
+    save_command: Optional[str] = None
+    lldp_command: Optional[str] = None
+    lldp_format: Optional[str] = None   # key ใน lldp_parser.FORMATS
+    serial_command: Optional[str] = None
+    rollback: Optional[str] = None      # 'configure_replace' | 'configuration_replace' | None (= inverse commands)
+    vlan_style: Optional[str] = None    # รูปแบบ config ของ generate_bulk_vlan_config
+    pipelining: bool = True             # รับคำสั่งต่อเนื่องได้โดยไม่ต้องรอ prompt (netmiko fast_cli)
+    prompt: str = r'^[<\[]?(?P<name>[^>\]#$]+)'
+    sys_desc_keywords: tuple = ()       # คำใน LLDP system description ที่บอกว่าเป็น vendor นี้
+    default_device_type: str = ''
+
+    @property
+    def negate(self) -> str:
+        return 'undo ' if self.syntax == 'comware' else 'no '
+
+    @property
+    def exit_command(self) -> str:
+        return 'quit' if self.syntax == 'comware' else 'exit'
+
+    def hostname_from_prompt(self, prompt: str) -> str:
+        m = re.match(self.prompt, (prompt or '').strip())
+        return m.group('name').strip() if m else (prompt or '').strip()
+
+
+VENDORS = {}
+_ORDER = []
+
+
+def register(profile: VendorProfile):
+    """Add (or replace) a vendor; new vendors plug in here without touching task code."""
+    if profile.name not in VENDORS:
+        _ORDER.append(profile.name)
+    VENDORS[profile.name] = profile
+    resolve_vendor.cache_clear()
+    return profile
+
+
+@lru_cache(maxsize=None)
+def resolve_vendor(device_type: str) -> VendorProfile:
+    """netmiko device_type → VendorProfile (cached; longest matching substring wins)."""
+    dtype = (device_type or '').lower()
+    best, best_len = VENDORS['default'], 0
+    for name in _ORDER:
+        for needle in VENDORS[name].match:
+            if needle in dtype and len(needle) > best_len:
+                best, best_len = VENDORS[name], len(needle)
+    return best
+
+
+def guess_device_type(sys_desc: str, fallback: str) -> str:
+    """Best-effort netmiko device_type from an LLDP system description."""
+    d = (sys_desc or '').lower()
+    best, best_len = None, 0
+    for name in _ORDER:
+        p = VENDORS[name]
+        for kw in p.sys_desc_keywords:
+            # เท่ากันให้ตัวที่ register ทีหลัง (เฉพาะกว่า) ชนะ เช่น 'nx-os' ชนะ 'cisco'
+            if kw in d and len(kw) >= best_len:
+                best, best_len = p, len(kw)
+    return best.default_device_type if best else fallback
+
+
+_IOS_STATE = (
+    ("Interface Status", "show ip interface brief"),
+    ("MAC Address Table", "show mac address-table"),
+    ("ARP Table", "show ip arp"),
+    ("Routing Table", "show ip route"),
+)
+
+register(VendorProfile(
+    name='default', match=(), syntax='ios',
+    running_config='show running-config',
+    backup_commands=(("Running Configuration", "show running-config"),),
+    lldp_command='show lldp neighbors detail', lldp_format='ios', serial_command='show version',
+    default_device_type='cisco_ios',
+))
+
+register(VendorProfile(
+    name='cisco_ios', match=('cisco',), syntax='ios',
+    running_config='show running-config',
+    backup_commands=(
+        ("Running Configuration", "show running-config"),
+        ("Version & Uptime", "show version"),
+        _IOS_STATE[0],
+        ("LLDP Neighbors", "show lldp neighbors"),
+        ("CDP Neighbors", "show cdp neighbors detail"),
+        *_IOS_STATE[1:],
+    ),
+    save_command='write memory',
+    lldp_command='show lldp neighbors detail', lldp_format='ios', serial_command='show version',
+    rollback='configure_replace', vlan_style='ios',
+    prompt=r'^(?P<name>[^#>]+)[#>]',
+    sys_desc_keywords=('cisco',), default_device_type='cisco_ios',
+))
+
+register(VendorProfile(
+    name='cisco_nxos', match=('cisco_nxos', 'nxos'), syntax='ios',
+    running_config='show running-config',
+    backup_commands=(
+        ("Running Configuration", "show running-config"),
+        ("Version & Uptime", "show version"),
+        _IOS_STATE[0],
+        ("LLDP Neighbors", "show lldp neighbors detail"),
+        ("CDP Neighbors", "show cdp neighbors detail"),
+        *_IOS_STATE[1:],
+    ),
+    save_command='copy running-config startup-config',
+    lldp_command='show lldp neighbors detail', lldp_format='ios', serial_command='show version',
+    vlan_style='ios',
+    prompt=r'^(?P<name>[^#>]+)[#>]',
+    sys_desc_keywords=('nx-os',), default_device_type='cisco_nxos',
+))
+
+register(VendorProfile(
+    name='aruba', match=('aruba',), syntax='ios',
+    running_config='show running-config',
+    backup_commands=(
+        ("Running Configuration", "show running-config"),
+        ("Version & Uptime", "show version"),
+        _IOS_STATE[0],
+        ("LLDP Neighbors", "show lldp neighbors detail"),
+        ("CDP Neighbors", "show cdp neighbors detail"),
+        *_IOS_STATE[1:],
+    ),
+    save_command='write memory',
+    lldp_command='show lldp neighbors detail', lldp_format='ios', serial_command='show version',
+    vlan_style='ios',
+    prompt=r'^(?P<name>[^#>]+)[#>]',
+    default_device_type='aruba_os',
+))
+
+register(VendorProfile(
+    name='aruba_aoscx', match=('aruba_aoscx', 'aoscx'), syntax='ios',
+    running_config='show running-config',
+    backup_commands=(
+        ("Running Configuration", "show running-config"),
+        ("Version & Uptime", "show version"),
+        _IOS_STATE[0],
+        ("LLDP Neighbors", "show lldp neighbor-info detail"),
+        ("MAC Address Table", "show mac-address-table"),
+        ("ARP Table", "show arp"),
+        ("Routing Table", "show ip route"),
+    ),
+    save_command='write memory',
+    lldp_command='show lldp neighbor-info detail', lldp_format='aoscx', serial_command='show system',
+    vlan_style='ios',
+    prompt=r'^(?P<name>[^#>]+)[#>]',
+    sys_desc_keywords=('arubaos-cx', 'aos-cx'), default_device_type='aruba_aoscx',
+))
+
+register(VendorProfile(
+    name='hp_procurve', match=('hp_procurve', 'provision', 'aruba_osswitch'), syntax='procurve',
+    running_config='show running-config',
+    backup_commands=(
+        ("Running Configuration", "show running-config"),
+        ("Version & Uptime", "show version"),
+        ("Interface Status", "show interfaces brief"),
+        ("LLDP Neighbors", "show lldp info remote-device detail"),
+        ("MAC Address Table", "show mac-address"),
+        ("ARP Table", "show arp"),
+        ("Routing Table", "show ip route"),
+    ),
+    save_command='write memory',
+    lldp_command='show lldp info remote-device detail', lldp_format='procurve',
+    serial_command='show system information', vlan_style='procurve',
+    prompt=r'^(?P<name>[^#>]+)[#>]',
+    sys_desc_keywords=('procurve', 'arubaos-switch', 'provision'), default_device_type='hp_procurve',
+))
+
+register(VendorProfile(
+    name='ruckus_fastiron', match=('fastiron', 'ruckus'), syntax='ios',
+    running_config='show running-config',
+    backup_commands=(("Running Configuration", "show running-config"),),
+    save_command='write memory',
+    lldp_command='show lldp neighbors detail', lldp_format='ruckus', serial_command='show version',
+    prompt=r'^(?:SSH@)?(?P<name>[^#>]+)[#>]',
+    sys_desc_keywords=('ruckus', 'icx', 'fastiron'), default_device_type='ruckus_fastiron',
+))
+
+_COMWARE_BACKUP = (
+    ("Current Configuration", "display current-configuration"),
+    ("Version & Uptime", "display version"),
+    ("Interface Status", "display ip interface brief"),
+    ("LLDP Neighbors", "display lldp neighbor-information verbose"),
+    ("MAC Address Table", "display mac-address"),
+    ("ARP Table", "display arp"),
+    ("Routing Table", "display ip routing-table"),
+)
+
+register(VendorProfile(
+    name='hp_comware', match=('hp_comware', 'comware', 'hp'), syntax='comware',
+    running_config='display current-configuration',
+    backup_commands=_COMWARE_BACKUP,
+    save_command='save force',
+    lldp_command='display lldp neighbor-information verbose', lldp_format='comware',
+    serial_command='display device manuinfo',
+    rollback='configuration_replace', vlan_style='comware',
+    prompt=r'^[<\[](?P<name>[^>\]]+)[>\]]',
+    sys_desc_keywords=('comware', 'h3c'), default_device_type='hp_comware',
+))
+
+register(VendorProfile(
+    name='huawei', match=('huawei',), syntax='comware',
+    running_config='display current-configuration',
+    backup_commands=_COMWARE_BACKUP,
+    save_command='save force',
+    lldp_command='display lldp neighbor-information verbose', lldp_format='comware',
+    serial_command='display device manuinfo',
+    vlan_style='comware',
+    prompt=r'^[<\[](?P<name>[^>\]]+)[>\]]',
+    sys_desc_keywords=('huawei', 'vrp'), default_device_type='huawei',
+))
+
+register(VendorProfile(
+    name='juniper', match=('juniper',), syntax='juniper',
+    running_config='show configuration',
+    backup_commands=(
+        ("Configuration", "show configuration"),
+        ("Version & Uptime", "show version"),
+        ("Interface Status", "show interfaces terse"),
+        ("LLDP Neighbors", "show lldp neighbors"),
+        ("ARP Table", "show arp"),
+        ("Routing Table", "show route"),
+    ),
+    prompt=r'^(?:\S+@)?(?P<name>[^>#%]+)[>#%]',
+    sys_desc_keywords=('junos', 'juniper'), default_device_type='juniper_junos',
+))
+
+register(VendorProfile(
+    name='fortinet', match=('fortinet',), syntax='fortinet',
+    running_config='show full-configuration',
+    backup_commands=(
+        ("Full Configuration", "show full-configuration"),
+        ("System Status", "get system status"),
+        ("Interface Status", "get system interface physical"),
+        ("ARP Table", "get system arp"),
+        ("Routing Table", "get router info routing-table all"),
+    ),
+    pipelining=False,                   # FortiOS ช้าตอนสลับ context, fast_cli ทำ output หลุด
+    prompt=r'^(?P<name>[^#$ ]+)\s*(?:\([^)]*\))?\s*[#$]',
+    sys_desc_keywords=('fortigate', 'fortinet'), default_device_type='fortinet',
+))
@@ -0,0 +1,108 @@
+import json
+import os
+import threading
+import zlib
+
+try:
+    import zstandard as zstd
+    HAS_ZSTD = True
+except ImportError:
+    HAS_ZSTD = False
+
+
+# ────────────────────────────────────────────────
+#   Agent ↔ Server wire format
+#   payload ใหญ่กว่า threshold จะถูกบีบอัดแล้วส่งเป็น binary attachment
+#   แทนการส่ง JSON string ตรงๆ (Socket.IO รองรับ bytes ใน payload อยู่แล้ว)
+# ────────────────────────────────────────────────
+
+ENVELOPE_KEY = '_wire'
+COMPRESS_THRESHOLD = int(os.getenv('WIRE_COMPRESS_THRESHOLD', str(16 * 1024)))
+
+
+def supported_codecs():
+    """Codecs this side can decode, most preferred first."""
+    return ['zstd', 'zlib'] if HAS_ZSTD else ['zlib']
+
+
+def negotiate(offered):
+    """Pick the best codec both sides support (None = send plain JSON)."""
+    offered = offered or []
+    for codec in supported_codecs():
+        if codec in offered:
+            return codec
+    return None
+
+
+def _compress(codec, raw: bytes) -> bytes:
+    if codec == 'zstd':
+        return zstd.ZstdCompressor(level=3).compress(raw)
+    return zlib.compress(raw, 6)
+
+
+def _decompress(codec, body: bytes) -> bytes:
+    if codec == 'zstd':
+        return zstd.ZstdDecompressor().decompress(body)
+    if codec == 'zlib':
+        return zlib.decompress(body)
+    raise ValueError(f"Unsupported wire codec: {codec}")
+
+
+class WireStats:
+    """Thread-safe counters comparing JSON size vs bytes actually put on the wire."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._data = {}
+
+    def record(self, direction, raw_bytes, wire_bytes, compressed):
+        with self._lock:
+            d = self._data.setdefault(direction, {
+                'messages': 0, 'compressed_messages': 0,
+                'raw_bytes': 0, 'wire_bytes': 0,
+            })
+            d['messages'] += 1
+            d['compressed_messages'] += 1 if compressed else 0
+            d['raw_bytes'] += raw_bytes
+            d['wire_bytes'] += wire_bytes
+
+    def snapshot(self):
+        with self._lock:
+            out = {}
+            for direction, d in self._data.items():
+                out[direction] = dict(d)
+                out[direction]['ratio'] = round(d['wire_bytes'] / d['raw_bytes'], 3) if d['raw_bytes'] else 1.0
+            return out
+
+    def summary(self):
+        parts = []
+        for direction, d in self.snapshot().items():
+            parts.append(f"{direction} {d['raw_bytes'] / 1e6:.2f}MB → {d['wire_bytes'] / 1e6:.2f}MB")
+        return "  |  ".join(parts) or "no traffic"
+
+
+def pack(payload: dict, codec, threshold=COMPRESS_THRESHOLD, stats=None, direction='out'):
+    """Wrap payload in a compressed envelope when a codec is negotiated and it is large enough."""
+    raw = json.dumps(payload, default=str, ensure_ascii=False).encode('utf-8')
+    if not codec or len(raw) < threshold:
+        if stats:
+            stats.record(direction, len(raw), len(raw), False)
+        return payload
+    body = _compress(codec, raw)
+    if stats:
+        stats.record(direction, len(raw), len(body), True)
+    return {ENVELOPE_KEY: codec, 'size': len(raw), 'data': body}
+
+
+def unpack(message, stats=None, direction='in'):
+    """Inverse of pack(); plain (uncompressed) messages are returned unchanged."""
+    if not isinstance(message, dict) or ENVELOPE_KEY not in message:
+        if stats:
+            size = len(json.dumps(message, default=str, ensure_ascii=False).encode('utf-8'))
+            stats.record(direction, size, size, False)
+        return message
+    body = message['data']
+    raw = _decompress(message[ENVELOPE_KEY], body)
+    if stats:
+        stats.record(direction, len(raw), len(body), True)
+    return json.loads(raw)